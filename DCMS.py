@@ -1,47 +1,13 @@
 import tkinter as tk
+from collections import deque
 from tkinter import messagebox, ttk
-import sqlite3
-import pandas as pd
-from openpyxl import Workbook
+from changefeed import POLL_INTERVAL
+from services import clinic
+from pagination import SortableHeadings, VirtualTreeview
 
 # Database Setup
 def setup_database():
-    conn = sqlite3.connect('dental_clinic.db')
-    c = conn.cursor()
-    
-    # Create Patients table
-    c.execute('''CREATE TABLE IF NOT EXISTS patients (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    age INTEGER,
-                    gender TEXT,
-                    contact TEXT
-                )''')
-    
-    # Create Appointments table
-    c.execute('''CREATE TABLE IF NOT EXISTS appointments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    date TEXT,
-                    time TEXT,
-                    description TEXT,
-                    FOREIGN KEY (patient_id) REFERENCES patients (id)
-                )''')
-    
-    # Create Billing table
-    c.execute('''CREATE TABLE IF NOT EXISTS billing (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    date TEXT,
-                    amount REAL,
-                    description TEXT,
-                    FOREIGN KEY (patient_id) REFERENCES patients (id)
-                )''')
-    
-    conn.commit()
-    conn.close()
-
-setup_database()
+    clinic.setup()
 
 # Main Application
 class DentalClinicApp:
@@ -66,10 +32,51 @@ class DentalClinicApp:
 
         self.tab_control.pack(expand=1, fill='both')
 
-        self.create_patients_tab()
-        self.create_appointments_tab()
-        self.create_billing_tab()
-        self.create_reports_tab()
+        # Each tab is built, and its first page loaded, when first selected
+        self.tab_builders = {
+            str(self.tab_patients): self.create_patients_tab,
+            str(self.tab_appointments): self.create_appointments_tab,
+            str(self.tab_billing): self.create_billing_tab,
+            str(self.tab_reports): self.create_reports_tab,
+        }
+        self.tab_control.bind('<<NotebookTabChanged>>', self.build_selected_tab)
+        self.build_selected_tab()
+
+        # Rows changed by writes, reported on the thread that committed them
+        # and patched into the lists by show_changes on the main thread.
+        # Changes from other workstations are polled for every half second.
+        self.changes = deque()
+        clinic.repository.subscribe(self.row_changed)
+        self.poll_changes()
+
+    def build_selected_tab(self, event=None):
+        build = self.tab_builders.pop(self.tab_control.select(), None)
+        if build is not None:
+            build()
+
+    LISTS = {'patients': 'patient_view', 'appointments': 'appointment_view', 'billing': 'billing_view'}
+
+    def row_changed(self, table, row_id, row):
+        if table in self.LISTS:
+            self.changes.append((table, row_id, row))
+
+    def poll_changes(self):
+        try:
+            clinic.changes.poll()
+            self.show_changes()
+        finally:
+            self.root.after(int(POLL_INTERVAL * 1000), self.poll_changes)
+
+    def show_changes(self):
+        while self.changes:
+            table, row_id, row = self.changes.popleft()
+            view = getattr(self, self.LISTS[table], None)
+            if view is None:
+                continue
+            if row_id is None:
+                view.reload()
+            else:
+                view.apply(row_id, row)
 
     def create_patients_tab(self):
         # Patient Management Widgets
@@ -109,12 +116,14 @@ class DentalClinicApp:
 
         # Add vertical scrollbar to the treeview
         self.patient_tree_scrollbar = ttk.Scrollbar(self.patients_frame, orient='vertical', command=self.patient_tree.yview)
-        self.patient_tree.configure(yscroll=self.patient_tree_scrollbar.set)
+        self.patient_view = VirtualTreeview(self.patient_tree, self.patient_tree_scrollbar, clinic.patients.view().page)
+        self.patient_sorting = SortableHeadings(self.patient_view, clinic.patients.view, {'ID': 'id', 'Name': 'name', 'Age': 'age'})
         self.patient_tree_scrollbar.grid(row=5, column=4, sticky='ns')
 
         # Configure grid weights for the treeview to expand correctly
         self.patients_frame.grid_rowconfigure(5, weight=1)
         self.patients_frame.grid_columnconfigure(1, weight=1)
+        self.view_patients()
 
     def create_appointments_tab(self):
         # Appointment Management Widgets
@@ -144,22 +153,26 @@ class DentalClinicApp:
         tk.Button(self.appointments_frame, text="View Appointments", command=self.view_appointments).grid(row=4, column=3, padx=10, pady=10, sticky='w')
 
         # Treeview
-        self.appointment_tree = ttk.Treeview(self.appointments_frame, columns=("ID", "Patient ID", "Date", "Time", "Description"), show='headings')
+        self.appointment_tree = ttk.Treeview(self.appointments_frame, columns=("ID", "Patient ID", "Date", "Time", "Description", "Duration", "Chair"), show='headings')
         self.appointment_tree.heading("ID", text="ID")
         self.appointment_tree.heading("Patient ID", text="Patient ID")
         self.appointment_tree.heading("Date", text="Date")
         self.appointment_tree.heading("Time", text="Time")
         self.appointment_tree.heading("Description", text="Description")
+        self.appointment_tree.heading("Duration", text="Duration")
+        self.appointment_tree.heading("Chair", text="Chair")
         self.appointment_tree.grid(row=5, column=0, columnspan=4, padx=10, pady=10, sticky='nsew')
 
         # Add vertical scrollbar to the treeview
         self.appointment_tree_scrollbar = ttk.Scrollbar(self.appointments_frame, orient='vertical', command=self.appointment_tree.yview)
-        self.appointment_tree.configure(yscroll=self.appointment_tree_scrollbar.set)
+        self.appointment_view = VirtualTreeview(self.appointment_tree, self.appointment_tree_scrollbar, clinic.appointments.view().page)
+        self.appointment_sorting = SortableHeadings(self.appointment_view, clinic.appointments.view, {'ID': 'id', 'Patient ID': 'patient_id', 'Date': 'date', 'Time': 'time'})
         self.appointment_tree_scrollbar.grid(row=5, column=4, sticky='ns')
 
         # Configure grid weights for the treeview to expand correctly
         self.appointments_frame.grid_rowconfigure(5, weight=1)
         self.appointments_frame.grid_columnconfigure(1, weight=1)
+        self.view_appointments()
 
     def create_billing_tab(self):
         # Billing Management Widgets
@@ -199,12 +212,14 @@ class DentalClinicApp:
 
         # Add vertical scrollbar to the treeview
         self.billing_tree_scrollbar = ttk.Scrollbar(self.billing_frame, orient='vertical', command=self.billing_tree.yview)
-        self.billing_tree.configure(yscroll=self.billing_tree_scrollbar.set)
+        self.billing_view = VirtualTreeview(self.billing_tree, self.billing_tree_scrollbar, clinic.billing.view().page)
+        self.billing_sorting = SortableHeadings(self.billing_view, clinic.billing.view, {'ID': 'id', 'Patient ID': 'patient_id', 'Date': 'date', 'Amount': 'amount', 'Description': 'description'})
         self.billing_tree_scrollbar.grid(row=5, column=4, sticky='ns')
 
         # Configure grid weights for the treeview to expand correctly
         self.billing_frame.grid_rowconfigure(5, weight=1)
         self.billing_frame.grid_columnconfigure(1, weight=1)
+        self.view_bills()
 
     def create_reports_tab(self):
         # Reporting Widgets
@@ -221,13 +236,13 @@ class DentalClinicApp:
         age = self.patient_age.get()
         gender = self.patient_gender.get()
         contact = self.patient_contact.get()
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('INSERT INTO patients (name, age, gender, contact) VALUES (?, ?, ?, ?)', (name, age, gender, contact))
-        conn.commit()
-        conn.close()
+        try:
+            clinic.patients.add(name, age, gender, contact)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         messagebox.showinfo("Success", "Patient added successfully")
-        self.view_patients()
+        self.show_changes()
 
     def update_patient(self):
         selected_item = self.patient_tree.selection()
@@ -240,13 +255,13 @@ class DentalClinicApp:
         age = self.patient_age.get()
         gender = self.patient_gender.get()
         contact = self.patient_contact.get()
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('UPDATE patients SET name = ?, age = ?, gender = ?, contact = ? WHERE id = ?', (name, age, gender, contact, patient_id))
-        conn.commit()
-        conn.close()
+        try:
+            clinic.patients.update(patient_id, name, age, gender, contact)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         messagebox.showinfo("Success", "Patient updated successfully")
-        self.view_patients()
+        self.show_changes()
 
     def delete_patient(self):
         selected_item = self.patient_tree.selection()
@@ -255,23 +270,12 @@ class DentalClinicApp:
             return
         
         patient_id = self.patient_tree.item(selected_item)['values'][0]
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('DELETE FROM patients WHERE id = ?', (patient_id,))
-        conn.commit()
-        conn.close()
+        clinic.patients.delete(patient_id)
         messagebox.showinfo("Success", "Patient deleted successfully")
-        self.view_patients()
+        self.show_changes()
 
     def view_patients(self):
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('SELECT * FROM patients')
-        patients = c.fetchall()
-        conn.close()
-        self.patient_tree.delete(*self.patient_tree.get_children())
-        for patient in patients:
-            self.patient_tree.insert('', 'end', values=patient)
+        self.patient_view.reload()
 
     # Appointment Management Methods
     def add_appointment(self):
@@ -279,13 +283,13 @@ class DentalClinicApp:
         date = self.appointment_date.get()
         time = self.appointment_time.get()
         description = self.appointment_description.get()
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('INSERT INTO appointments (patient_id, date, time, description) VALUES (?, ?, ?, ?)', (patient_id, date, time, description))
-        conn.commit()
-        conn.close()
+        try:
+            clinic.appointments.add(patient_id, date, time, description)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         messagebox.showinfo("Success", "Appointment scheduled successfully")
-        self.view_appointments()
+        self.show_changes()
 
     def update_appointment(self):
         selected_item = self.appointment_tree.selection()
@@ -293,18 +297,19 @@ class DentalClinicApp:
             messagebox.showwarning("Warning", "Please select an appointment to update")
             return
         
-        appointment_id = self.appointment_tree.item(selected_item)['values'][0]
+        values = self.appointment_tree.item(selected_item)['values']
+        appointment_id, duration, chair = values[0], values[5], values[6]
         patient_id = self.appointment_patient_id.get()
         date = self.appointment_date.get()
         time = self.appointment_time.get()
         description = self.appointment_description.get()
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('UPDATE appointments SET patient_id = ?, date = ?, time = ?, description = ? WHERE id = ?', (patient_id, date, time, description, appointment_id))
-        conn.commit()
-        conn.close()
+        try:
+            clinic.appointments.update(appointment_id, patient_id, date, time, description, duration, chair)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         messagebox.showinfo("Success", "Appointment updated successfully")
-        self.view_appointments()
+        self.show_changes()
 
     def delete_appointment(self):
         selected_item = self.appointment_tree.selection()
@@ -313,23 +318,12 @@ class DentalClinicApp:
             return
         
         appointment_id = self.appointment_tree.item(selected_item)['values'][0]
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('DELETE FROM appointments WHERE id = ?', (appointment_id,))
-        conn.commit()
-        conn.close()
+        clinic.appointments.delete(appointment_id)
         messagebox.showinfo("Success", "Appointment deleted successfully")
-        self.view_appointments()
+        self.show_changes()
 
     def view_appointments(self):
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('SELECT * FROM appointments')
-        appointments = c.fetchall()
-        conn.close()
-        self.appointment_tree.delete(*self.appointment_tree.get_children())
-        for appointment in appointments:
-            self.appointment_tree.insert('', 'end', values=appointment)
+        self.appointment_view.reload()
 
     # Billing Management Methods
     def add_bill(self):
@@ -337,13 +331,13 @@ class DentalClinicApp:
         date = self.bill_date.get()
         amount = self.bill_amount.get()
         description = self.bill_description.get()
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('INSERT INTO billing (patient_id, date, amount, description) VALUES (?, ?, ?, ?)', (patient_id, date, amount, description))
-        conn.commit()
-        conn.close()
+        try:
+            clinic.billing.add(patient_id, date, amount, description)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         messagebox.showinfo("Success", "Bill generated successfully")
-        self.view_bills()
+        self.show_changes()
 
     def update_bill(self):
         selected_item = self.billing_tree.selection()
@@ -356,13 +350,13 @@ class DentalClinicApp:
         date = self.bill_date.get()
         amount = self.bill_amount.get()
         description = self.bill_description.get()
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('UPDATE billing SET patient_id = ?, date = ?, amount = ?, description = ? WHERE id = ?', (patient_id, date, amount, description, bill_id))
-        conn.commit()
-        conn.close()
+        try:
+            clinic.billing.update(bill_id, patient_id, date, amount, description)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         messagebox.showinfo("Success", "Bill updated successfully")
-        self.view_bills()
+        self.show_changes()
 
     def delete_bill(self):
         selected_item = self.billing_tree.selection()
@@ -371,40 +365,24 @@ class DentalClinicApp:
             return
         
         bill_id = self.billing_tree.item(selected_item)['values'][0]
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('DELETE FROM billing WHERE id = ?', (bill_id,))
-        conn.commit()
-        conn.close()
+        clinic.billing.delete(bill_id)
         messagebox.showinfo("Success", "Bill deleted successfully")
-        self.view_bills()
+        self.show_changes()
 
     def view_bills(self):
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('SELECT * FROM billing')
-        bills = c.fetchall()
-        conn.close()
-        self.billing_tree.delete(*self.billing_tree.get_children())
-        for bill in bills:
-            self.billing_tree.insert('', 'end', values=bill)
+        self.billing_view.reload()
 
     # Reporting Methods
     def generate_patient_report(self):
-        conn = sqlite3.connect('dental_clinic.db')
-        patients_df = pd.read_sql_query('SELECT * FROM patients', conn)
-        conn.close()
-        patients_df.to_excel('patient_report.xlsx', index=False)
+        clinic.reports.export('patient')
         messagebox.showinfo("Success", "Patient report generated successfully")
 
     def generate_financial_report(self):
-        conn = sqlite3.connect('dental_clinic.db')
-        billing_df = pd.read_sql_query('SELECT * FROM billing', conn)
-        conn.close()
-        billing_df.to_excel('financial_report.xlsx', index=False)
+        clinic.reports.export('financial')
         messagebox.showinfo("Success", "Financial report generated successfully")
 
 if __name__ == '__main__':
+    setup_database()
     root = tk.Tk()
     app = DentalClinicApp(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,113 @@
+from datetime import date as _date, timedelta
+
+# Financial Analytics
+# Every figure is computed by SQLite, from the trigger-maintained summary
+# tables where possible and otherwise with GROUP BY over the covering billing
+# indexes; only aggregated rows come back to Python. Each function returns a
+# (columns, rows) pair so results can be shown in a Treeview or exported.
+# As in the summary tables, a bill without an amount counts as zero.
+PERIODS = {
+    'day': "day",
+    'week': "strftime('%Y-W%W', day)",
+    'month': "substr(day, 1, 7)",
+    'year': "substr(day, 1, 4)",
+}
+
+
+def _date_range(start, end, column='date'):
+    clauses, params = [], []
+    if start:
+        clauses.append(column + ' >= ?')
+        params.append(start)
+    if end:
+        clauses.append(column + ' <= ?')
+        params.append(end)
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+# Weeks, months and years are rolled up from the per-day summary rows
+def revenue_by_period(conn, period='month', start=None, end=None):
+    where, params = _date_range(start, end, 'day')
+    rows = conn.execute('''SELECT {period} AS period, SUM(bills), ROUND(SUM(revenue_cents) / 100.0, 2),
+                                  ROUND(SUM(revenue_cents) / 100.0 / SUM(bills), 2)
+                           FROM billing_daily{where}
+                           GROUP BY period ORDER BY period'''.format(period=PERIODS[period], where=where), params).fetchall()
+    return ('Period', 'Bills', 'Revenue', 'Average Bill'), rows
+
+
+def revenue_by_patient(conn, start=None, end=None, limit=100):
+    if not start and not end:
+        rows = conn.execute('''SELECT s.patient_id, p.name, s.bills, ROUND(s.revenue_cents / 100.0, 2),
+                                      ROUND(s.revenue_cents / 100.0 / s.bills, 2), s.last_date
+                               FROM billing_patient s LEFT JOIN patients p ON p.id = s.patient_id
+                               ORDER BY s.revenue_cents DESC LIMIT ?''', (limit,)).fetchall()
+        return ('Patient ID', 'Name', 'Bills', 'Total', 'Average Bill', 'Last Bill'), rows
+    where, params = _date_range(start, end)
+    rows = conn.execute('''SELECT b.patient_id, p.name, b.bills, b.total, b.average, b.last_date
+                           FROM (SELECT patient_id, COUNT(*) AS bills, ROUND(SUM(IFNULL(amount, 0)), 2) AS total,
+                                        ROUND(AVG(IFNULL(amount, 0)), 2) AS average, MAX(date) AS last_date
+                                 FROM billing{where} GROUP BY patient_id) b
+                           LEFT JOIN patients p ON p.id = b.patient_id
+                           ORDER BY b.total DESC LIMIT ?'''.format(where=where), params + [limit]).fetchall()
+    return ('Patient ID', 'Name', 'Bills', 'Total', 'Average Bill', 'Last Bill'), rows
+
+
+# Billed amounts per patient split into age buckets (0-30, 31-60, 61-90 and
+# over 90 days old), the usual shape of an accounts-receivable aging report.
+# Bucket edges are computed once so each bill is a plain string comparison.
+def aging_summary(conn, as_of=None, limit=100):
+    as_of = _date.fromisoformat(as_of) if as_of else _date.today()
+    edges = [(as_of - timedelta(days=days)).isoformat() for days in (30, 60, 90)]
+    rows = conn.execute('''SELECT b.patient_id, p.name, b.current, b.days_31_60, b.days_61_90, b.over_90, b.total
+                           FROM (SELECT patient_id,
+                                        ROUND(SUM(CASE WHEN date >= ? THEN IFNULL(amount, 0) ELSE 0 END), 2) AS current,
+                                        ROUND(SUM(CASE WHEN date < ? AND date >= ? THEN IFNULL(amount, 0) ELSE 0 END), 2) AS days_31_60,
+                                        ROUND(SUM(CASE WHEN date < ? AND date >= ? THEN IFNULL(amount, 0) ELSE 0 END), 2) AS days_61_90,
+                                        ROUND(SUM(CASE WHEN date < ? THEN IFNULL(amount, 0) ELSE 0 END), 2) AS over_90,
+                                        ROUND(SUM(IFNULL(amount, 0)), 2) AS total
+                                 FROM billing WHERE date <= ?
+                                 GROUP BY patient_id) b
+                           LEFT JOIN patients p ON p.id = b.patient_id
+                           ORDER BY b.total DESC LIMIT ?''',
+                        (edges[0], edges[0], edges[1], edges[1], edges[2], edges[2], as_of.isoformat(), limit)).fetchall()
+    return ('Patient ID', 'Name', '0-30 Days', '31-60 Days', '61-90 Days', 'Over 90 Days', 'Total'), rows
+
+
+def top_procedures(conn, start=None, end=None, limit=20):
+    where, params = _date_range(start, end)
+    groups = conn.execute('SELECT description, COUNT(*), SUM(IFNULL(amount, 0)) FROM billing{} GROUP BY description'.format(where), params).fetchall()
+    # Fold spelling variants ("x-ray", "X-Ray ") together; this loops over
+    # distinct descriptions, not over bills.
+    procedures = {}
+    for description, count, revenue in groups:
+        key = (description or '').strip().lower()
+        name, total_count, total_revenue = procedures.get(key, (description, 0, 0.0))
+        procedures[key] = (name, total_count + count, total_revenue + revenue)
+    ranked = sorted(procedures.values(), key=lambda item: item[2], reverse=True)[:limit]
+    rows = [(name, count, round(revenue, 2), round(revenue / count, 2)) for name, count, revenue in ranked]
+    return ('Procedure', 'Count', 'Revenue', 'Average Price'), rows
+
+
+def totals(conn, start=None, end=None):
+    where, params = _date_range(start, end, 'day')
+    bills, cents, first, last = conn.execute('SELECT COALESCE(SUM(bills), 0), COALESCE(SUM(revenue_cents), 0), MIN(day), MAX(day) FROM billing_daily{}'.format(where), params).fetchone()
+    if not start and not end:
+        patients = conn.execute('SELECT COUNT(*) FROM billing_patient').fetchone()[0]
+    else:
+        where, params = _date_range(start, end)
+        patients = conn.execute('SELECT COUNT(*) FROM (SELECT patient_id FROM billing{} GROUP BY patient_id)'.format(where), params).fetchone()[0]
+    revenue = cents / 100.0
+    average = round(revenue / bills, 2) if bills else 0
+    return ('Bills', 'Patients', 'Revenue', 'Average Bill', 'First Bill', 'Last Bill'), [(bills, patients, round(revenue, 2), average, first, last)]
+
+
+ANALYSES = {
+    'Daily Revenue': lambda conn, start=None, end=None: revenue_by_period(conn, 'day', start, end),
+    'Weekly Revenue': lambda conn, start=None, end=None: revenue_by_period(conn, 'week', start, end),
+    'Monthly Revenue': lambda conn, start=None, end=None: revenue_by_period(conn, 'month', start, end),
+    'Yearly Revenue': lambda conn, start=None, end=None: revenue_by_period(conn, 'year', start, end),
+    'Revenue by Patient': revenue_by_patient,
+    'Aging Summary': lambda conn, start=None, end=None: aging_summary(conn, end),
+    'Top Procedures': top_procedures,
+    'Totals': totals,
+}
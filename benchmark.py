@@ -0,0 +1,327 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from analytics import ANALYSES
+from credentials import SCRYPT_N, SCRYPT_P, SCRYPT_R, hash_password
+from database import ConnectionPool
+from datagen import SCALES, SEED, generate, table_sizes
+from scheduling import week_start
+from services import Clinic
+
+# Benchmark Suite
+# Times every query path the application uses (page loads, searches, logins,
+# writes, free-slot lookups, analytics, exports and imports) against a
+# synthetic database generated from a fixed seed, so runs are comparable.
+# Each run works on a fresh copy of the generated database, so the writes and
+# imports it times never leave traces that would slow down the next run.
+# Results are written as JSON and can be compared with a stored baseline;
+# the run fails when a scenario's median gets slower than the tolerance.
+REPEAT = 20
+SLOW_REPEAT = 3
+BILL_RUN = 500
+TOLERANCE = 0.25
+# Differences below this are timer noise, whatever the ratio
+NOISE_MS = 0.05
+
+
+class Scenario:
+    def __init__(self, name, run, repeat=REPEAT, teardown=None):
+        self.name = name
+        self.run = run
+        self.repeat = repeat
+        self.teardown = teardown
+
+
+def measure(scenario, warmup=1):
+    for _ in range(warmup):
+        scenario.run()
+        if scenario.teardown:
+            scenario.teardown()
+    times, result = [], None
+    for _ in range(scenario.repeat):
+        started = time.perf_counter()
+        result = scenario.run()
+        times.append((time.perf_counter() - started) * 1000)
+        if scenario.teardown:
+            scenario.teardown()
+    times.sort()
+    return {
+        'repeat': scenario.repeat,
+        'min_ms': round(times[0], 4),
+        'median_ms': round(statistics.median(times), 4),
+        'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 4),
+        'mean_ms': round(statistics.fmean(times), 4),
+        'rows': len(result) if isinstance(result, (list, tuple)) else getattr(result, 'imported', None),
+    }
+
+
+def _extent(pool, table):
+    low, high = pool.fetchone('SELECT MIN(id), MAX(id) FROM {}'.format(table))
+    return low or 0, high or 0
+
+
+def _write_import_file(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(('name', 'age', 'gender', 'contact'))
+        for index in range(rows):
+            writer.writerow(('Import Patient {}'.format(index), 20 + index % 60, ('Male', 'Female', 'Other')[index % 3], '556-{:07d}'.format(index)))
+
+
+def scenarios(clinic, workdir, formats=('csv',), import_rows=10000):
+    pool = clinic.pool
+    found = []
+
+    # Page loads, the way the Treeviews scroll: first, middle and last page
+    for name, service, table in (('patients', clinic.patients, 'patients'),
+                                 ('appointments', clinic.appointments, 'appointments'),
+                                 ('bills', clinic.billing, 'billing')):
+        low, high = _extent(pool, table)
+        found.append(Scenario('view_{}_first_page'.format(name), lambda s=service: s.page(limit=100)))
+        found.append(Scenario('view_{}_middle_page'.format(name), lambda s=service, m=(low + high) // 2: s.page(after_id=m, limit=100)))
+        found.append(Scenario('view_{}_last_page'.format(name), lambda s=service, h=high: s.page(before_id=h + 1, limit=100)))
+
+    # Sorted and filtered views: the first page, and a page from the middle
+    # continuing after a row found once up front
+    _, bills = _extent(pool, 'billing')
+    for name, order_by, descending, filters in (('bills_by_amount', 'amount', True, {}),
+                                                ('bills_by_date', 'date', False, {}),
+                                                ('bills_by_description', 'description', False, {}),
+                                                ('bills_filtered', 'date', True, {'amount_from': 500, 'date_from': '2021-01-01'})):
+        view = clinic.billing.view(order_by, descending, **filters)
+        middle = pool.fetchone('SELECT {} FROM billing ORDER BY {}{} LIMIT 1 OFFSET ?'.format(
+            ', '.join(clinic.repository.COLUMNS['billing']), order_by, ' DESC' if descending else ''), (bills // 2,))
+        found.append(Scenario('view_{}_first_page'.format(name), lambda v=view: v.page(limit=100)))
+        found.append(Scenario('view_{}_middle_page'.format(name), lambda v=view, m=middle: v.page(after=m, limit=100)))
+
+    _, high = _extent(pool, 'patients')
+    middle_patient = str(max(high // 2, 1))
+    # Searches go to SQLite directly; repeated ones are served from the search
+    # caches and timed separately below. search_patients_typed is one search
+    # per keystroke while typing a name into an empty cache, as the Patients
+    # tab does when typing pauses after every letter.
+    repository = clinic.repository
+    token, _ = clinic.users.login('admin', 'admin')
+
+    def type_search(term):
+        clinic.patient_cache.searches.clear()
+        for end in range(1, len(term) + 1):
+            clinic.patients.search(term[:end])
+    found += [
+        Scenario('search_patients_common_name', lambda: repository.search_patients('smi')),
+        Scenario('search_patients_full_name', lambda: repository.search_patients('priya sharma')),
+        Scenario('search_patients_contact', lambda: repository.search_patients('555-0001234')),
+        Scenario('search_patients_id', lambda: repository.search_patients(middle_patient)),
+        Scenario('search_patients_cached', lambda: clinic.patients.search('smi')),
+        Scenario('search_patients_typed', lambda: type_search('priya sharma')),
+        Scenario('get_patient', lambda: repository.get_patient(int(middle_patient))),
+        Scenario('get_patient_cached', lambda: clinic.patients.get(middle_patient)),
+        Scenario('patient_chart', lambda: repository.patient_chart(int(middle_patient))),
+        Scenario('patient_chart_cached', lambda: clinic.patients.chart(middle_patient)),
+        Scenario('search_appointments_description', lambda: repository.search_appointments('root canal')),
+        Scenario('search_appointments_patient_id', lambda: repository.search_appointments(middle_patient)),
+        Scenario('search_bills_description', lambda: repository.search_bills('crown')),
+        Scenario('search_bills_patient_id', lambda: repository.search_bills(middle_patient)),
+        # Logins pay for the password hash (credentials.SCRYPT_N sets the cost);
+        # the cached path is HTTP Basic auth after the first request and the
+        # session lookup is every request carrying a token.
+        Scenario('authenticate_user', lambda: clinic.users.authenticate('admin', 'admin')),
+        Scenario('authenticate_user_wrong_password', lambda: clinic.users.authenticate('admin', 'wrong'),
+                 teardown=lambda: clinic.users.limiter.succeeded('admin')),
+        Scenario('authenticate_user_unknown', lambda: clinic.users.authenticate('nobody', 'admin'),
+                 teardown=lambda: clinic.users.limiter.succeeded('nobody')),
+        Scenario('authenticate_user_cached', lambda: clinic.users.authenticate('admin', 'admin', cached=True)),
+        Scenario('session_lookup', lambda: clinic.users.session(token)),
+        Scenario('hash_password', lambda: hash_password('correct horse battery staple')),
+        Scenario('list_users', lambda: clinic.users.list()),
+    ]
+
+    first_day = pool.fetchone('SELECT MIN(date) FROM appointments')[0] or '2020-01-01'
+    found.append(Scenario('free_slots', lambda: clinic.appointments.free_slots(first_day, '09:00', 30, 1)))
+    # The Schedule tab: loading a week (one range query, bucketed into slots)
+    # and drawing a day or one chair's week from the loaded grid
+    week = clinic.appointments.schedule(week_start(first_day), 7)
+    found += [
+        Scenario('schedule_week', lambda: clinic.appointments.schedule(week_start(first_day), 7)),
+        Scenario('schedule_draw_day', lambda: week.day(first_day)),
+        Scenario('schedule_draw_week', lambda: week.week(1)),
+    ]
+
+    # Change feed polls: an idle poll is what every open window pays twice a
+    # second, the other picks up ten patients changed since the previous poll
+    # by another workstation (a second connection).
+    other = sqlite3.connect(pool.path)
+
+    def remote_update():
+        with other:
+            other.execute('UPDATE patients SET contact = contact WHERE id IN (SELECT id FROM patients ORDER BY id LIMIT 10)')
+    found += [
+        Scenario('change_feed_poll_idle', clinic.changes.poll),
+        Scenario('change_feed_poll_remote_changes', clinic.changes.poll, teardown=remote_update),
+    ]
+
+    # Writes are undone after each run so the database stays the same size
+    created = []
+    found += [
+        Scenario('add_patient', lambda: created.append(clinic.patients.add('Bench Patient', 40, 'Other', '000')),
+                 teardown=lambda: clinic.patients.delete(created.pop())),
+        Scenario('add_appointment', lambda: created.append(clinic.appointments.add(1, '2099-01-05', '09:00', 'Bench', 30, 1)),
+                 teardown=lambda: clinic.appointments.delete(created.pop())),
+        Scenario('add_bill', lambda: created.append(clinic.billing.add(1, '2099-01-05', 100, 'Bench')),
+                 teardown=lambda: clinic.billing.delete(created.pop())),
+    ]
+
+    # An end-of-day billing run: 500 line items entered one after the other,
+    # waiting for each commit, and submitted without waiting so the write
+    # queue commits them in batches.
+    def bill_run(wait):
+        ids = [clinic.billing.add(1, '2099-01-06', 100, 'Bench run', wait=wait) for _ in range(BILL_RUN)]
+        return ids if wait else [future.result() for future in ids]
+
+    def undo_bill_run():
+        pool.execute("DELETE FROM billing WHERE date = '2099-01-06' AND description = 'Bench run'")
+        clinic.repository.notify('billing')
+
+    found += [
+        Scenario('add_bills_sequential', lambda: bill_run(True), SLOW_REPEAT * 2, undo_bill_run),
+        Scenario('add_bills_batched', lambda: bill_run(False), SLOW_REPEAT * 2, undo_bill_run),
+    ]
+
+    for name in ANALYSES:
+        found.append(Scenario('analysis_' + name.lower().replace(' ', '_'), lambda n=name: clinic.reports.analyse(n)[1], SLOW_REPEAT * 2))
+
+    # Columnar snapshots, when NumPy is installed: the first scenario pays for
+    # the full load in its warmup, the others time vectorized work on it.
+    try:
+        bills = clinic.reports.snapshot('billing')
+    except RuntimeError:
+        bills = None
+    if bills is not None:
+        found += [
+            Scenario('snapshot_refresh_bills', lambda: clinic.reports.snapshot('billing')),
+            Scenario('snapshot_filter_sort_bills', lambda: bills.select(bills.filter(description='crown', amount_from=900), 'amount', True)),
+            Scenario('snapshot_sort_all_bills', lambda: bills.select(order_by='date', descending=True)),
+            Scenario('snapshot_revenue_by_month', lambda: bills.aggregate('month')),
+        ]
+
+    for fmt in formats:
+        for report in ('patient', 'financial'):
+            path = os.path.join(workdir, '{}_report.{}'.format(report, fmt))
+            found.append(Scenario('generate_{}_report_{}'.format(report, fmt), lambda r=report, f=fmt, p=path: clinic.reports.export(r, f, p), SLOW_REPEAT))
+
+    if import_rows:
+        source = os.path.join(workdir, 'import_patients.csv')
+        _write_import_file(source, import_rows)
+        before = []
+        found.append(Scenario('import_patients',
+                              lambda: before.append(_extent(pool, 'patients')[1]) or clinic.reports.import_file('patients', source),
+                              SLOW_REPEAT,
+                              teardown=lambda: pool.execute('DELETE FROM patients WHERE id > ?', (before.pop(),))))
+    return found
+
+
+def copy_database(source, target):
+    with sqlite3.connect(source) as original, sqlite3.connect(target) as copy:
+        original.backup(copy)
+    original.close()
+    copy.close()
+
+
+def run(database, scale, formats=('csv',), only=None, progress=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'benchmark.db')
+        copy_database(database, path)
+        clinic = Clinic(ConnectionPool(path)).setup()
+        try:
+            for scenario in scenarios(clinic, workdir, formats):
+                if only and not any(part in scenario.name for part in only):
+                    continue
+                results[scenario.name] = measure(scenario)
+                if progress:
+                    progress(scenario.name, results[scenario.name])
+            counts = {table: clinic.pool.fetchone('SELECT COUNT(*) FROM {}'.format(table))[0] for table in ('patients', 'appointments', 'billing')}
+        finally:
+            clinic.close()
+    return {
+        'meta': {
+            'scale': scale,
+            'rows': counts,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'password_hash': 'scrypt n={} r={} p={}'.format(SCRYPT_N, SCRYPT_R, SCRYPT_P),
+        },
+        'results': results,
+    }
+
+
+# Returns (name, baseline median, median, ratio, regressed) for every
+# scenario found in both runs.
+def compare(results, baseline, tolerance=TOLERANCE):
+    rows = []
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        before, after = base['median_ms'], result['median_ms']
+        ratio = after / before if before else float('inf')
+        regressed = ratio > 1 + tolerance and after - before > NOISE_MS
+        rows.append((name, before, after, ratio, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the clinic query paths on synthetic data')
+    parser.add_argument('--scale', default='10k', help='{} or a number of bills'.format(', '.join(SCALES)))
+    parser.add_argument('--db', help='benchmark database, left unchanged (default: bench_<scale>.db, generated if missing)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare with this JSON results file')
+    parser.add_argument('--save-baseline', action='store_true', help='also write the results to the --baseline file')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown of a median (default: %(default)s)')
+    parser.add_argument('--formats', default='csv', help='export formats to time, comma separated (default: %(default)s)')
+    parser.add_argument('--only', action='append', help='run only scenarios whose name contains this text')
+    args = parser.parse_args(argv)
+
+    path = args.db or 'bench_{}.db'.format(args.scale)
+    if not os.path.exists(path):
+        print('Generating {} ...'.format(path))
+        conn = sqlite3.connect(path)
+        generate(conn, *table_sizes(args.scale), seed=SEED)
+        conn.close()
+    results = run(path, args.scale, args.formats.split(','), args.only,
+                  progress=lambda name, result: print('{:<45} {:>10.3f} ms  p95 {:>10.3f} ms'.format(name, result['median_ms'], result['p95_ms'])))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    status = 0
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['meta'].get('rows') != results['meta']['rows']:
+            print('Warning: baseline was recorded on a different database ({})'.format(baseline['meta'].get('rows')))
+        print()
+        print('{:<45} {:>12} {:>12} {:>8}'.format('scenario', 'baseline ms', 'now ms', 'ratio'))
+        for name, before, after, ratio, regressed in compare(results, baseline, args.tolerance):
+            print('{:<45} {:>12.3f} {:>12.3f} {:>7.2f}x{}'.format(name, before, after, ratio, '  REGRESSION' if regressed else ''))
+            if regressed:
+                status = 1
+    elif args.baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print('Baseline saved to {}'.format(args.baseline))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
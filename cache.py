@@ -0,0 +1,227 @@
+import threading
+import time
+from collections import OrderedDict
+
+# LRU Cache
+# A bounded, thread-safe mapping that forgets the least recently used entry
+# once maxsize is reached and treats entries older than ttl seconds as
+# missing. Hits, misses, evictions and expirations are counted for stats().
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored = entry
+                if self.ttl is None or self.clock() - stored < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    # Like get, but without counting a hit or miss or refreshing the entry
+    def peek(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl is not None and self.clock() - entry[1] >= self.ttl):
+                return default
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+# Search Cache
+# Results of one table's search(term), by normalized term, cleared whenever the
+# repository reports a write to the table. Search as you type asks for "s",
+# "sm", "smi", ... in turn: a term missing from the cache is first answered by
+# filtering the cached results of a shorter term it extends, as long as that
+# result was complete (fewer rows than the search limit) and every match for
+# the longer term is guaranteed to be among them (SearchIndex.refines).
+# Narrowed results keep the order of the shorter term's results.
+class SearchCache:
+    def __init__(self, repository, table, search, maxsize=256, ttl=300):
+        self.index = repository.search
+        self.table = table
+        self._search = search
+        self.results = LRUCache(maxsize, ttl)
+        self.narrowed = 0
+        self._lock = threading.Lock()
+        # Bumped on every write, so a search that raced a write is not cached
+        self._generation = 0
+        repository.subscribe(self._changed)
+
+    def search(self, term):
+        key = ' '.join(term.lower().split())
+        rows = self.results.get(key)
+        if rows is MISSING:
+            generation = self._generation
+            rows = self._narrow(term, key)
+            if rows is None:
+                rows = tuple(self._search(term))
+            with self._lock:
+                if generation == self._generation:
+                    self.results.put(key, rows)
+        return list(rows)
+
+    def _narrow(self, term, key):
+        for end in range(len(key) - 1, 0, -1):
+            shorter = key[:end]
+            rows = self.results.peek(shorter)
+            if rows is MISSING or len(rows) >= self.index.limit or not self.index.refines(term, shorter):
+                continue
+            matches = self.index.matcher(self.table, term)
+            self.narrowed += 1
+            return tuple(row for row in rows if matches(row))
+        return None
+
+    def _changed(self, table, row_id=None, row=None):
+        if table == self.table:
+            with self._lock:
+                self._generation += 1
+                self.results.clear()
+
+    def clear(self):
+        self._changed(self.table)
+
+    def stats(self):
+        stats = self.results.stats()
+        stats['narrowed'] = self.narrowed
+        return stats
+
+
+# Patient Cache
+# Patient records by id and patient search results by term, filled from the
+# repository on a miss. The repository reports every patient write through
+# subscribe(): an added or updated patient replaces its cached record, a
+# deleted one is dropped, and cached search results are cleared because the
+# write may change which patients a term matches. Writes made by other
+# processes are picked up when the entries expire after ttl seconds.
+class PatientCache:
+    def __init__(self, repository, maxsize=2048, search_size=256, ttl=300):
+        self.repository = repository
+        self.records = LRUCache(maxsize, ttl)
+        self.searches = SearchCache(repository, 'patients', repository.search_patients, search_size, ttl)
+        self._lock = threading.Lock()
+        # Bumped on every write, so a read that raced a write is not cached
+        self._generation = 0
+        repository.subscribe(self._changed)
+
+    def get(self, patient_id):
+        row = self.records.get(patient_id)
+        if row is MISSING:
+            generation = self._generation
+            row = self.repository.get_patient(patient_id)
+            with self._lock:
+                if generation == self._generation:
+                    self.records.put(patient_id, row)
+        return row
+
+    def search(self, term):
+        return self.searches.search(term)
+
+    def _changed(self, table, row_id=None, row=None):
+        if table != 'patients':
+            return
+        with self._lock:
+            self._generation += 1
+            if row_id is None:
+                self.records.clear()
+            elif row is None:
+                self.records.invalidate(row_id)
+            else:
+                self.records.put(row_id, row)
+
+    def clear(self):
+        self._changed('patients')
+        self.searches.clear()
+
+    def stats(self):
+        return {'records': self.records.stats(), 'searches': self.searches.stats()}
+
+
+# Patient Charts
+# Recently opened patient charts (see ClinicRepository.patient_chart), so
+# stepping back and forth between patients, or to a neighbour whose chart was
+# prefetched while the previous one was on screen, needs no query. A change
+# to a patient drops that patient's chart. Any appointment or bill change
+# drops every chart, since an update may have moved the row from another
+# patient.
+class ChartCache:
+    def __init__(self, repository, maxsize=64, ttl=300):
+        self.repository = repository
+        self.charts = LRUCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self._generation = 0
+        repository.subscribe(self._changed)
+
+    def get(self, patient_id):
+        chart = self.charts.get(patient_id)
+        if chart is MISSING:
+            generation = self._generation
+            chart = self.repository.patient_chart(patient_id)
+            with self._lock:
+                if generation == self._generation:
+                    self.charts.put(patient_id, chart)
+        return chart
+
+    def _changed(self, table, row_id=None, row=None):
+        if table not in ('patients', 'appointments', 'billing'):
+            return
+        with self._lock:
+            self._generation += 1
+            if table == 'patients' and row_id is not None:
+                self.charts.invalidate(row_id)
+            else:
+                self.charts.clear()
+
+    def clear(self):
+        self._changed('billing')
+
+    def stats(self):
+        return self.charts.stats()
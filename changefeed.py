@@ -0,0 +1,174 @@
+import logging
+import sqlite3
+import threading
+import time
+from instrumentation import metrics
+
+logger = logging.getLogger('dcms.changes')
+
+# Change Feed
+# Triggers log every insert, update and delete on patients, appointments and
+# billing in change_log under an increasing sequence number, whichever
+# program makes it: this one, another workstation sharing the database file
+# or the command line. ChangeFeed.poll() first asks SQLite whether another
+# connection has committed anything since the last poll (PRAGMA data_version,
+# answered without reading the database), and only then reads the log entries
+# after the last sequence number it has seen. It fetches the current version
+# of those rows by id and reports them through ClinicRepository.notify, so
+# caches and open lists are patched exactly as after a local write. Writes
+# made through this process's repository were reported when they committed
+# and are skipped.
+# A bulk import logs one entry with a NULL row_id for the whole batch, which
+# is reported as a change to the whole table. The log keeps about the last
+# LOG_SIZE entries; a feed that falls further behind than that reports every
+# table as changed.
+TABLES = ('patients', 'appointments', 'billing')
+LOG_SIZE = 100000
+PRUNE_EVERY = 1000
+POLL_INTERVAL = 0.5
+# Row ids per IN (...) lookup
+FETCH_CHUNK = 500
+
+
+def create_change_log(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS change_log (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        tbl TEXT NOT NULL,
+                        row_id INTEGER
+                    )''')
+    for table in TABLES:
+        log = "INSERT INTO change_log (tbl, row_id) VALUES ('{}', {{}}.id);".format(table)
+        conn.execute('CREATE TRIGGER IF NOT EXISTS {0}_changes_ai AFTER INSERT ON {0} BEGIN {1} END'.format(table, log.format('NEW')))
+        conn.execute('CREATE TRIGGER IF NOT EXISTS {0}_changes_ad AFTER DELETE ON {0} BEGIN {1} END'.format(table, log.format('OLD')))
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS {0}_changes_au AFTER UPDATE ON {0} BEGIN {1}
+                            INSERT INTO change_log (tbl, row_id) SELECT '{0}', OLD.id WHERE OLD.id != NEW.id;
+                        END'''.format(table, log.format('NEW')))
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS change_log_prune AFTER INSERT ON change_log
+                    WHEN NEW.seq % {} = 0 BEGIN
+                        DELETE FROM change_log WHERE seq <= NEW.seq - {};
+                    END'''.format(PRUNE_EVERY, LOG_SIZE))
+
+
+# Bulk imports drop the per-row trigger for a batch and log it once
+def change_trigger(conn, table):
+    return conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (table + '_changes_ai',)).fetchone()
+
+
+def log_bulk_change(conn, table):
+    conn.execute('INSERT INTO change_log (tbl, row_id) VALUES (?, NULL)', (table,))
+
+
+class ChangeFeed:
+    def __init__(self, pool, repository):
+        self.pool = pool
+        self.repository = repository
+        # Last sequence number handled; read from the log on the first poll
+        self.seq = None
+        self.data_version = None
+        # (first, last] sequence ranges committed through this process
+        self._own = []
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.polls = 0
+        self.reads = 0
+        self.changes = 0
+
+    # Sequence number of the last entry logged, as conn sees it. Reads
+    # sqlite_sequence, so it also works before the change log exists.
+    @staticmethod
+    def position(conn):
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+        return row[0] if row else 0
+
+    # Entries first + 1 to last were written by this process and reported
+    def own(self, first, last):
+        if last > first:
+            with self._lock:
+                self._own.append((first, last))
+
+    # Reports changes committed elsewhere since the last poll and returns how
+    # many rows were reported
+    def poll(self):
+        with self._poll_lock:
+            started = time.perf_counter()
+            conn = self.pool.connection()
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+            changed = {}
+            if version != self.data_version:
+                self.data_version = version
+                changed = self._read(conn)
+            self.polls += 1
+            metrics.record('change feed', 'poll', (time.perf_counter() - started) * 1000)
+        count = 0
+        for table, ids in changed.items():
+            if ids is None:
+                self.repository.notify(table)
+                count += 1
+                continue
+            rows = self.repository.get_rows(table, list(ids), FETCH_CHUNK)
+            for row_id in ids:
+                self.repository.notify(table, row_id, rows.get(row_id))
+            count += len(ids)
+        if changed:
+            self.changes += count
+            metrics.record('change feed', 'apply', (time.perf_counter() - started) * 1000, count)
+        return count
+
+    # table -> ids changed after self.seq (None: the whole table), skipping
+    # this process's own writes
+    def _read(self, conn):
+        if self.seq is None:
+            self.seq = self.position(conn)
+            return {}
+        entries = conn.execute('SELECT seq, tbl, row_id FROM change_log WHERE seq > ? ORDER BY seq', (self.seq,)).fetchall()
+        if not entries:
+            return {}
+        self.reads += 1
+        with self._lock:
+            own, self._own = self._own, [(first, last) for first, last in self._own if last > entries[-1][0]]
+        if entries[0][0] > self.seq + 1:
+            # Pruned before this feed read it
+            changed = dict.fromkeys(TABLES)
+        else:
+            changed = {}
+            for seq, table, row_id in entries:
+                if any(first < seq <= last for first, last in own):
+                    continue
+                ids = changed.setdefault(table, {})
+                if row_id is None:
+                    changed[table] = None
+                elif ids is not None:
+                    ids[row_id] = None
+        self.seq = entries[-1][0]
+        return changed
+
+    # Poll every interval seconds on a daemon thread, for programs without a
+    # Tk main loop to schedule polls on (see server.py)
+    def start(self, interval=POLL_INTERVAL):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='dcms-changes', daemon=True)
+            self._thread.start()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.poll()
+            except sqlite3.Error:
+                logger.exception('Polling for changes failed')
+
+    def stop(self):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def stats(self):
+        return {
+            'seq': self.seq,
+            'polls': self.polls,
+            'reads': self.reads,
+            'changes': self.changes,
+        }
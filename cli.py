@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import sqlite3
+import sys
+from database import ConnectionPool, DB_PATH
+from analytics import ANALYSES
+from exporter import EXPORT_FORMATS, REPORTS
+from importer import IMPORTS
+from scheduling import DEFAULT_DURATION
+from server import HOST, PORT, WORKERS, serve
+from services import Clinic
+
+# Command Line Interface
+# dcms runs the clinic's operations without a display, for scripts, nightly
+# jobs and load tests. Rows are printed tab-separated, one per line; errors go
+# to stderr with a non-zero exit status.
+def print_rows(rows, columns=None):
+    if columns:
+        print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+def list_rows(service, args):
+    print_rows(service.page(args.after, limit=args.limit))
+
+
+def crud_commands(subparsers, name, service_name, fields):
+    parser = subparsers.add_parser(name, help='manage {}'.format(name))
+    commands = parser.add_subparsers(dest='action', required=True)
+
+    command = commands.add_parser('list', help='list rows in id order')
+    command.add_argument('--after', type=int, help='start after this id')
+    command.add_argument('--limit', type=int, default=100)
+    command.set_defaults(run=lambda clinic, args: list_rows(getattr(clinic, service_name), args))
+
+    command = commands.add_parser('search', help='full-text search')
+    command.add_argument('term')
+    command.set_defaults(run=lambda clinic, args: print_rows(getattr(clinic, service_name).search(args.term)))
+
+    command = commands.add_parser('add')
+    for name, options, _ in fields:
+        command.add_argument(name, **options)
+    command.set_defaults(run=lambda clinic, args: print(getattr(clinic, service_name).add(*values(args, fields))))
+
+    command = commands.add_parser('update')
+    command.add_argument('id', type=int)
+    for name, options, _ in fields:
+        command.add_argument(name, **options)
+    command.set_defaults(run=lambda clinic, args: getattr(clinic, service_name).update(args.id, *values(args, fields)))
+
+    command = commands.add_parser('delete')
+    command.add_argument('id', type=int)
+    command.set_defaults(run=lambda clinic, args: getattr(clinic, service_name).delete(args.id))
+    return commands
+
+
+def field(name, **options):
+    return name, options, name.lstrip('-').replace('-', '_')
+
+
+def values(args, fields):
+    return [getattr(args, dest) for _, _, dest in fields]
+
+
+def show_chart(clinic, args):
+    chart = clinic.patients.chart(args.id)
+    if chart is None:
+        raise ValueError("No patient with id {}".format(args.id))
+    print_rows([chart.patient], ('id', 'name', 'age', 'gender', 'contact'))
+    for title, rows in (('upcoming', chart.upcoming), ('past', chart.past)):
+        print()
+        print_rows(rows, (title, 'date', 'time', 'description', 'duration', 'chair'))
+    print()
+    print_rows(chart.bills, ('bill', 'date', 'amount', 'description', 'balance'))
+
+
+def free_slots(clinic, args):
+    slots = clinic.appointments.free_slots(args.date, args.time, args.duration, args.chair, args.count)
+    print_rows(slots, ('date', 'time', 'chair'))
+
+
+def show_schedule(clinic, args):
+    schedule = clinic.appointments.schedule(args.date, args.days, args.chair)
+    if args.chair is not None:
+        print_rows(schedule.week(args.chair), ('time',) + tuple(schedule.dates))
+        return
+    for index, date in enumerate(schedule.dates):
+        if index:
+            print()
+        print_rows(schedule.day(date), (date,) + tuple('chair {}'.format(chair) for chair in schedule.chairs))
+
+
+def import_rows(clinic, args):
+    result = clinic.reports.import_file(args.table, args.file, args.rejects)
+    print(result)
+    return 1 if result.rejected else 0
+
+
+def run_report(clinic, args):
+    print(clinic.reports.export(args.report, args.format, args.output))
+
+
+def run_analysis(clinic, args):
+    columns, rows = clinic.reports.analyse(args.name, args.start, args.end)
+    if args.output:
+        print(clinic.reports.export_rows(columns, rows, args.output))
+    else:
+        print_rows(rows, columns)
+
+
+def run_server(clinic, args):
+    try:
+        asyncio.run(serve(clinic, args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='dcms', description='Dental Clinic Management System')
+    parser.add_argument('--db', default=DB_PATH, help='database file (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    patients = crud_commands(subparsers, 'patients', 'patients', [
+        field('name'), field('age'), field('gender'), field('contact'),
+    ])
+    command = patients.add_parser('chart', help='show a patient with appointments and bills')
+    command.add_argument('id', type=int)
+    command.set_defaults(run=show_chart)
+    appointments = crud_commands(subparsers, 'appointments', 'appointments', [
+        field('patient_id'), field('date'), field('time'), field('description'),
+        field('--duration', default=DEFAULT_DURATION), field('--chair', default=1),
+    ])
+    command = appointments.add_parser('slots', help='suggest free slots from a date and time')
+    command.add_argument('date')
+    command.add_argument('time')
+    command.add_argument('--duration', default=DEFAULT_DURATION)
+    command.add_argument('--chair', type=int)
+    command.add_argument('--count', type=int, default=3)
+    command.set_defaults(run=free_slots)
+    command = appointments.add_parser('schedule', help='show appointments in time slots, per chair')
+    command.add_argument('date')
+    command.add_argument('--days', type=int, default=1)
+    command.add_argument('--chair', type=int, help='one chair, with a column per day')
+    command.set_defaults(run=show_schedule)
+    crud_commands(subparsers, 'bills', 'billing', [
+        field('patient_id'), field('date'), field('amount'), field('description'),
+    ])
+
+    command = subparsers.add_parser('import', help='bulk import a CSV or XLSX file')
+    command.add_argument('table', choices=list(IMPORTS))
+    command.add_argument('file')
+    command.add_argument('--rejects', help='reject file (default: <file>_rejects.csv)')
+    command.set_defaults(run=import_rows)
+
+    command = subparsers.add_parser('report', help='export a report')
+    command.add_argument('report', choices=list(REPORTS))
+    command.add_argument('--format', choices=EXPORT_FORMATS, default='xlsx')
+    command.add_argument('--output', help='output file (default: <report>_report.<format>)')
+    command.set_defaults(run=run_report)
+
+    command = subparsers.add_parser('analysis', help='run a financial analysis')
+    command.add_argument('name', choices=list(ANALYSES))
+    command.add_argument('--from', dest='start')
+    command.add_argument('--to', dest='end')
+    command.add_argument('--output', help='save to a file instead of printing')
+    command.set_defaults(run=run_analysis)
+
+    command = subparsers.add_parser('serve', help='run the HTTP/JSON API server')
+    command.add_argument('--host', default=HOST)
+    command.add_argument('--port', type=int, default=PORT)
+    command.add_argument('--workers', type=int, default=WORKERS)
+    command.set_defaults(run=run_server)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    clinic = Clinic(ConnectionPool(args.db)).setup()
+    try:
+        return args.run(clinic, args) or 0
+    except (ValueError, RuntimeError, OSError, sqlite3.Error) as e:
+        print('dcms: error: {}'.format(e), file=sys.stderr)
+        return 1
+    finally:
+        clinic.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import base64
+import hashlib
+import hmac
+import math
+import secrets
+import threading
+import time
+from cache import LRUCache, MISSING
+
+# Password Hashing
+# Passwords are stored as "scrypt$n$r$p$salt$hash" with a random salt per
+# password. scrypt costs memory as well as time, so guessing passwords from a
+# stolen database is slow even on GPUs. With the default n=2**14, r=8 a check
+# takes about 60 ms and 16 MiB; raising SCRYPT_N makes every hash made from
+# then on dearer, and older hashes are upgraded at the user's next login
+# (needs_rehash). Python builds without hashlib.scrypt use PBKDF2-SHA256,
+# stored as "pbkdf2_sha256$iterations$salt$hash".
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600000
+SALT_BYTES = 16
+KEY_BYTES = 32
+SCHEMES = ('scrypt', 'pbkdf2_sha256')
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=KEY_BYTES)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations, KEY_BYTES)
+
+
+def hash_password(password):
+    salt = secrets.token_bytes(SALT_BYTES)
+    if hasattr(hashlib, 'scrypt'):
+        return 'scrypt${}${}${}${}${}'.format(SCRYPT_N, SCRYPT_R, SCRYPT_P, _b64(salt), _b64(_scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)))
+    return 'pbkdf2_sha256${}${}${}'.format(PBKDF2_ITERATIONS, _b64(salt), _b64(_pbkdf2(password, salt, PBKDF2_ITERATIONS)))
+
+
+def verify_password(password, stored):
+    try:
+        scheme, *fields = stored.split('$')
+        if scheme == 'scrypt' and hasattr(hashlib, 'scrypt'):
+            n, r, p, salt, expected = fields
+            actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+        elif scheme == 'pbkdf2_sha256':
+            iterations, salt, expected = fields
+            actual = _pbkdf2(password, base64.b64decode(salt), int(iterations))
+        else:
+            return False
+        return hmac.compare_digest(actual, base64.b64decode(expected))
+    except ValueError:
+        return False
+
+
+def is_hashed(stored):
+    return stored.split('$', 1)[0] in SCHEMES
+
+
+# True when stored was made with other settings than hash_password uses now
+def needs_rehash(stored):
+    if hasattr(hashlib, 'scrypt'):
+        return stored.split('$')[:4] != ['scrypt', str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+    return stored.split('$')[:2] != ['pbkdf2_sha256', str(PBKDF2_ITERATIONS)]
+
+
+_dummy_hash = None
+
+
+# Checked against when the username does not exist, so an unknown user takes
+# as long to reject as a wrong password.
+def dummy_hash():
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_urlsafe(16))
+    return _dummy_hash
+
+
+# Login Rate Limiter
+# After max_failures wrong passwords for one username within window seconds,
+# further logins as that user are refused for lockout seconds without the
+# password being checked. A correct password clears the count. Unknown
+# usernames are counted the same way, so the limiter does not reveal which
+# users exist.
+MAX_FAILURES = 5
+FAILURE_WINDOW = 900
+LOCKOUT = 300
+
+
+class LoginLocked(ValueError):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__("Too many failed logins. Try again in {} seconds.".format(retry_after))
+
+
+class LoginLimiter:
+    def __init__(self, max_failures=MAX_FAILURES, window=FAILURE_WINDOW, lockout=LOCKOUT, maxsize=10000, clock=time.monotonic):
+        self.max_failures = max_failures
+        self.window = window
+        self.lockout = lockout
+        self.clock = clock
+        # username -> (failures, first failure, locked until)
+        self._failures = LRUCache(maxsize, max(window, lockout), clock)
+        self._lock = threading.Lock()
+
+    # Raises LoginLocked while username is locked out
+    def check(self, username):
+        entry = self._failures.peek(username)
+        if entry is not MISSING:
+            remaining = entry[2] - self.clock()
+            if remaining > 0:
+                raise LoginLocked(math.ceil(remaining))
+
+    def failed(self, username):
+        now = self.clock()
+        with self._lock:
+            failures, first, _ = self._failures.peek(username, (0, now, 0))
+            if now - first > self.window:
+                failures, first = 0, now
+            failures += 1
+            self._failures.put(username, (failures, first, now + self.lockout if failures >= self.max_failures else 0))
+
+    def succeeded(self, username):
+        self._failures.invalidate(username)
+
+    def stats(self):
+        return {'tracked': len(self._failures)}
+
+
+# Session Cache
+# Logged-in users by session token, kept in memory for ttl seconds after
+# login, so requests carrying a token skip the password hash. HTTP Basic
+# clients send the password with every request instead; a verified pair is
+# remembered under an HMAC of username and password with a secret that only
+# lives in this process, never under the password itself.
+SESSION_TTL = 8 * 3600
+
+
+class SessionCache:
+    def __init__(self, ttl=SESSION_TTL, maxsize=10000, clock=time.monotonic):
+        self.sessions = LRUCache(maxsize, ttl, clock)
+        self._secret = secrets.token_bytes(32)
+
+    def create(self, username, role):
+        token = secrets.token_urlsafe(32)
+        self.sessions.put(token, (username, role))
+        return token
+
+    def credential_key(self, username, password):
+        return hmac.new(self._secret, '{}\0{}'.format(username, password).encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def remember(self, key, username, role):
+        self.sessions.put(key, (username, role))
+
+    # (username, role) for a live token or credential key, else None
+    def get(self, key):
+        session = self.sessions.get(key)
+        return None if session is MISSING else session
+
+    def revoke(self, key):
+        self.sessions.invalidate(key)
+
+    def clear(self):
+        self.sessions.clear()
+
+    def stats(self):
+        return self.sessions.stats()
@@ -0,0 +1,373 @@
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date as _date, timedelta
+from changefeed import ChangeFeed
+from instrumentation import InstrumentedConnection
+from queries import TableQuery
+from search import SearchIndex
+from validation import normalize_date, normalize_time
+from scheduling import DEFAULT_DURATION, Schedule, Scheduler, SchedulingConflict, to_minutes, validate_chair, validate_days, validate_duration
+
+DB_PATH = 'dental_clinic.db'
+
+# A patient's chart: the patient row, upcoming appointments (soonest first),
+# past appointments (latest first), bills in date order, each ending in the
+# running balance, and the balance owed. Appointment rows are (id, date, time,
+# description, duration, chair); bill rows (id, date, amount, description,
+# balance).
+PatientChart = namedtuple('PatientChart', 'patient upcoming past bills balance')
+
+# Connection Pool
+# Each thread gets one long-lived connection which is reused for every query
+# issued from that thread. Connections belonging to threads that have exited
+# are closed the next time a new connection is opened.
+# Connections are instrumented (see instrumentation.py) unless instrumented=False.
+class ConnectionPool:
+    PRAGMAS = (
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('temp_store', 'MEMORY'),
+        ('cache_size', -16000),
+        ('mmap_size', 134217728),
+        ('busy_timeout', 5000),
+    )
+
+    def __init__(self, path=DB_PATH, cached_statements=256, instrumented=True):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.factory = InstrumentedConnection if instrumented else sqlite3.Connection
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            with self._lock:
+                self.reused += 1
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False,
+                               cached_statements=self.cached_statements, factory=self.factory)
+        for name, value in self.PRAGMAS:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        self._local.conn = conn
+
+        with self._lock:
+            self._close_dead_threads()
+            self._connections[threading.current_thread()] = conn
+            self.opened += 1
+        return conn
+
+    def _close_dead_threads(self):
+        for thread in [t for t in self._connections if not t.is_alive()]:
+            self._connections.pop(thread).close()
+            self.closed += 1
+
+    def execute(self, query, params=()):
+        conn = self.connection()
+        with conn:
+            return conn.execute(query, params)
+
+    # Statements run on this thread's connection inside the block stop with
+    # sqlite3.OperationalError ('interrupted') once cancelled() returns true.
+    # SQLite calls the progress handler every `every` virtual machine
+    # instructions, so even a long scan notices within a fraction of a
+    # millisecond. Unlike Connection.interrupt() this can only ever stop the
+    # statements of the block, not whatever the connection runs next.
+    @contextmanager
+    def interruptible(self, cancelled, every=1000):
+        conn = self.connection()
+        conn.set_progress_handler(lambda: 1 if cancelled() else 0, every)
+        try:
+            yield conn
+        finally:
+            conn.set_progress_handler(None, every)
+
+    def fetchall(self, query, params=()):
+        return self.connection().execute(query, params).fetchall()
+
+    def fetchone(self, query, params=()):
+        return self.connection().execute(query, params).fetchone()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'opened': self.opened,
+                'reused': self.reused,
+                'closed': self.closed,
+                'open_connections': len(self._connections),
+            }
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self.closed += len(self._connections)
+            self._connections.clear()
+        self._local = threading.local()
+
+
+# Data Access Layer
+class ClinicRepository:
+    COLUMNS = {
+        'patients': ('id', 'name', 'age', 'gender', 'contact'),
+        'appointments': ('id', 'patient_id', 'date', 'time', 'description', 'duration', 'chair'),
+        'billing': ('id', 'patient_id', 'date', 'amount', 'description'),
+    }
+
+    def __init__(self, pool, writes=None):
+        self.pool = pool
+        self.writes = writes
+        self.search = SearchIndex(pool)
+        self.scheduler = Scheduler()
+        self.changes = ChangeFeed(pool, self)
+        self._listeners = []
+
+    # Change notification: callback(table, row_id, row) is called after every
+    # write made through the repository. row is the new row for inserts and
+    # updates and None for deletes; row_id is None when any number of rows may
+    # have changed (e.g. after a bulk import).
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def notify(self, table, row_id=None, row=None):
+        for callback in self._listeners:
+            callback(table, row_id, row)
+
+    # Runs fn(conn) in an IMMEDIATE write transaction, through the write queue
+    # when there is one (see writequeue.py), then done(result), which reports
+    # the change. Returns the result, or with wait=False a Future for it.
+    # The change log entries the write made are handed to the change feed,
+    # which then skips them.
+    def _write(self, fn, done, wait=True):
+        logged = []
+
+        def write(conn):
+            first = self.changes.position(conn)
+            result = fn(conn)
+            logged[:] = first, self.changes.position(conn)
+            return result
+
+        def committed(result):
+            self.changes.own(*logged)
+            done(result)
+
+        if self.writes is not None:
+            future = self.writes.submit(write, committed)
+            return future.result() if wait else future
+        conn = self.pool.connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            result = write(conn)
+        committed(result)
+        return result
+
+    # Keyset pagination: only one page of rows is ever read, whatever the table size.
+    # Rows are always returned in ascending id order.
+    def fetch_page(self, table, after_id=None, before_id=None, limit=100):
+        columns = ', '.join(self.COLUMNS[table])
+        if before_id is not None:
+            rows = self.pool.fetchall('SELECT {} FROM {} WHERE id < ? ORDER BY id DESC LIMIT ?'.format(columns, table), (before_id, limit))
+            rows.reverse()
+            return rows
+        if after_id is None:
+            after_id = 0
+        return self.pool.fetchall('SELECT {} FROM {} WHERE id > ? ORDER BY id LIMIT ?'.format(columns, table), (after_id, limit))
+
+    # The rows with the given ids, by id; ids that no longer exist are missing
+    def get_rows(self, table, ids, chunk=500):
+        columns = ', '.join(self.COLUMNS[table])
+        rows = {}
+        for start in range(0, len(ids), chunk):
+            part = ids[start:start + chunk]
+            for row in self.pool.fetchall('SELECT {} FROM {} WHERE id IN ({})'.format(columns, table, ', '.join('?' * len(part))), part):
+                rows[row[0]] = row
+        return rows
+
+    # A sorted, filtered view of a table, paged by its rows (see queries.py)
+    def query(self, table, order_by='id', descending=False, filters=None):
+        return TableQuery(self.pool, table, self.COLUMNS[table], order_by, descending, filters)
+
+    # Users
+    # Passwords arrive here already hashed (see credentials.py)
+    def get_credentials(self, username):
+        return self.pool.fetchone('SELECT id, password, role FROM users WHERE username = ?', (username,))
+
+    def add_user(self, username, password_hash, role):
+        user_id = self.pool.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)', (username, password_hash, role)).lastrowid
+        self.notify('users', user_id)
+        return user_id
+
+    def update_user(self, user_id, username, password_hash, role):
+        self.pool.execute('UPDATE users SET username = ?, password = ?, role = ? WHERE id = ?', (username, password_hash, role, user_id))
+        self.notify('users', user_id)
+
+    # Same password, new hash: not a change anyone needs to hear about
+    def rehash_password(self, user_id, password_hash):
+        self.pool.execute('UPDATE users SET password = ? WHERE id = ?', (password_hash, user_id))
+
+    def delete_user(self, user_id):
+        self.pool.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        self.notify('users', user_id)
+
+    def list_users(self):
+        return self.pool.fetchall('SELECT id, username, role FROM users')
+
+    # Patients
+    def get_patient(self, patient_id):
+        return self.pool.fetchone('SELECT id, name, age, gender, contact FROM patients WHERE id = ?', (patient_id,))
+
+    # The whole chart in one statement, so it is one round trip and one
+    # consistent snapshot. Each part seeks an index on patient_id (the rowid,
+    # appointments (patient_id, date) and billing (patient_id, date, amount)),
+    # and the running balance is a window function over the patient's bills.
+    CHART_QUERY = '''SELECT 0, id, name, age, gender, contact, NULL FROM patients WHERE id = :id
+                     UNION ALL
+                     SELECT 1, id, date, time, description, duration, chair FROM appointments WHERE patient_id = :id
+                     UNION ALL
+                     SELECT 2, id, date, amount, description, ROUND(SUM(amount) OVER (ORDER BY date, id), 2), NULL FROM billing WHERE patient_id = :id'''
+
+    # None when there is no such patient. Appointments on or after today
+    # (YYYY-MM-DD, default the current date) are upcoming.
+    def patient_chart(self, patient_id, today=None):
+        today = today or _date.today().isoformat()
+        patient, appointments, bills = None, [], []
+        for kind, *row in self.pool.fetchall(self.CHART_QUERY, {'id': patient_id}):
+            if kind == 0:
+                patient = tuple(row[:5])
+            elif kind == 1:
+                appointments.append(tuple(row))
+            else:
+                bills.append(tuple(row[:5]))
+        if patient is None:
+            return None
+        appointments.sort(key=lambda row: (row[1] or '', row[2] or '', row[0]))
+        bills.sort(key=lambda row: (row[1] or '', row[0]))
+        upcoming = [row for row in appointments if (row[1] or '') >= today]
+        past = [row for row in appointments if (row[1] or '') < today]
+        past.reverse()
+        return PatientChart(patient, upcoming, past, bills, bills[-1][4] if bills else 0)
+
+    # Writes take wait=False to return a Future instead of waiting for the commit
+    def add_patient(self, name, age, gender, contact, wait=True):
+        def insert(conn):
+            return conn.execute('INSERT INTO patients (name, age, gender, contact) VALUES (?, ?, ?, ?)', (name, age, gender, contact)).lastrowid
+        return self._write(insert, lambda patient_id: self.notify('patients', patient_id, (patient_id, name, age, gender, contact)), wait)
+
+    def update_patient(self, patient_id, name, age, gender, contact, wait=True):
+        def update(conn):
+            return conn.execute('UPDATE patients SET name = ?, age = ?, gender = ?, contact = ? WHERE id = ?', (name, age, gender, contact, patient_id)).rowcount
+
+        def done(rowcount):
+            if rowcount:
+                self.notify('patients', patient_id, (patient_id, name, age, gender, contact))
+            else:
+                self.notify('patients', patient_id)
+        return self._write(update, done, wait)
+
+    def delete_patient(self, patient_id, wait=True):
+        return self._write(lambda conn: conn.execute('DELETE FROM patients WHERE id = ?', (patient_id,)).rowcount,
+                           lambda rowcount: self.notify('patients', patient_id), wait)
+
+    def search_patients(self, search_term):
+        return self.search.search_patients(search_term)
+
+    # Appointments
+    # The overlap check and the write share one IMMEDIATE transaction, so two
+    # workstations cannot book the same chair at the same time.
+    def add_appointment(self, patient_id, date, time, description, duration=DEFAULT_DURATION, chair=1, wait=True):
+        date, time, duration, chair, start = self._appointment_slot(date, time, duration, chair)
+
+        def insert(conn):
+            self._check_free(conn, date, time, duration, chair)
+            return conn.execute('INSERT INTO appointments (patient_id, date, time, description, duration, chair, start_ts, end_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (patient_id, date, time, description, duration, chair, start, start + duration)).lastrowid
+        return self._write(insert, lambda appointment_id: self.notify('appointments', appointment_id, (appointment_id, patient_id, date, time, description, duration, chair)), wait)
+
+    def update_appointment(self, appointment_id, patient_id, date, time, description, duration=DEFAULT_DURATION, chair=1, wait=True):
+        date, time, duration, chair, start = self._appointment_slot(date, time, duration, chair)
+
+        def update(conn):
+            self._check_free(conn, date, time, duration, chair, appointment_id)
+            return conn.execute('UPDATE appointments SET patient_id = ?, date = ?, time = ?, description = ?, duration = ?, chair = ?, start_ts = ?, end_ts = ? WHERE id = ?',
+                                (patient_id, date, time, description, duration, chair, start, start + duration, appointment_id)).rowcount
+        return self._write(update, lambda rowcount: self.notify('appointments', appointment_id, (appointment_id, patient_id, date, time, description, duration, chair) if rowcount else None), wait)
+
+    def _appointment_slot(self, date, time, duration, chair):
+        date = normalize_date(date)
+        time = normalize_time(time)
+        duration = validate_duration(duration)
+        chair = validate_chair(chair)
+        return date, time, duration, chair, to_minutes(date, time)
+
+    def _check_free(self, conn, date, time, duration, chair, exclude_id=None):
+        conflicts = self.scheduler.conflicts(conn, date, time, duration, chair, exclude_id)
+        if conflicts:
+            suggestions = self.scheduler.next_free_slots(conn, date, time, duration, chair, exclude_id=exclude_id)
+            raise SchedulingConflict(conflicts, suggestions)
+
+    def free_slots(self, date, time, duration=DEFAULT_DURATION, chair=None, count=3):
+        date = normalize_date(date)
+        time = normalize_time(time)
+        return self.scheduler.next_free_slots(self.pool.connection(), date, time, validate_duration(duration), chair, count)
+
+    # Appointments dated first to last (inclusive), all chairs or one, with
+    # the patient's name, in date and time order: a range seek on
+    # idx_appointments_date_time. Rows whose date or time cannot be read
+    # (start_ts NULL) are left out.
+    SCHEDULE_QUERY = '''SELECT a.id, a.patient_id, a.date, a.time, a.description, a.duration, a.chair, p.name
+                        FROM appointments a LEFT JOIN patients p ON p.id = a.patient_id
+                        WHERE a.date BETWEEN :first AND :last AND a.start_ts IS NOT NULL AND (:chair IS NULL OR a.chair = :chair)
+                        ORDER BY a.date, a.time'''
+
+    def appointments_between(self, first, last, chair=None):
+        return self.pool.fetchall(self.SCHEDULE_QUERY, {'first': first, 'last': last, 'chair': chair})
+
+    # days days of appointments from first, bucketed into the scheduler's
+    # slots per chair (see scheduling.Schedule)
+    def schedule(self, first, days=1, chair=None):
+        first = normalize_date(first)
+        days = validate_days(days)
+        chair = None if chair is None else validate_chair(chair)
+        last = (_date.fromisoformat(first) + timedelta(days=days - 1)).isoformat()
+        chairs = [chair] if chair is not None else range(1, self.scheduler.chairs + 1)
+        return Schedule(first, days, self.appointments_between(first, last, chair), chairs,
+                        self.scheduler.opening, self.scheduler.closing, self.scheduler.slot_minutes)
+
+    def delete_appointment(self, appointment_id, wait=True):
+        return self._write(lambda conn: conn.execute('DELETE FROM appointments WHERE id = ?', (appointment_id,)).rowcount,
+                           lambda rowcount: self.notify('appointments', appointment_id), wait)
+
+    def search_appointments(self, search_term):
+        return self.search.search_appointments(search_term)
+
+    # Billing
+    def add_bill(self, patient_id, date, amount, description, wait=True):
+        date = normalize_date(date)
+
+        def insert(conn):
+            return conn.execute('INSERT INTO billing (patient_id, date, amount, description) VALUES (?, ?, ?, ?)', (patient_id, date, amount, description)).lastrowid
+        return self._write(insert, lambda bill_id: self.notify('billing', bill_id, (bill_id, patient_id, date, amount, description)), wait)
+
+    def update_bill(self, bill_id, patient_id, date, amount, description, wait=True):
+        date = normalize_date(date)
+
+        def update(conn):
+            return conn.execute('UPDATE billing SET patient_id = ?, date = ?, amount = ?, description = ? WHERE id = ?', (patient_id, date, amount, description, bill_id)).rowcount
+        return self._write(update, lambda rowcount: self.notify('billing', bill_id, (bill_id, patient_id, date, amount, description) if rowcount else None), wait)
+
+    def delete_bill(self, bill_id, wait=True):
+        return self._write(lambda conn: conn.execute('DELETE FROM billing WHERE id = ?', (bill_id,)).rowcount,
+                           lambda rowcount: self.notify('billing', bill_id), wait)
+
+    def search_bills(self, search_term):
+        return self.search.search_bills(search_term)
+
+
+pool = ConnectionPool(DB_PATH)
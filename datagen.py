@@ -0,0 +1,155 @@
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import date as _date, timedelta
+from credentials import hash_password
+from migrations import upgrade
+from scheduling import CHAIRS, DEFAULT_DURATION, to_minutes
+from search import FTS_TABLES
+from summaries import fill_summaries
+
+# Synthetic Clinic Data
+# Fills an empty database with a reproducible clinic: the same seed and sizes
+# always give the same rows. Appointments are laid out day by day in 30-minute
+# slots on every chair without overlaps, most slots taken; bills are spread
+# over the same period with prices per procedure.
+SEED = 42
+START_DATE = '2020-01-01'
+BATCH_SIZE = 50000
+
+# Scale name -> rows in the billing table; there are half as many
+# appointments and a fifth as many patients.
+SCALES = {
+    '10k': 10000,
+    '100k': 100000,
+    '1m': 1000000,
+    '5m': 5000000,
+}
+
+FIRST_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth',
+               'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+               'Amit', 'Priya', 'Rahul', 'Ananya', 'Wei', 'Mei', 'Omar', 'Fatima', 'Luis', 'Sofia')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+              'Sharma', 'Patel', 'Khan', 'Chen', 'Wang', 'Nguyen', 'Kim', 'Ali', 'Silva', 'Costa')
+GENDERS = ('Male', 'Female', 'Other')
+PROCEDURES = (
+    ('Checkup', 50), ('Cleaning', 80), ('X-Ray', 120), ('Filling', 150), ('Extraction', 200),
+    ('Root Canal', 700), ('Crown', 900), ('Whitening', 300), ('Braces Adjustment', 100), ('Implant Consultation', 150),
+)
+SLOTS_PER_DAY = 16
+SLOT_FILL = 0.8
+
+
+def table_sizes(scale):
+    bills = SCALES[scale] if scale in SCALES else int(scale)
+    return max(bills // 5, 1), bills // 2, bills
+
+
+def _patients(rng, count):
+    for index in range(count):
+        yield ('{} {}'.format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)), rng.randint(1, 95),
+               rng.choice(GENDERS), '555-{:07d}'.format(index))
+
+
+def _appointments(rng, count, patients, start):
+    day, slot, made = _date.fromisoformat(start), 0, 0
+    while made < count:
+        if slot == SLOTS_PER_DAY * CHAIRS:
+            day, slot = day + timedelta(days=1), 0
+        chair, index = slot // SLOTS_PER_DAY + 1, slot % SLOTS_PER_DAY
+        slot += 1
+        if rng.random() > SLOT_FILL:
+            continue
+        date = day.isoformat()
+        time_ = '{:02d}:{:02d}'.format(9 + index // 2, 30 * (index % 2))
+        start_ts = to_minutes(date, time_)
+        yield (rng.randint(1, patients), date, time_, rng.choice(PROCEDURES)[0], DEFAULT_DURATION, chair,
+               start_ts, start_ts + DEFAULT_DURATION)
+        made += 1
+
+
+def _bills(rng, count, patients, start, days):
+    first = _date.fromisoformat(start)
+    for _ in range(count):
+        procedure, price = rng.choice(PROCEDURES)
+        yield (rng.randint(1, patients), (first + timedelta(days=rng.randrange(days))).isoformat(),
+               round(price * rng.uniform(0.8, 1.2), 2), procedure)
+
+
+def _insert(conn, statement, rows, progress, label):
+    written, batch = 0, []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            conn.executemany(statement, batch)
+            written += len(batch)
+            batch = []
+            if progress:
+                progress(label, written)
+    if batch:
+        conn.executemany(statement, batch)
+        written += len(batch)
+    if progress:
+        progress(label, written)
+    return written
+
+
+def generate(conn, patients, appointments, bills, seed=SEED, start=START_DATE, users=10, progress=None):
+    upgrade(conn)
+    for table in ('patients', 'appointments', 'billing'):
+        if conn.execute('SELECT 1 FROM {} LIMIT 1'.format(table)).fetchone():
+            raise ValueError("Synthetic data needs an empty database; {} already has rows".format(table))
+    rng = random.Random(seed)
+    # Enough days for every appointment, and at least four years of billing
+    days = max(1461, int(appointments / (SLOTS_PER_DAY * CHAIRS * SLOT_FILL)) + 1)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        # Per-row index and summary triggers are dropped for the load; the
+        # indexes and summaries are then built once from the finished tables.
+        names = [fts + '_ai' for fts, _ in FTS_TABLES.values()] + ['billing_summary_ai']
+        triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({})".format(
+            ', '.join('?' * len(names))), names).fetchall()
+        for name, _ in triggers:
+            conn.execute('DROP TRIGGER {}'.format(name))
+        _insert(conn, 'INSERT INTO patients (name, age, gender, contact) VALUES (?, ?, ?, ?)',
+                _patients(rng, patients), progress, 'patients')
+        _insert(conn, 'INSERT INTO appointments (patient_id, date, time, description, duration, chair, start_ts, end_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                _appointments(rng, appointments, patients, start), progress, 'appointments')
+        _insert(conn, 'INSERT INTO billing (patient_id, date, amount, description) VALUES (?, ?, ?, ?)',
+                _bills(rng, bills, patients, start, days), progress, 'bills')
+        conn.executemany('INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)',
+                         [('user{}'.format(index), hash_password('password'), 'user') for index in range(1, users + 1)])
+        for fts, _ in FTS_TABLES.values():
+            if any(name == fts + '_ai' for name, _ in triggers):
+                conn.execute("INSERT INTO {fts} ({fts}) VALUES ('rebuild')".format(fts=fts))
+        fill_summaries(conn)
+        for _, sql in triggers:
+            conn.execute(sql)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic clinic database')
+    parser.add_argument('database')
+    parser.add_argument('--scale', default='10k', help='{} or a number of bills'.format(', '.join(SCALES)))
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--force', action='store_true', help='replace an existing database file')
+    args = parser.parse_args(argv)
+    if os.path.exists(args.database):
+        if not args.force:
+            parser.error('{} already exists (use --force to replace it)'.format(args.database))
+        os.remove(args.database)
+    patients, appointments, bills = table_sizes(args.scale)
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.database)
+    generate(conn, patients, appointments, bills, args.seed,
+             progress=lambda label, written: print('{}: {}'.format(label, written).ljust(30), end='\r'))
+    conn.close()
+    print('Generated {} patients, {} appointments and {} bills in {:.1f}s'.format(
+        patients, appointments, bills, time.perf_counter() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import metrics
+
+# Background Task
+# Handle returned by BackgroundExecutor.submit. A task is cancelled when a
+# newer task is submitted with the same key; its result is then dropped
+# instead of being delivered to the UI. A task submitted with a connection
+# pool also has the query it is running interrupted (ConnectionPool.interruptible).
+class BackgroundTask:
+    def __init__(self, key, name):
+        self.key = key
+        self.name = name
+        self.cancelled = False
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def timing(self):
+        return {
+            'name': self.name,
+            'queued_ms': (self.started - self.submitted) * 1000,
+            'run_ms': (self.finished - self.started) * 1000,
+        }
+
+
+# Background Executor
+# Runs blocking work (queries, report exports) on a bounded pool of worker
+# threads. Results are put on a queue which the Tk main loop drains with
+# root.after, so callbacks that touch widgets always run on the main thread.
+class BackgroundExecutor:
+    def __init__(self, root, max_workers=4, poll_interval=30, history=500):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dcms-worker')
+        self._results = queue.Queue()
+        self._calls = queue.Queue()
+        self._latest = {}
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.timings = deque(maxlen=history)
+        self._after_id = self.root.after(self.poll_interval, self._poll)
+
+    def submit(self, fn, *args, key=None, on_success=None, on_error=None, name=None, pool=None):
+        task = BackgroundTask(key, name or getattr(getattr(fn, 'func', fn), '__name__', repr(fn)))
+        if key is not None:
+            previous = self._latest.get(key)
+            if previous is not None:
+                previous.cancel()
+            self._latest[key] = task
+        with self._lock:
+            self.pending += 1
+            depth = self.pending
+        metrics.record('executor', 'queue depth', depth)
+        self._pool.submit(self._run, task, fn, args, on_success, on_error, pool)
+        return task
+
+    # Thread-safe: schedule fn(*args) to run on the Tk main thread, e.g. to
+    # report progress from inside a running task.
+    def call_soon(self, fn, *args):
+        self._calls.put((fn, args))
+
+    def _run(self, task, fn, args, on_success, on_error, pool):
+        result = error = None
+        task.started = time.perf_counter()
+        if not task.cancelled:
+            try:
+                if pool is None:
+                    result = fn(*args)
+                else:
+                    with pool.interruptible(lambda: task.cancelled):
+                        result = fn(*args)
+            except Exception as e:
+                error = e
+        task.finished = time.perf_counter()
+        with self._lock:
+            self.pending -= 1
+        self._results.put((task, result, error, on_success, on_error))
+
+    def _poll(self):
+        while True:
+            try:
+                fn, args = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception:
+                self.root.report_callback_exception(*sys.exc_info())
+        while True:
+            try:
+                task, result, error, on_success, on_error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if task.key is not None and self._latest.get(task.key) is task:
+                del self._latest[task.key]
+            if task.cancelled:
+                self.cancelled += 1
+                continue
+            self.completed += 1
+            timing = task.timing()
+            self.timings.append(timing)
+            metrics.record('task', task.name, timing['run_ms'])
+            metrics.record('task wait', task.name, timing['queued_ms'])
+            try:
+                if error is not None:
+                    if on_error is None:
+                        raise error
+                    on_error(error)
+                elif on_success is not None:
+                    on_success(result)
+            except Exception:
+                self.root.report_callback_exception(*sys.exc_info())
+        self._after_id = self.root.after(self.poll_interval, self._poll)
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+        }
+
+    def shutdown(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        for task in self._latest.values():
+            task.cancel()
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,191 @@
+import csv
+import os
+
+# Streaming Report Export
+# Rows are read from the cursor in chunks with fetchmany() and handed straight
+# to a format writer, so peak memory depends on the chunk size rather than on
+# the size of the table being exported.
+CHUNK_SIZE = 5000
+EXPORT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+REPORTS = {
+    'patient': ('patient_report', 'patients', 'SELECT id, name, age, gender, contact FROM patients ORDER BY id'),
+    'financial': ('financial_report', 'billing', 'SELECT id, patient_id, date, amount, description FROM billing ORDER BY id'),
+}
+
+
+class XlsxWriter:
+    MAX_ROWS = 1048576
+
+    def __init__(self, path, columns, types=None):
+        from openpyxl import Workbook
+        self.path = path
+        self.columns = columns
+        self.workbook = Workbook(write_only=True)
+        self._new_sheet()
+
+    def _new_sheet(self):
+        title = 'Sheet{}'.format(len(self.workbook.worksheets) + 1)
+        self.sheet = self.workbook.create_sheet(title)
+        self.sheet.append(self.columns)
+        self.sheet_rows = 1
+
+    def write(self, rows):
+        for row in rows:
+            # Spill over into a new sheet at Excel's row limit
+            if self.sheet_rows >= self.MAX_ROWS:
+                self._new_sheet()
+            self.sheet.append(row)
+            self.sheet_rows += 1
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class CsvWriter:
+    def __init__(self, path, columns, types=None):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    # Declared SQLite column types, used instead of guessing from the first chunk
+    ARROW_TYPES = {'INTEGER': 'int64', 'REAL': 'float64', 'TEXT': 'string'}
+
+    def __init__(self, path, columns, types=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet export requires the 'pyarrow' package")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.columns = columns
+        self.types = types or {}
+        self.schema = None
+        self.writer = None
+
+    def write(self, rows):
+        data = list(zip(*rows))
+        if self.schema is None:
+            arrays = [self._first_array(name, values) for name, values in zip(self.columns, data)]
+            self.schema = self.pa.schema([self.pa.field(name, array.type) for name, array in zip(self.columns, arrays)])
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        else:
+            arrays = [self._array(values, field) for values, field in zip(data, self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    # The declared type, or text when a value does not fit it: SQLite lets a
+    # legacy row hold text in an INTEGER or REAL column. Undeclared columns
+    # take the type pyarrow infers.
+    def _first_array(self, name, values):
+        declared = self.ARROW_TYPES.get(self.types.get(name, '').upper())
+        if declared:
+            try:
+                return self.pa.array(values, type=self.pa.type_for_alias(declared))
+            except self.pa.ArrowException:
+                return self._text(values)
+        try:
+            array = self.pa.array(values)
+        except self.pa.ArrowException:
+            array = None
+        if array is None or self.pa.types.is_null(array.type):
+            return self._text(values)
+        return array
+
+    def _array(self, values, field):
+        try:
+            return self.pa.array(values, type=field.type)
+        except self.pa.ArrowException:
+            if self.pa.types.is_string(field.type):
+                return self._text(values)
+            raise ValueError("Column '{}' holds values that are not {}".format(field.name, field.type))
+
+    def _text(self, values):
+        return self.pa.array([None if value is None else str(value) for value in values], type=self.pa.string())
+
+    def close(self):
+        if self.writer is None:
+            self.schema = self.pa.schema([self.pa.field(name, self.pa.string()) for name in self.columns])
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        self.writer.close()
+
+
+WRITERS = {
+    'xlsx': XlsxWriter,
+    'csv': CsvWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def export_query(conn, query, path, params=(), fmt=None, chunk_size=CHUNK_SIZE, progress=None, total=None, types=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in WRITERS:
+        raise ValueError("Unsupported export format '{}'".format(fmt))
+    cursor = conn.execute(query, params)
+    columns = [description[0] for description in cursor.description]
+    writer = WRITERS[fmt](path, columns, types)
+    written = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            writer.write(rows)
+            written += len(rows)
+            if progress is not None:
+                progress(written, total)
+    finally:
+        cursor.close()
+        writer.close()
+    return written
+
+
+def export_rows(columns, rows, path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in WRITERS:
+        raise ValueError("Unsupported export format '{}'".format(fmt))
+    writer = WRITERS[fmt](path, list(columns))
+    try:
+        if rows:
+            writer.write(rows)
+    finally:
+        writer.close()
+    return path
+
+
+# Storage classes each declared type can be exported as without loss
+STORAGE_CLASSES = {'INTEGER': ('integer',), 'REAL': ('integer', 'real')}
+
+
+# The declared types of table's columns, with TEXT for any column holding a
+# value of another storage class, which SQLite's type affinity allows in
+# legacy rows (an age of "n/a"). Checked in one pass over the table.
+def stored_types(conn, table, types):
+    checked = [name for name, declared in types.items() if declared.upper() in STORAGE_CLASSES]
+    if not checked:
+        return types
+    mistyped = conn.execute('SELECT {} FROM {}'.format(', '.join(
+        "MAX(typeof({}) NOT IN ('null', {}))".format(name, ', '.join("'{}'".format(c) for c in STORAGE_CLASSES[types[name].upper()]))
+        for name in checked), table)).fetchone()
+    mistyped = dict(zip(checked, mistyped))
+    return {name: 'TEXT' if mistyped.get(name) else declared for name, declared in types.items()}
+
+
+def export_report(conn, report, fmt='xlsx', path=None, chunk_size=CHUNK_SIZE, progress=None):
+    name, table, query = REPORTS[report]
+    path = path or '{}.{}'.format(name, fmt)
+    total = conn.execute('SELECT COUNT(*) FROM {}'.format(table)).fetchone()[0]
+    types = {row[1]: row[2] for row in conn.execute('PRAGMA table_info({})'.format(table))}
+    if fmt == 'parquet':
+        types = stored_types(conn, table, types)
+    export_query(conn, query, path, fmt=fmt, chunk_size=chunk_size, progress=progress, total=total, types=types)
+    return path
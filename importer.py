@@ -0,0 +1,268 @@
+import csv
+import os
+import sqlite3
+import sys
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from changefeed import ChangeFeed, change_trigger, log_bulk_change
+from scheduling import Scheduler, SchedulingConflict, to_minutes
+from search import index_rows_after, insert_trigger
+from validation import validate_appointment, validate_bill, validate_patient
+
+# Bulk Import
+# Rows are streamed from a CSV or XLSX file, checked with the same validators
+# as the entry forms and inserted with executemany(), one transaction per
+# batch, with the full-text index filled once per batch instead of by the
+# per-row trigger, and one change log entry per batch (see changefeed.py)
+# instead of one per row. Rows that fail validation or the insert are written to a
+# reject file with their line number and the reason, and the import carries on.
+# Appointments that would double-book a chair are rejected too, as
+# add_appointment would refuse them.
+BATCH_SIZE = 5000
+IMPORT_FORMATS = ('.csv', '.xlsx', '.xlsm')
+
+
+def _appointment(*values):
+    patient_id, date, time_, description, duration, chair = validate_appointment(*values)
+    start = to_minutes(date, time_)
+    return patient_id, date, time_, description, duration, chair, start, start + duration
+
+
+# Checks a batch of appointments inside its write transaction: each row
+# against the chair's bookings with the scheduler's range query (which sees
+# earlier batches and other writers), and against the rows accepted earlier
+# in the batch, kept per chair sorted by start. Accepted rows never overlap,
+# so only the neighbours either side of a new row can clash with it.
+_scheduler = Scheduler()
+
+
+def _unbooked(conn, batch):
+    accepted, rejected, booked = [], [], {}
+    for line, row, values in batch:
+        patient_id, date, time_, description, duration, chair, start, end = values[-8:]
+        conflicts = _scheduler.bookings(conn, chair, start, end)
+        starts, rows = booked.setdefault(chair, ([], []))
+        index = bisect_left(starts, start)
+        for neighbour in rows[max(index - 1, 0):index + 1]:
+            if neighbour[6] < end and start < neighbour[7]:
+                conflicts.append(neighbour)
+        if conflicts:
+            rejected.append((line, row, str(SchedulingConflict(conflicts, []))))
+            continue
+        starts.insert(index, start)
+        rows.insert(index, (None, patient_id, date, time_, description, duration, start, end))
+        accepted.append((line, row, values))
+    return accepted, rejected
+
+
+# table -> check run on a batch inside its transaction, returning the rows to
+# insert and the (line, row, reason) of the others
+CHECKS = {
+    'appointments': _unbooked,
+}
+
+
+def _record_id(value):
+    try:
+        record_id = int(str(value).strip())
+    except ValueError:
+        raise ValueError("ID must be a positive number")
+    if record_id <= 0:
+        raise ValueError("ID must be a positive number")
+    return record_id
+
+
+# table -> (fields read from the file, optional fields and their defaults,
+#           validator returning the insert values, inserted columns)
+IMPORTS = {
+    'patients': (('name', 'age', 'gender', 'contact'), {}, validate_patient,
+                 ('name', 'age', 'gender', 'contact')),
+    'appointments': (('patient_id', 'date', 'time', 'description', 'duration', 'chair'), {'duration': None, 'chair': None}, _appointment,
+                     ('patient_id', 'date', 'time', 'description', 'duration', 'chair', 'start_ts', 'end_ts')),
+    'billing': (('patient_id', 'date', 'amount', 'description'), {}, validate_bill,
+                ('patient_id', 'date', 'amount', 'description')),
+}
+
+
+class ImportResult(namedtuple('ImportResult', 'table imported rejected seconds reject_path')):
+    @property
+    def rows_per_second(self):
+        return (self.imported + self.rejected) / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        message = "Imported {} {} rows, rejected {} ({:.0f} rows/sec)".format(self.imported, self.table, self.rejected, self.rows_per_second)
+        if self.rejected:
+            message += "; rejected rows written to {}".format(self.reject_path)
+        return message
+
+
+def read_rows(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in IMPORT_FORMATS:
+        raise ValueError("Import files must be CSV or XLSX")
+    if extension == '.csv':
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            yield from csv.reader(file)
+        return
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        header = None
+        # Exports spill over into several sheets, each starting with the header
+        for sheet in workbook.worksheets:
+            for index, row in enumerate(sheet.iter_rows(values_only=True)):
+                if index == 0 and header is not None and list(row) == header:
+                    continue
+                if header is None:
+                    header = list(row)
+                yield list(row)
+    finally:
+        workbook.close()
+
+
+def _column(name):
+    return str(name or '').strip().lower().replace(' ', '_')
+
+
+def _positions(header, fields, optional):
+    columns = [_column(name) for name in header]
+    missing = [field for field in fields if field not in columns and field not in optional]
+    if missing:
+        raise ValueError("Missing columns: {}".format(', '.join(missing)))
+    return [columns.index(field) if field in columns else None for field in fields], \
+        columns.index('id') if 'id' in columns else None
+
+
+class RejectWriter:
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.file = None
+        self.count = 0
+
+    def write(self, line, row, reason):
+        if self.file is None:
+            self.file = open(self.path, 'w', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['line', 'error'] + list(self.header))
+        self.writer.writerow([line, reason] + list(row))
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+# logged(first, last), if given, is called after each commit with the change
+# log entries the transaction wrote (see ChangeFeed.own)
+def _insert_batch(conn, table, statement, batch, rejects, bulk_index, logged=None):
+    try:
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            first = ChangeFeed.position(conn)
+            accepted, rejected = CHECKS[table](conn, batch) if table in CHECKS else (batch, [])
+            trigger = insert_trigger(conn, table) if bulk_index else None
+            change = change_trigger(conn, table) if bulk_index else None
+            if trigger:
+                # New AUTOINCREMENT ids are always above the current maximum
+                last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM {}'.format(table)).fetchone()[0]
+                conn.execute('DROP TRIGGER {}'.format(trigger[0]))
+            if change:
+                conn.execute('DROP TRIGGER {}'.format(change[0]))
+            conn.executemany(statement, [values for _, _, values in accepted])
+            if trigger:
+                index_rows_after(conn, table, last_id)
+                conn.execute(trigger[1])
+            if change:
+                conn.execute(change[1])
+                log_bulk_change(conn, table)
+            last = ChangeFeed.position(conn)
+        for line, row, reason in rejected:
+            rejects.write(line, row, reason)
+        if logged:
+            logged(first, last)
+        return len(accepted)
+    except sqlite3.IntegrityError:
+        pass
+    # A single bad row (such as a duplicate id) fails the whole executemany;
+    # redo the batch row by row so only the offending rows are rejected. Each
+    # row is checked on its own, against the rows inserted before it.
+    imported = 0
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        first = ChangeFeed.position(conn)
+        for line, row, values in batch:
+            if table in CHECKS:
+                _, rejected = CHECKS[table](conn, [(line, row, values)])
+                if rejected:
+                    rejects.write(*rejected[0])
+                    continue
+            try:
+                conn.execute(statement, values)
+                imported += 1
+            except sqlite3.IntegrityError as e:
+                rejects.write(line, row, str(e))
+        last = ChangeFeed.position(conn)
+    if logged:
+        logged(first, last)
+    return imported
+
+
+def import_file(conn, table, path, reject_path=None, batch_size=BATCH_SIZE, progress=None, logged=None):
+    fields, optional, validate, columns = IMPORTS[table]
+    rows = read_rows(path)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("{} is empty".format(path))
+    positions, id_position = _positions(header, fields, optional)
+    # Rows keep their ids when the file has an id column; they may then land
+    # below existing ids, so the search index is updated by the trigger instead.
+    bulk_index = id_position is None
+    if id_position is not None:
+        columns = ('id',) + columns
+    statement = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+    rejects = RejectWriter(reject_path or os.path.splitext(path)[0] + '_rejects.csv', header)
+    started = time.perf_counter()
+    imported = 0
+    batch = []
+    try:
+        for line, row in enumerate(rows, start=2):
+            if all(value is None or str(value).strip() == '' for value in row):
+                continue
+            values = [row[position] if position is not None and position < len(row) else optional.get(field)
+                      for field, position in zip(fields, positions)]
+            try:
+                values = validate(*values)
+                if id_position is not None:
+                    values = (_record_id(row[id_position]),) + tuple(values)
+            except ValueError as e:
+                rejects.write(line, row, str(e))
+                continue
+            batch.append((line, row, values))
+            if len(batch) >= batch_size:
+                imported += _insert_batch(conn, table, statement, batch, rejects, bulk_index, logged)
+                batch = []
+                if progress:
+                    progress(imported, rejects.count)
+        if batch:
+            imported += _insert_batch(conn, table, statement, batch, rejects, bulk_index, logged)
+        if progress:
+            progress(imported, rejects.count)
+    finally:
+        rejects.close()
+    return ImportResult(table, imported, rejects.count, time.perf_counter() - started, rejects.path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in IMPORTS:
+        print('Usage: python importer.py [{}] file.csv|file.xlsx [database]'.format('|'.join(IMPORTS)))
+        sys.exit(2)
+    from database import DB_PATH
+    from migrations import upgrade
+    conn = sqlite3.connect(sys.argv[3] if len(sys.argv) > 3 else DB_PATH)
+    upgrade(conn)
+    print(import_file(conn, sys.argv[1], sys.argv[2],
+                      progress=lambda imported, rejected: print('{} imported, {} rejected'.format(imported, rejected), end='\r')))
+    conn.close()
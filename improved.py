@@ -1,61 +1,28 @@
+import time
+started = time.perf_counter()
+import sys
 import tkinter as tk
-from tkinter import messagebox, ttk
+from tkinter import filedialog, messagebox, ttk
 import sqlite3
-import pandas as pd
-from openpyxl import Workbook
-from functools import partial
-import threading
+from datetime import date as _date, timedelta
+from services import clinic
+from executor import BackgroundExecutor
+from pagination import IncrementalSearch, SortableHeadings, VirtualTreeview
+from scheduling import DEFAULT_DURATION, SchedulingConflict, week_start
+from instrumentation import StartupTrace, metrics, timed
+
+# Startup
+# Importing this module has no side effects: the database is upgraded by the
+# main block, where that costs one read once the schema is current. Tabs are
+# built the first time they are selected and the report modules are imported
+# by the Reports tab. Run with --trace-startup to print how long each step
+# took; the same timings are on the Diagnostics tab under 'startup'.
+trace = StartupTrace(started)
+trace.mark('imports')
 
 # Database Setup
 def setup_database():
-    conn = sqlite3.connect('dental_clinic.db')
-    c = conn.cursor()
-
-    # Create Users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL,
-                    password TEXT NOT NULL,
-                    role TEXT NOT NULL
-                )''')
-
-    # Create Patients table
-    c.execute('''CREATE TABLE IF NOT EXISTS patients (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    age INTEGER,
-                    gender TEXT,
-                    contact TEXT
-                )''')
-
-    # Create Appointments table
-    c.execute('''CREATE TABLE IF NOT EXISTS appointments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    date TEXT,
-                    time TEXT,
-                    description TEXT,
-                    FOREIGN KEY (patient_id) REFERENCES patients (id)
-                )''')
-
-    # Create Billing table
-    c.execute('''CREATE TABLE IF NOT EXISTS billing (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    date TEXT,
-                    amount REAL,
-                    description TEXT,
-                    FOREIGN KEY (patient_id) REFERENCES patients (id)
-                )''')
-
-    # Create a default admin user
-    c.execute('INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)',
-              ('admin', 'admin', 'admin'))
-
-    conn.commit()
-    conn.close()
-
-setup_database()
+    clinic.setup()
 
 # Main Application
 class DentalClinicApp:
@@ -64,8 +31,19 @@ class DentalClinicApp:
         self.root.title("Dental Clinic Management System")
         self.root.geometry("800x600")
         self.current_user_role = None
+        self.chart = None
+        self.schedule = None
+        self.executor = BackgroundExecutor(self.root)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.create_login_screen()
 
+    # Commits the bills still queued (added with wait=False) before the
+    # window goes; clinic.close() also stops the change feed.
+    def on_close(self):
+        self.executor.shutdown()
+        clinic.close()
+        self.root.destroy()
+
     def create_login_screen(self):
         self.login_frame = tk.Frame(self.root)
         self.login_frame.pack(fill='both', expand=True)
@@ -79,49 +57,112 @@ class DentalClinicApp:
         self.username_entry.grid(row=0, column=1, padx=10, pady=10, sticky='w')
         self.password_entry.grid(row=1, column=1, padx=10, pady=10, sticky='w')
 
-        tk.Button(self.login_frame, text="Login", command=self.authenticate_user).grid(row=2, column=0, columnspan=2, padx=10, pady=10)
+        self.login_button = tk.Button(self.login_frame, text="Login", command=self.authenticate_user)
+        self.login_button.grid(row=2, column=0, columnspan=2, padx=10, pady=10)
+        self.password_entry.bind('<Return>', lambda event: self.authenticate_user())
+        self.login_frame.bind('<Map>', self.login_shown)
+
+    def login_shown(self, event):
+        self.login_frame.unbind('<Map>')
+        trace.mark('login screen')
+        if '--trace-startup' in sys.argv:
+            print(trace.report())
 
+    # The password hash is checked on a worker thread so the window stays responsive
     def authenticate_user(self):
+        if str(self.login_button['state']) == 'disabled':
+            return
         username = self.username_entry.get()
         password = self.password_entry.get()
 
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('SELECT role FROM users WHERE username = ? AND password = ?', (username, password))
-        user = c.fetchone()
-        conn.close()
+        self.login_button.config(state='disabled')
+        self.executor.submit(clinic.users.authenticate, username, password, on_success=self.logged_in, on_error=self.login_failed, name='login')
 
-        if user:
-            self.current_user_role = user[0]
+    def logged_in(self, role):
+        if role:
+            self.current_user_role = role
             self.login_frame.destroy()
             self.create_main_interface()
         else:
+            self.login_button.config(state='normal')
             messagebox.showerror("Login Error", "Invalid username or password")
 
+    def login_failed(self, error):
+        self.login_button.config(state='normal')
+        if isinstance(error, sqlite3.Error):
+            messagebox.showerror("Database Error", str(error))
+        else:
+            messagebox.showerror("Login Error", str(error))
+
+    # Only the Patients tab is built at login; the others are built, and
+    # their first page loaded, when first selected
     def create_main_interface(self):
         self.tab_control = ttk.Notebook(self.root)
         self.tab_patients = ttk.Frame(self.tab_control)
         self.tab_appointments = ttk.Frame(self.tab_control)
+        self.tab_schedule = ttk.Frame(self.tab_control)
         self.tab_billing = ttk.Frame(self.tab_control)
         self.tab_reports = ttk.Frame(self.tab_control)
         self.tab_users = ttk.Frame(self.tab_control)
+        self.tab_diagnostics = ttk.Frame(self.tab_control)
 
         self.tab_control.add(self.tab_patients, text='Patients')
         self.tab_control.add(self.tab_appointments, text='Appointments')
+        self.tab_control.add(self.tab_schedule, text='Schedule')
         self.tab_control.add(self.tab_billing, text='Billing')
         self.tab_control.add(self.tab_reports, text='Reports')
 
         if self.current_user_role == 'admin':
             self.tab_control.add(self.tab_users, text='Users')
+            self.tab_control.add(self.tab_diagnostics, text='Diagnostics')
 
         self.tab_control.pack(expand=1, fill='both')
 
-        self.create_patients_tab()
-        self.create_appointments_tab()
-        self.create_billing_tab()
-        self.create_reports_tab()
+        self.tab_builders = {
+            str(self.tab_patients): self.create_patients_tab,
+            str(self.tab_appointments): self.create_appointments_tab,
+            str(self.tab_schedule): self.create_schedule_tab,
+            str(self.tab_billing): self.create_billing_tab,
+            str(self.tab_reports): self.create_reports_tab,
+        }
         if self.current_user_role == 'admin':
-            self.create_users_tab()
+            self.tab_builders[str(self.tab_users)] = self.create_users_tab
+            self.tab_builders[str(self.tab_diagnostics)] = self.create_diagnostics_tab
+        self.tab_control.bind('<<NotebookTabChanged>>', self.build_selected_tab)
+        self.build_selected_tab()
+        clinic.repository.subscribe(self.row_changed)
+        clinic.changes.start()
+
+    def build_selected_tab(self, event=None):
+        tab = self.tab_control.select()
+        build = self.tab_builders.pop(tab, None)
+        if build is not None:
+            with timed('startup', 'tab ' + self.tab_control.tab(tab, 'text')):
+                build()
+
+    # Every write made through the repository is reported with the changed
+    # row, on whichever thread committed it, and so is every write another
+    # workstation makes, found by the change feed's polling thread. The row is
+    # patched into its list on the main thread instead of the list being
+    # reloaded; a bulk change (row_id None) reloads the list.
+    LISTS = {'patients': 'patient_view', 'appointments': 'appointment_view', 'billing': 'billing_view'}
+
+    def row_changed(self, table, row_id, row):
+        if table in self.LISTS:
+            self.executor.call_soon(self.show_change, table, row_id, row)
+
+    def show_change(self, table, row_id, row):
+        if self.chart is not None:
+            self.chart.changed(table, row_id, row)
+        if self.schedule is not None and self.schedule.affected(table, row_id, row):
+            self.load_schedule()
+        view = getattr(self, self.LISTS[table], None)
+        if view is None:
+            return
+        if row_id is None:
+            view.reload()
+        else:
+            view.apply(row_id, row)
 
     def create_users_tab(self):
         self.users_frame = tk.Frame(self.tab_users)
@@ -156,6 +197,7 @@ class DentalClinicApp:
 
         self.users_frame.grid_rowconfigure(4, weight=1)
         self.users_frame.grid_columnconfigure(1, weight=1)
+        self.view_users()
 
     def add_user(self):
         username = self.user_username.get()
@@ -166,21 +208,14 @@ class DentalClinicApp:
             messagebox.showwarning("Warning", "All fields are required")
             return
 
-        if role.lower() not in ["admin", "user"]:
-            messagebox.showerror("Error", "Role must be 'admin' or 'user'")
-            return
-
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
         try:
-            c.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)', (username, password, role))
-            conn.commit()
+            clinic.users.add(username, password, role)
             messagebox.showinfo("Success", "User added successfully")
             self.view_users()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def update_user(self):
         selected_item = self.user_tree.selection()
@@ -197,21 +232,14 @@ class DentalClinicApp:
             messagebox.showwarning("Warning", "All fields are required")
             return
 
-        if role.lower() not in ["admin", "user"]:
-            messagebox.showerror("Error", "Role must be 'admin' or 'user'")
-            return
-
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
         try:
-            c.execute('UPDATE users SET username = ?, password = ?, role = ? WHERE id = ?', (username, password, role, user_id))
-            conn.commit()
+            clinic.users.update(user_id, username, password, role)
             messagebox.showinfo("Success", "User updated successfully")
             self.view_users()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def delete_user(self):
         selected_item = self.user_tree.selection()
@@ -220,28 +248,135 @@ class DentalClinicApp:
             return
 
         user_id = self.user_tree.item(selected_item)['values'][0]
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
         try:
-            c.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            conn.commit()
+            clinic.users.delete(user_id)
             messagebox.showinfo("Success", "User deleted successfully")
             self.view_users()
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def view_users(self):
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        c.execute('SELECT id, username, role FROM users')
-        users = c.fetchall()
-        conn.close()
+        users = clinic.users.list()
         self.user_tree.delete(*self.user_tree.get_children())
         for user in users:
             self.user_tree.insert('', 'end', values=user)
 
+    # Diagnostics: query, Treeview and background task timings from the
+    # instrumentation layer, plus the slow-query log with its query plans
+    def create_diagnostics_tab(self):
+        self.diagnostics_frame = tk.Frame(self.tab_diagnostics)
+        self.diagnostics_frame.pack(fill='both', expand=True)
+
+        tk.Button(self.diagnostics_frame, text="Refresh", command=self.refresh_diagnostics).grid(row=0, column=0, padx=10, pady=10, sticky='w')
+        tk.Button(self.diagnostics_frame, text="Reset", command=self.reset_diagnostics).grid(row=0, column=1, padx=10, pady=10, sticky='w')
+        tk.Button(self.diagnostics_frame, text="Export...", command=self.export_diagnostics).grid(row=0, column=2, padx=10, pady=10, sticky='w')
+        self.diagnostics_status = tk.Label(self.diagnostics_frame, text="")
+        self.diagnostics_status.grid(row=0, column=3, padx=10, pady=10, sticky='w')
+
+        self.metrics_tree = ttk.Treeview(self.diagnostics_frame, columns=metrics.COLUMNS, show='headings')
+        for column in metrics.COLUMNS:
+            self.metrics_tree.heading(column, text=column)
+            self.metrics_tree.column(column, width=300 if column == 'Name' else 60, stretch=column == 'Name')
+        self.metrics_tree.grid(row=1, column=0, columnspan=4, padx=10, pady=10, sticky='nsew')
+
+        self.metrics_tree_scrollbar = ttk.Scrollbar(self.diagnostics_frame, orient='vertical', command=self.metrics_tree.yview)
+        self.metrics_tree.configure(yscroll=self.metrics_tree_scrollbar.set)
+        self.metrics_tree_scrollbar.grid(row=1, column=4, sticky='ns')
+
+        tk.Label(self.diagnostics_frame, text="Slow queries (over {} ms)".format(metrics.slow_ms)).grid(row=2, column=0, columnspan=4, padx=10, sticky='w')
+        self.slow_query_tree = ttk.Treeview(self.diagnostics_frame, columns=("Time", "ms", "Rows", "SQL"), show='headings', height=5)
+        for column, width in (("Time", 140), ("ms", 60), ("Rows", 60), ("SQL", 400)):
+            self.slow_query_tree.heading(column, text=column)
+            self.slow_query_tree.column(column, width=width, stretch=column == "SQL")
+        self.slow_query_tree.grid(row=3, column=0, columnspan=4, padx=10, pady=10, sticky='nsew')
+        self.slow_query_tree.bind('<<TreeviewSelect>>', self.show_query_plan)
+
+        self.query_plan = tk.Text(self.diagnostics_frame, height=5, state='disabled')
+        self.query_plan.grid(row=4, column=0, columnspan=4, padx=10, pady=10, sticky='nsew')
+
+        self.diagnostics_frame.grid_rowconfigure(1, weight=1)
+        self.diagnostics_frame.grid_columnconfigure(3, weight=1)
+        self.refresh_diagnostics()
+
+    def refresh_diagnostics(self):
+        self.metrics_tree.delete(*self.metrics_tree.get_children())
+        for row in metrics.summary():
+            self.metrics_tree.insert('', 'end', values=row)
+        self.slow_queries = list(metrics.slow_queries)
+        self.slow_query_tree.delete(*self.slow_query_tree.get_children())
+        for index, query in enumerate(self.slow_queries):
+            self.slow_query_tree.insert('', 0, iid=str(index), values=(query['time'], query['ms'], query['rows'], query['sql']))
+        self.diagnostics_status.config(text="Connections: {open_connections} open, {reused} reused | Tasks: {pending} pending, {completed} done".format(
+            **clinic.pool.stats(), **self.executor.stats()) + self.cache_status())
+
+    def cache_status(self):
+        if clinic.patient_cache is None:
+            return ""
+        stats = clinic.patient_cache.stats()
+        charts = clinic.patients.charts.stats()
+        return " | Patient cache: {:.0%} hits, {} evictions | Search cache: {:.0%} hits, {} narrowed | Chart cache: {:.0%} hits".format(
+            stats['records']['hit_rate'], stats['records']['evictions'], stats['searches']['hit_rate'], stats['searches']['narrowed'], charts['hit_rate'])
+
+    def show_query_plan(self, event):
+        selected = self.slow_query_tree.selection()
+        if not selected:
+            return
+        query = self.slow_queries[int(selected[0])]
+        self.query_plan.config(state='normal')
+        self.query_plan.delete('1.0', 'end')
+        self.query_plan.insert('end', '{}\nParameters: {}\n\n{}'.format(query['sql'], query['parameters'], '\n'.join(query['plan'])))
+        self.query_plan.config(state='disabled')
+
+    def reset_diagnostics(self):
+        metrics.reset()
+        self.refresh_diagnostics()
+
+    def export_diagnostics(self):
+        path = filedialog.asksaveasfilename(title="Export Diagnostics", defaultextension='.json',
+                                            initialfile='diagnostics.json', filetypes=[("JSON", '*.json')])
+        if not path:
+            return
+        try:
+            metrics.export(path, {'pool': clinic.pool.stats(), 'executor': self.executor.stats(),
+                                  'recent_tasks': list(self.executor.timings),
+                                  'patient_cache': clinic.patient_cache.stats() if clinic.patient_cache else None,
+                                  'write_queue': clinic.writes.stats() if clinic.writes else None})
+            messagebox.showinfo("Success", "Diagnostics exported to {}".format(path))
+        except OSError as e:
+            messagebox.showerror("Export Error", str(e))
+
+    # Filter bar above a tab's Treeview. fields are (label, filter name,
+    # choices or None for a free-text entry); the filters run in SQL.
+    def create_filter_bar(self, frame, sorting, fields):
+        bar = tk.Frame(frame)
+        bar.grid(row=5, column=0, columnspan=5, padx=10, sticky='w')
+        entries = {}
+        for column, (label, name, choices) in enumerate(fields):
+            tk.Label(bar, text=label).grid(row=0, column=2 * column, padx=(0, 5), sticky='w')
+            if choices:
+                entry = ttk.Combobox(bar, values=choices, state='readonly', width=8)
+            else:
+                entry = tk.Entry(bar, width=11)
+            entry.grid(row=0, column=2 * column + 1, padx=(0, 10), sticky='w')
+            entries[name] = entry
+
+        def apply():
+            try:
+                sorting.filter(**{name: entry.get() for name, entry in entries.items()})
+            except ValueError as e:
+                messagebox.showerror("Filter Error", str(e))
+
+        def clear():
+            for entry in entries.values():
+                if isinstance(entry, ttk.Combobox):
+                    entry.set('')
+                else:
+                    entry.delete(0, tk.END)
+            sorting.filter()
+
+        tk.Button(bar, text="Filter", command=apply).grid(row=0, column=2 * len(fields), padx=(0, 5))
+        tk.Button(bar, text="Clear", command=clear).grid(row=0, column=2 * len(fields) + 1)
+
     def create_patients_tab(self):
         self.patients_frame = tk.Frame(self.tab_patients)
         self.patients_frame.pack(fill='both', expand=True)
@@ -268,6 +403,7 @@ class DentalClinicApp:
         tk.Button(self.patients_frame, text="Update Patient", command=self.update_patient).grid(row=4, column=1, padx=10, pady=10, sticky='w')
         tk.Button(self.patients_frame, text="Delete Patient", command=self.delete_patient).grid(row=4, column=2, padx=10, pady=10, sticky='w')
         tk.Button(self.patients_frame, text="View Patients", command=self.view_patients).grid(row=4, column=3, padx=10, pady=10, sticky='w')
+        tk.Button(self.patients_frame, text="Open Chart", command=self.open_chart).grid(row=4, column=4, padx=10, pady=10, sticky='w')
         tk.Button(self.patients_frame, text="Search", command=self.search_patients).grid(row=0, column=4, padx=10, pady=10, sticky='w')
 
         self.patient_tree = ttk.Treeview(self.patients_frame, columns=("ID", "Name", "Age", "Gender", "Contact"), show='headings')
@@ -276,35 +412,48 @@ class DentalClinicApp:
         self.patient_tree.heading("Age", text="Age")
         self.patient_tree.heading("Gender", text="Gender")
         self.patient_tree.heading("Contact", text="Contact")
-        self.patient_tree.grid(row=5, column=0, columnspan=5, padx=10, pady=10, sticky='nsew')
+        self.patient_tree.grid(row=6, column=0, columnspan=5, padx=10, pady=10, sticky='nsew')
+        self.patient_tree.bind('<Double-1>', lambda event: self.open_chart())
 
         self.patient_tree_scrollbar = ttk.Scrollbar(self.patients_frame, orient='vertical', command=self.patient_tree.yview)
-        self.patient_tree.configure(yscroll=self.patient_tree_scrollbar.set)
-        self.patient_tree_scrollbar.grid(row=5, column=5, sticky='ns')
+        self.patient_view = VirtualTreeview(self.patient_tree, self.patient_tree_scrollbar, clinic.patients.view().page, executor=self.executor, name='patients', pool=clinic.pool)
+        self.patient_search = IncrementalSearch(self.search_patient_entry, self.patient_view, clinic.patients.search)
+        self.patient_sorting = SortableHeadings(self.patient_view, clinic.patients.view, {'ID': 'id', 'Name': 'name', 'Age': 'age'})
+        self.patient_tree_scrollbar.grid(row=6, column=5, sticky='ns')
+        self.create_filter_bar(self.patients_frame, self.patient_sorting, [('Gender', 'gender', ('', 'Male', 'Female', 'Other')), ('Age from', 'age_from', None), ('Age to', 'age_to', None)])
 
-        self.patients_frame.grid_rowconfigure(5, weight=1)
+        self.patients_frame.grid_rowconfigure(6, weight=1)
         self.patients_frame.grid_columnconfigure(1, weight=1)
+        self.view_patients()
 
     def create_appointments_tab(self):
         self.appointments_frame = tk.Frame(self.tab_appointments)
         self.appointments_frame.pack(fill='both', expand=True)
 
         tk.Label(self.appointments_frame, text="Patient ID").grid(row=0, column=0, padx=10, pady=10, sticky='w')
-        tk.Label(self.appointments_frame, text="Date (DD-MM-YYYY)").grid(row=1, column=0, padx=10, pady=10, sticky='w')
+        tk.Label(self.appointments_frame, text="Date (YYYY-MM-DD)").grid(row=1, column=0, padx=10, pady=10, sticky='w')
         tk.Label(self.appointments_frame, text="Time (HH:MM)").grid(row=2, column=0, padx=10, pady=10, sticky='w')
         tk.Label(self.appointments_frame, text="Description").grid(row=3, column=0, padx=10, pady=10, sticky='w')
         tk.Label(self.appointments_frame, text="Search").grid(row=0, column=2, padx=10, pady=10, sticky='w')
+        tk.Label(self.appointments_frame, text="Duration (min)").grid(row=1, column=2, padx=10, pady=10, sticky='w')
+        tk.Label(self.appointments_frame, text="Chair").grid(row=2, column=2, padx=10, pady=10, sticky='w')
 
         self.appointment_patient_id = tk.Entry(self.appointments_frame)
         self.appointment_date = tk.Entry(self.appointments_frame)
         self.appointment_time = tk.Entry(self.appointments_frame)
         self.appointment_description = tk.Entry(self.appointments_frame)
+        self.appointment_duration = tk.Entry(self.appointments_frame)
+        self.appointment_chair = tk.Entry(self.appointments_frame)
         self.search_appointment_entry = tk.Entry(self.appointments_frame)
+        self.appointment_duration.insert(0, str(DEFAULT_DURATION))
+        self.appointment_chair.insert(0, "1")
 
         self.appointment_patient_id.grid(row=0, column=1, padx=10, pady=10, sticky='w')
         self.appointment_date.grid(row=1, column=1, padx=10, pady=10, sticky='w')
         self.appointment_time.grid(row=2, column=1, padx=10, pady=10, sticky='w')
         self.appointment_description.grid(row=3, column=1, padx=10, pady=10, sticky='w')
+        self.appointment_duration.grid(row=1, column=3, padx=10, pady=10, sticky='w')
+        self.appointment_chair.grid(row=2, column=3, padx=10, pady=10, sticky='w')
         self.search_appointment_entry.grid(row=0, column=3, padx=10, pady=10, sticky='w')
 
         tk.Button(self.appointments_frame, text="Add Appointment", command=self.add_appointment).grid(row=4, column=0, padx=10, pady=10, sticky='w')
@@ -313,27 +462,33 @@ class DentalClinicApp:
         tk.Button(self.appointments_frame, text="View Appointments", command=self.view_appointments).grid(row=4, column=3, padx=10, pady=10, sticky='w')
         tk.Button(self.appointments_frame, text="Search", command=self.search_appointments).grid(row=0, column=4, padx=10, pady=10, sticky='w')
 
-        self.appointment_tree = ttk.Treeview(self.appointments_frame, columns=("ID", "Patient ID", "Date", "Time", "Description"), show='headings')
+        self.appointment_tree = ttk.Treeview(self.appointments_frame, columns=("ID", "Patient ID", "Date", "Time", "Description", "Duration", "Chair"), show='headings')
         self.appointment_tree.heading("ID", text="S.No.")
         self.appointment_tree.heading("Patient ID", text="Patient ID")
         self.appointment_tree.heading("Date", text="Date")
         self.appointment_tree.heading("Time", text="Time")
         self.appointment_tree.heading("Description", text="Description")
-        self.appointment_tree.grid(row=5, column=0, columnspan=5, padx=10, pady=10, sticky='nsew')
+        self.appointment_tree.heading("Duration", text="Duration")
+        self.appointment_tree.heading("Chair", text="Chair")
+        self.appointment_tree.grid(row=6, column=0, columnspan=5, padx=10, pady=10, sticky='nsew')
 
         self.appointment_tree_scrollbar = ttk.Scrollbar(self.appointments_frame, orient='vertical', command=self.appointment_tree.yview)
-        self.appointment_tree.configure(yscroll=self.appointment_tree_scrollbar.set)
-        self.appointment_tree_scrollbar.grid(row=5, column=5, sticky='ns')
+        self.appointment_view = VirtualTreeview(self.appointment_tree, self.appointment_tree_scrollbar, clinic.appointments.view().page, executor=self.executor, name='appointments', pool=clinic.pool)
+        self.appointment_search = IncrementalSearch(self.search_appointment_entry, self.appointment_view, clinic.appointments.search)
+        self.appointment_sorting = SortableHeadings(self.appointment_view, clinic.appointments.view, {'ID': 'id', 'Patient ID': 'patient_id', 'Date': 'date', 'Time': 'time'})
+        self.appointment_tree_scrollbar.grid(row=6, column=5, sticky='ns')
+        self.create_filter_bar(self.appointments_frame, self.appointment_sorting, [('Patient ID', 'patient_id', None), ('Date from', 'date_from', None), ('Date to', 'date_to', None), ('Chair', 'chair', None)])
 
-        self.appointments_frame.grid_rowconfigure(5, weight=1)
+        self.appointments_frame.grid_rowconfigure(6, weight=1)
         self.appointments_frame.grid_columnconfigure(1, weight=1)
+        self.view_appointments()
 
     def create_billing_tab(self):
         self.billing_frame = tk.Frame(self.tab_billing)
         self.billing_frame.pack(fill='both', expand=True)
 
         tk.Label(self.billing_frame, text="Patient ID").grid(row=0, column=0, padx=10, pady=10, sticky='w')
-        tk.Label(self.billing_frame, text="Date (DD-MM-YYYY)").grid(row=1, column=0, padx=10, pady=10, sticky='w')
+        tk.Label(self.billing_frame, text="Date (YYYY-MM-DD)").grid(row=1, column=0, padx=10, pady=10, sticky='w')
         tk.Label(self.billing_frame, text="Amount").grid(row=2, column=0, padx=10, pady=10, sticky='w')
         tk.Label(self.billing_frame, text="Description").grid(row=3, column=0, padx=10, pady=10, sticky='w')
         tk.Label(self.billing_frame, text="Search").grid(row=0, column=2, padx=10, pady=10, sticky='w')
@@ -355,6 +510,9 @@ class DentalClinicApp:
         tk.Button(self.billing_frame, text="Delete Bill", command=self.delete_bill).grid(row=4, column=2, padx=10, pady=10, sticky='w')
         tk.Button(self.billing_frame, text="View Bills", command=self.view_bills).grid(row=4, column=3, padx=10, pady=10, sticky='w')
         tk.Button(self.billing_frame, text="Search", command=self.search_bills).grid(row=0, column=4, padx=10, pady=10, sticky='w')
+        self.bill_status = tk.Label(self.billing_frame, text="")
+        self.bill_status.grid(row=4, column=4, padx=10, pady=10, sticky='w')
+        self.bills_saving = 0
 
         self.billing_tree = ttk.Treeview(self.billing_frame, columns=("ID", "Patient ID", "Date", "Amount", "Description"), show='headings')
         self.billing_tree.heading("ID", text="S.No.")
@@ -362,22 +520,75 @@ class DentalClinicApp:
         self.billing_tree.heading("Date", text="Date")
         self.billing_tree.heading("Amount", text="Amount")
         self.billing_tree.heading("Description", text="Description")
-        self.billing_tree.grid(row=5, column=0, columnspan=5, padx=10, pady=10, sticky='nsew')
+        self.billing_tree.grid(row=6, column=0, columnspan=5, padx=10, pady=10, sticky='nsew')
 
         self.billing_tree_scrollbar = ttk.Scrollbar(self.billing_frame, orient='vertical', command=self.billing_tree.yview)
-        self.billing_tree.configure(yscroll=self.billing_tree_scrollbar.set)
-        self.billing_tree_scrollbar.grid(row=5, column=5, sticky='ns')
+        self.billing_view = VirtualTreeview(self.billing_tree, self.billing_tree_scrollbar, clinic.billing.view().page, executor=self.executor, name='billing', pool=clinic.pool)
+        self.billing_search = IncrementalSearch(self.search_bill_entry, self.billing_view, clinic.billing.search)
+        self.billing_sorting = SortableHeadings(self.billing_view, clinic.billing.view, {'ID': 'id', 'Patient ID': 'patient_id', 'Date': 'date', 'Amount': 'amount', 'Description': 'description'})
+        self.billing_tree_scrollbar.grid(row=6, column=5, sticky='ns')
+        self.create_filter_bar(self.billing_frame, self.billing_sorting, [('Patient ID', 'patient_id', None), ('Date from', 'date_from', None), ('Date to', 'date_to', None), ('Amount from', 'amount_from', None), ('Amount to', 'amount_to', None)])
 
-        self.billing_frame.grid_rowconfigure(5, weight=1)
+        self.billing_frame.grid_rowconfigure(6, weight=1)
         self.billing_frame.grid_columnconfigure(1, weight=1)
+        self.view_bills()
 
     def create_reports_tab(self):
+        from analytics import ANALYSES
+        from exporter import EXPORT_FORMATS
+        from importer import IMPORTS
+
         self.reports_frame = tk.Frame(self.tab_reports)
         self.reports_frame.pack(fill='both', expand=True)
 
         tk.Button(self.reports_frame, text="Generate Patient Report", command=self.generate_patient_report).grid(row=0, column=0, padx=10, pady=10)
         tk.Button(self.reports_frame, text="Generate Financial Report", command=self.generate_financial_report).grid(row=1, column=0, padx=10, pady=10)
 
+        tk.Label(self.reports_frame, text="Format").grid(row=0, column=1, padx=10, pady=10, sticky='w')
+        self.report_format = ttk.Combobox(self.reports_frame, values=EXPORT_FORMATS, state='readonly', width=10)
+        self.report_format.set('xlsx')
+        self.report_format.grid(row=0, column=2, padx=10, pady=10, sticky='w')
+
+        # Bulk Import
+        tk.Label(self.reports_frame, text="Import").grid(row=1, column=1, padx=10, pady=10, sticky='w')
+        self.import_table = ttk.Combobox(self.reports_frame, values=list(IMPORTS), state='readonly', width=12)
+        self.import_table.set('patients')
+        self.import_table.grid(row=1, column=2, padx=10, pady=10, sticky='w')
+        tk.Button(self.reports_frame, text="Import File...", command=self.import_data).grid(row=1, column=3, padx=10, pady=10, sticky='w')
+
+        self.report_progress = ttk.Progressbar(self.reports_frame, orient='horizontal', length=300, mode='determinate')
+        self.report_progress.grid(row=2, column=0, columnspan=3, padx=10, pady=10, sticky='w')
+        self.report_status = tk.Label(self.reports_frame, text="")
+        self.report_status.grid(row=3, column=0, columnspan=3, padx=10, pady=10, sticky='w')
+
+        # Financial Analytics
+        tk.Label(self.reports_frame, text="Analysis").grid(row=4, column=0, padx=10, pady=10, sticky='w')
+        tk.Label(self.reports_frame, text="From (YYYY-MM-DD)").grid(row=5, column=0, padx=10, pady=10, sticky='w')
+        tk.Label(self.reports_frame, text="To (YYYY-MM-DD)").grid(row=5, column=2, padx=10, pady=10, sticky='w')
+
+        self.analysis_choice = ttk.Combobox(self.reports_frame, values=list(ANALYSES), state='readonly')
+        self.analysis_choice.set('Monthly Revenue')
+        self.analysis_start = tk.Entry(self.reports_frame)
+        self.analysis_end = tk.Entry(self.reports_frame)
+
+        self.analysis_choice.grid(row=4, column=1, padx=10, pady=10, sticky='w')
+        self.analysis_start.grid(row=5, column=1, padx=10, pady=10, sticky='w')
+        self.analysis_end.grid(row=5, column=3, padx=10, pady=10, sticky='w')
+
+        tk.Button(self.reports_frame, text="Show Analysis", command=self.show_analysis).grid(row=4, column=2, padx=10, pady=10, sticky='w')
+        tk.Button(self.reports_frame, text="Export Analysis", command=self.export_analysis).grid(row=4, column=3, padx=10, pady=10, sticky='w')
+
+        self.analysis_tree = ttk.Treeview(self.reports_frame, show='headings')
+        self.analysis_tree.grid(row=6, column=0, columnspan=4, padx=10, pady=10, sticky='nsew')
+
+        self.analysis_tree_scrollbar = ttk.Scrollbar(self.reports_frame, orient='vertical', command=self.analysis_tree.yview)
+        self.analysis_tree.configure(yscroll=self.analysis_tree_scrollbar.set)
+        self.analysis_tree_scrollbar.grid(row=6, column=4, sticky='ns')
+
+        self.reports_frame.grid_rowconfigure(6, weight=1)
+        self.reports_frame.grid_columnconfigure(1, weight=1)
+        self.analysis_result = None
+
     # Patient Management Methods
     def add_patient(self):
         name = self.patient_name.get()
@@ -390,28 +601,12 @@ class DentalClinicApp:
             return
 
         try:
-            age = int(age)
-            if age <= 0:
-                raise ValueError("Age must be a positive integer")
+            clinic.patients.add(name, age, gender, contact)
+            messagebox.showinfo("Success", "Patient added successfully")
         except ValueError as e:
             messagebox.showerror("Error", str(e))
-            return
-
-        if gender.lower() not in ["male", "female", "other"]:
-            messagebox.showerror("Error", "Gender must be 'Male', 'Female', or 'Other'")
-            return
-
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        try:
-            c.execute('INSERT INTO patients (name, age, gender, contact) VALUES (?, ?, ?, ?)', (name, age, gender, contact))
-            conn.commit()
-            messagebox.showinfo("Success", "Patient added successfully")
-            self.view_patients()
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def update_patient(self):
         selected_item = self.patient_tree.selection()
@@ -430,28 +625,12 @@ class DentalClinicApp:
             return
 
         try:
-            age = int(age)
-            if age <= 0:
-                raise ValueError("Age must be a positive integer")
+            clinic.patients.update(patient_id, name, age, gender, contact)
+            messagebox.showinfo("Success", "Patient updated successfully")
         except ValueError as e:
             messagebox.showerror("Error", str(e))
-            return
-
-        if gender.lower() not in ["male", "female", "other"]:
-            messagebox.showerror("Error", "Gender must be 'Male', 'Female', or 'Other'")
-            return
-
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        try:
-            c.execute('UPDATE patients SET name = ?, age = ?, gender = ?, contact = ? WHERE id = ?', (name, age, gender, contact, patient_id))
-            conn.commit()
-            messagebox.showinfo("Success", "Patient updated successfully")
-            self.view_patients()
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def delete_patient(self):
         selected_item = self.patient_tree.selection()
@@ -460,42 +639,29 @@ class DentalClinicApp:
             return
 
         patient_id = self.patient_tree.item(selected_item)['values'][0]
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
         try:
-            c.execute('DELETE FROM patients WHERE id = ?', (patient_id,))
-            conn.commit()
+            clinic.patients.delete(patient_id)
             messagebox.showinfo("Success", "Patient deleted successfully")
-            self.view_patients()
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def view_patients(self):
-        def fetch_data():
-            conn = sqlite3.connect('dental_clinic.db')
-            c = conn.cursor()
-            c.execute('SELECT * FROM patients')
-            patients = c.fetchall()
-            conn.close()
-            self.patient_tree.delete(*self.patient_tree.get_children())
-            for patient in patients:
-                self.patient_tree.insert('', 'end', values=patient)
-
-        threading.Thread(target=fetch_data).start()
+        self.patient_view.reload()
 
     def search_patients(self):
-        search_term = self.search_patient_entry.get()
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        query = "SELECT * FROM patients WHERE name LIKE ? OR ID LIKE ?"
-        c.execute(query, ('%' + search_term + '%', '%' + search_term + '%'))
-        patients = c.fetchall()
-        conn.close()
-        self.patient_tree.delete(*self.patient_tree.get_children())
-        for patient in patients:
-            self.patient_tree.insert('', 'end', values=patient)
+        self.patient_search.run()
+
+    def open_chart(self):
+        selected_item = self.patient_tree.selection()
+        if not selected_item:
+            messagebox.showwarning("Warning", "Please select a patient to open")
+            return
+        patient_id = self.patient_tree.item(selected_item)['values'][0]
+        if self.chart is None:
+            self.chart = PatientChartWindow(self, patient_id)
+        else:
+            self.chart.show_patient(patient_id)
+            self.chart.window.lift()
 
     # Appointment Management Methods
     def add_appointment(self):
@@ -503,22 +669,22 @@ class DentalClinicApp:
         date = self.appointment_date.get()
         time = self.appointment_time.get()
         description = self.appointment_description.get()
+        duration = self.appointment_duration.get() or DEFAULT_DURATION
+        chair = self.appointment_chair.get() or 1
 
         if not patient_id or not date or not time or not description:
             messagebox.showwarning("Warning", "All fields are required")
             return
 
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
         try:
-            c.execute('INSERT INTO appointments (patient_id, date, time, description) VALUES (?, ?, ?, ?)', (patient_id, date, time, description))
-            conn.commit()
+            clinic.appointments.add(patient_id, date, time, description, duration, chair)
             messagebox.showinfo("Success", "Appointment scheduled successfully")
-            self.view_appointments()
+        except SchedulingConflict as e:
+            messagebox.showerror("Scheduling Conflict", str(e))
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def update_appointment(self):
         selected_item = self.appointment_tree.selection()
@@ -531,22 +697,22 @@ class DentalClinicApp:
         date = self.appointment_date.get()
         time = self.appointment_time.get()
         description = self.appointment_description.get()
+        duration = self.appointment_duration.get() or DEFAULT_DURATION
+        chair = self.appointment_chair.get() or 1
 
         if not patient_id or not date or not time or not description:
             messagebox.showwarning("Warning", "All fields are required")
             return
 
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
         try:
-            c.execute('UPDATE appointments SET patient_id = ?, date = ?, time = ?, description = ? WHERE id = ?', (patient_id, date, time, description, appointment_id))
-            conn.commit()
+            clinic.appointments.update(appointment_id, patient_id, date, time, description, duration, chair)
             messagebox.showinfo("Success", "Appointment updated successfully")
-            self.view_appointments()
+        except SchedulingConflict as e:
+            messagebox.showerror("Scheduling Conflict", str(e))
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def delete_appointment(self):
         selected_item = self.appointment_tree.selection()
@@ -555,42 +721,111 @@ class DentalClinicApp:
             return
 
         appointment_id = self.appointment_tree.item(selected_item)['values'][0]
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
         try:
-            c.execute('DELETE FROM appointments WHERE id = ?', (appointment_id,))
-            conn.commit()
+            clinic.appointments.delete(appointment_id)
             messagebox.showinfo("Success", "Appointment deleted successfully")
-            self.view_appointments()
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def view_appointments(self):
-        def fetch_data():
-            conn = sqlite3.connect('dental_clinic.db')
-            c = conn.cursor()
-            c.execute('SELECT * FROM appointments')
-            appointments = c.fetchall()
-            conn.close()
-            self.appointment_tree.delete(*self.appointment_tree.get_children())
-            for appointment in appointments:
-                self.appointment_tree.insert('', 'end', values=appointment)
-
-        threading.Thread(target=fetch_data).start()
+        self.appointment_view.reload()
 
     def search_appointments(self):
-        search_term = self.search_appointment_entry.get()
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        query = "SELECT * FROM appointments WHERE description LIKE ? OR patient_id LIKE ?"
-        c.execute(query, ('%' + search_term + '%', '%' + search_term + '%'))
-        appointments = c.fetchall()
-        conn.close()
-        self.appointment_tree.delete(*self.appointment_tree.get_children())
-        for appointment in appointments:
-            self.appointment_tree.insert('', 'end', values=appointment)
+        self.appointment_search.run()
+
+    # Schedule Tab
+    # One day with the chairs side by side, or one chair's week, in time
+    # slots. The week around the chosen day is read by one indexed range query
+    # on a worker thread and bucketed into slots once (see
+    # scheduling.Schedule), so moving between days of that week only redraws
+    # the grid. Only that week is held; it is reloaded when one of its
+    # appointments, or one moved into it, changes.
+    def create_schedule_tab(self):
+        self.schedule_frame = tk.Frame(self.tab_schedule)
+        self.schedule_frame.pack(fill='both', expand=True)
+        self.schedule_day = _date.today()
+        self.schedule_mode = tk.StringVar(value='day')
+        self.schedule_columns = None
+
+        tk.Button(self.schedule_frame, text="<", command=lambda: self.move_schedule(-1)).grid(row=0, column=0, padx=10, pady=10, sticky='w')
+        tk.Button(self.schedule_frame, text="Today", command=self.schedule_today).grid(row=0, column=1, pady=10, sticky='w')
+        tk.Button(self.schedule_frame, text=">", command=lambda: self.move_schedule(1)).grid(row=0, column=2, padx=10, pady=10, sticky='w')
+        self.schedule_title = tk.Label(self.schedule_frame, text="", width=24, anchor='w')
+        self.schedule_title.grid(row=0, column=3, padx=10, pady=10, sticky='w')
+        tk.Radiobutton(self.schedule_frame, text="Day", variable=self.schedule_mode, value='day', command=self.draw_schedule).grid(row=0, column=4, sticky='w')
+        tk.Radiobutton(self.schedule_frame, text="Week", variable=self.schedule_mode, value='week', command=self.draw_schedule).grid(row=0, column=5, sticky='w')
+        tk.Label(self.schedule_frame, text="Chair").grid(row=0, column=6, padx=10, pady=10, sticky='w')
+        self.schedule_chair = ttk.Combobox(self.schedule_frame, values=[], width=4, state='readonly')
+        self.schedule_chair.grid(row=0, column=7, pady=10, sticky='w')
+        self.schedule_chair.bind('<<ComboboxSelected>>', lambda event: self.draw_schedule())
+
+        self.schedule_tree = ttk.Treeview(self.schedule_frame, show='headings')
+        self.schedule_tree.grid(row=1, column=0, columnspan=8, padx=10, pady=10, sticky='nsew')
+        self.schedule_tree_scrollbar = ttk.Scrollbar(self.schedule_frame, orient='vertical', command=self.schedule_tree.yview)
+        self.schedule_tree.configure(yscroll=self.schedule_tree_scrollbar.set)
+        self.schedule_tree_scrollbar.grid(row=1, column=8, sticky='ns')
+        self.schedule_status = tk.Label(self.schedule_frame, text="", anchor='w')
+        self.schedule_status.grid(row=2, column=0, columnspan=8, padx=10, sticky='w')
+
+        self.schedule_frame.grid_rowconfigure(1, weight=1)
+        self.schedule_frame.grid_columnconfigure(3, weight=1)
+        self.load_schedule()
+
+    def load_schedule(self):
+        self.schedule_status.config(text="Loading...")
+        self.executor.submit(clinic.appointments.schedule, week_start(self.schedule_day.isoformat()), 7, key='schedule',
+                             on_success=self.schedule_loaded, on_error=self.schedule_failed, name='schedule')
+
+    def schedule_loaded(self, schedule):
+        self.schedule = schedule
+        self.schedule_chair.config(values=schedule.chairs)
+        if self.schedule_chair.get() not in [str(chair) for chair in schedule.chairs]:
+            self.schedule_chair.set(schedule.chairs[0])
+        self.draw_schedule()
+
+    def schedule_failed(self, error):
+        self.schedule_status.config(text="")
+        messagebox.showerror("Database Error", str(error))
+
+    # Day view steps a day, week view a week
+    def move_schedule(self, step):
+        self.show_schedule_day(self.schedule_day + timedelta(days=step * (7 if self.schedule_mode.get() == 'week' else 1)))
+
+    def schedule_today(self):
+        self.show_schedule_day(_date.today())
+
+    def show_schedule_day(self, day):
+        self.schedule_day = day
+        if self.schedule is not None and day.isoformat() in self.schedule.dates:
+            self.draw_schedule()
+        else:
+            self.load_schedule()
+
+    def draw_schedule(self):
+        schedule, date = self.schedule, self.schedule_day.isoformat()
+        if schedule is None or date not in schedule.dates:
+            return
+        if self.schedule_mode.get() == 'day':
+            headings = ("Time",) + tuple("Chair {}".format(chair) for chair in schedule.chairs)
+            rows = schedule.day(date)
+            self.schedule_title.config(text=self.schedule_day.strftime('%A %d %B %Y'))
+        else:
+            chair = int(self.schedule_chair.get())
+            headings = ("Time",) + tuple(_date.fromisoformat(day).strftime('%a %d %b') for day in schedule.dates)
+            rows = schedule.week(chair)
+            self.schedule_title.config(text="Week of {}, chair {}".format(_date.fromisoformat(schedule.dates[0]).strftime('%d %B %Y'), chair))
+        with timed('treeview', 'schedule', len(rows)):
+            if headings != self.schedule_columns:
+                self.schedule_columns = headings
+                columns = tuple('c{}'.format(index) for index in range(len(headings)))
+                self.schedule_tree.configure(columns=columns)
+                for column, heading in zip(columns, headings):
+                    self.schedule_tree.heading(column, text=heading)
+                    self.schedule_tree.column(column, width=60 if column == 'c0' else 160, stretch=column != 'c0')
+            self.schedule_tree.delete(*self.schedule_tree.get_children())
+            for row in rows:
+                self.schedule_tree.insert('', 'end', values=row)
+        self.schedule_status.config(text="{} appointment(s) this week".format(len(schedule)))
 
     # Billing Management Methods
     def add_bill(self):
@@ -604,24 +839,31 @@ class DentalClinicApp:
             return
 
         try:
-            amount = float(amount)
-            if amount <= 0:
-                raise ValueError("Amount must be a positive number")
+            future = clinic.billing.add(patient_id, date, amount, description, wait=False)
         except ValueError as e:
             messagebox.showerror("Error", str(e))
             return
 
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
+        # The write queue saves the bill; the form is free for the next line
+        # item at once, keeping the patient and date.
+        self.bills_saving += 1
+        self.bill_status.config(text="Saving {} bill(s)...".format(self.bills_saving))
+        self.bill_amount.delete(0, 'end')
+        self.bill_description.delete(0, 'end')
+        future.add_done_callback(lambda done: self.executor.call_soon(self.bill_saved, done))
+
+    def bill_saved(self, future):
+        self.bills_saving -= 1
         try:
-            c.execute('INSERT INTO billing (patient_id, date, amount, description) VALUES (?, ?, ?, ?)', (patient_id, date, amount, description))
-            conn.commit()
-            messagebox.showinfo("Success", "Bill generated successfully")
-            self.view_bills()
-        except sqlite3.Error as e:
+            bill_id = future.result()
+        except (ValueError, sqlite3.Error) as e:
+            self.bill_status.config(text="")
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
+            return
+        if self.bills_saving:
+            self.bill_status.config(text="Saving {} bill(s)...".format(self.bills_saving))
+        else:
+            self.bill_status.config(text="Bill {} generated".format(bill_id))
 
     def update_bill(self):
         selected_item = self.billing_tree.selection()
@@ -640,24 +882,12 @@ class DentalClinicApp:
             return
 
         try:
-            amount = float(amount)
-            if amount <= 0:
-                raise ValueError("Amount must be a positive number")
+            clinic.billing.update(bill_id, patient_id, date, amount, description)
+            messagebox.showinfo("Success", "Bill updated successfully")
         except ValueError as e:
             messagebox.showerror("Error", str(e))
-            return
-
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        try:
-            c.execute('UPDATE billing SET patient_id = ?, date = ?, amount = ?, description = ? WHERE id = ?', (patient_id, date, amount, description, bill_id))
-            conn.commit()
-            messagebox.showinfo("Success", "Bill updated successfully")
-            self.view_bills()
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def delete_bill(self):
         selected_item = self.billing_tree.selection()
@@ -666,65 +896,234 @@ class DentalClinicApp:
             return
 
         bill_id = self.billing_tree.item(selected_item)['values'][0]
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
         try:
-            c.execute('DELETE FROM billing WHERE id = ?', (bill_id,))
-            conn.commit()
+            clinic.billing.delete(bill_id)
             messagebox.showinfo("Success", "Bill deleted successfully")
-            self.view_bills()
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
-        finally:
-            conn.close()
 
     def view_bills(self):
-        def fetch_data():
-            conn = sqlite3.connect('dental_clinic.db')
-            c = conn.cursor()
-            c.execute('SELECT * FROM billing')
-            bills = c.fetchall()
-            conn.close()
-            self.billing_tree.delete(*self.billing_tree.get_children())
-            for bill in bills:
-                self.billing_tree.insert('', 'end', values=bill)
-
-        threading.Thread(target=fetch_data).start()
+        self.billing_view.reload()
 
     def search_bills(self):
-        search_term = self.search_bill_entry.get()
-        conn = sqlite3.connect('dental_clinic.db')
-        c = conn.cursor()
-        query = "SELECT * FROM billing WHERE description LIKE ? OR patient_id LIKE ?"
-        c.execute(query, ('%' + search_term + '%', '%' + search_term + '%'))
-        bills = c.fetchall()
-        conn.close()
-        self.billing_tree.delete(*self.billing_tree.get_children())
-        for bill in bills:
-            self.billing_tree.insert('', 'end', values=bill)
+        self.billing_search.run()
 
     # Reporting Methods
     def generate_patient_report(self):
-        def generate_report():
-            conn = sqlite3.connect('dental_clinic.db')
-            patients_df = pd.read_sql_query('SELECT * FROM patients', conn)
-            conn.close()
-            patients_df.to_excel('patient_report.xlsx', index=False)
-            messagebox.showinfo("Success", "Patient report generated successfully")
-
-        threading.Thread(target=generate_report).start()
+        self.generate_report('patient', "Patient report generated successfully")
 
     def generate_financial_report(self):
-        def generate_report():
-            conn = sqlite3.connect('dental_clinic.db')
-            billing_df = pd.read_sql_query('SELECT * FROM billing', conn)
-            conn.close()
-            billing_df.to_excel('financial_report.xlsx', index=False)
-            messagebox.showinfo("Success", "Financial report generated successfully")
+        self.generate_report('financial', "Financial report generated successfully")
+
+    def generate_report(self, report, message):
+        fmt = self.report_format.get()
+
+        def update_progress(written, total):
+            self.executor.call_soon(self.show_report_progress, written, total)
+
+        def generate():
+            return clinic.reports.export(report, fmt, progress=update_progress)
+
+        self.report_progress['value'] = 0
+        self.report_status.config(text="Exporting...")
+        self.executor.submit(generate, key=report + '_report',
+                             on_success=lambda path: self.report_finished(path, message),
+                             on_error=lambda e: messagebox.showerror("Report Error", str(e)))
+
+    def show_report_progress(self, written, total):
+        self.report_progress['maximum'] = max(total, written, 1)
+        self.report_progress['value'] = written
+        self.report_status.config(text="Exported {} of {} rows".format(written, total))
+
+    def report_finished(self, path, message):
+        self.report_status.config(text="Saved {}".format(path))
+        messagebox.showinfo("Success", message)
+
+    def import_data(self):
+        table = self.import_table.get()
+        path = filedialog.askopenfilename(title="Import {}".format(table),
+                                          filetypes=[("CSV or Excel", "*.csv *.xlsx"), ("All files", "*.*")])
+        if not path:
+            return
+
+        def update_progress(imported, rejected):
+            self.executor.call_soon(self.show_import_progress, imported, rejected)
+
+        def run_import():
+            return clinic.reports.import_file(table, path, progress=update_progress)
+
+        self.report_status.config(text="Importing...")
+        self.executor.submit(run_import, key='import',
+                             on_success=self.import_finished,
+                             on_error=lambda e: messagebox.showerror("Import Error", str(e)))
+
+    def show_import_progress(self, imported, rejected):
+        self.report_status.config(text="Imported {} rows, rejected {}".format(imported, rejected))
+
+    def import_finished(self, result):
+        self.report_status.config(text=str(result))
+        messagebox.showinfo("Import Finished", str(result))
+
+    def show_analysis(self):
+        name = self.analysis_choice.get()
+        start = self.analysis_start.get().strip()
+        end = self.analysis_end.get().strip()
+        self.executor.submit(clinic.reports.analyse, name, start, end, key='analysis',
+                             on_success=lambda result: self.show_analysis_result(name, result),
+                             on_error=lambda e: messagebox.showerror("Analysis Error", str(e)))
+
+    def show_analysis_result(self, name, result):
+        columns, rows = result
+        self.analysis_result = (name, columns, rows)
+        self.analysis_tree.delete(*self.analysis_tree.get_children())
+        self.analysis_tree['columns'] = columns
+        for column in columns:
+            self.analysis_tree.heading(column, text=column)
+            self.analysis_tree.column(column, width=100)
+        for row in rows:
+            self.analysis_tree.insert('', 'end', values=row)
+
+    def export_analysis(self):
+        if self.analysis_result is None:
+            messagebox.showwarning("Warning", "Please show an analysis to export")
+            return
+
+        name, columns, rows = self.analysis_result
+        path = '{}.{}'.format(name.lower().replace(' ', '_'), self.report_format.get())
+        try:
+            clinic.reports.export_rows(columns, rows, path)
+            messagebox.showinfo("Success", "Analysis exported to {}".format(path))
+        except (OSError, RuntimeError, ValueError) as e:
+            messagebox.showerror("Export Error", str(e))
+
+# Patient Chart
+# A patient's details, upcoming and past appointments and bills with a running
+# balance, read by one query (see ClinicRepository.patient_chart) on a worker
+# thread. Previous and Next step through the patients in the order of the
+# Patients list. While a chart is on screen the charts of the patients either
+# side are fetched in the background, so stepping to them is served from the
+# chart cache. The chart reloads when any of its rows change.
+class PatientChartWindow:
+    APPOINTMENT_COLUMNS = ("ID", "Date", "Time", "Description", "Minutes", "Chair")
+    BILL_COLUMNS = ("ID", "Date", "Amount", "Description", "Balance")
+
+    def __init__(self, app, patient_id):
+        self.app = app
+        self.tree = app.patient_tree
+        self.patient_id = None
+        self.shown = {'appointments': set(), 'billing': set()}
+        self.window = tk.Toplevel(app.root)
+        self.window.title("Patient Chart")
+        self.window.geometry("700x600")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.header = tk.Label(self.window, text="", anchor='w')
+        self.header.grid(row=0, column=0, columnspan=3, padx=10, pady=10, sticky='w')
+        self.balance = tk.Label(self.window, text="", anchor='w')
+        self.balance.grid(row=1, column=0, columnspan=3, padx=10, sticky='w')
+        self.previous_button = tk.Button(self.window, text="Previous", command=lambda: self.step(forward=False))
+        self.next_button = tk.Button(self.window, text="Next", command=lambda: self.step(forward=True))
+        self.previous_button.grid(row=8, column=0, padx=10, pady=10, sticky='w')
+        self.next_button.grid(row=8, column=1, padx=10, pady=10, sticky='w')
+        tk.Button(self.window, text="Close", command=self.close).grid(row=8, column=2, padx=10, pady=10, sticky='e')
+
+        tk.Label(self.window, text="Upcoming appointments").grid(row=2, column=0, padx=10, sticky='w')
+        self.upcoming_tree = self.create_table(3, self.APPOINTMENT_COLUMNS)
+        tk.Label(self.window, text="Past appointments").grid(row=4, column=0, padx=10, sticky='w')
+        self.past_tree = self.create_table(5, self.APPOINTMENT_COLUMNS)
+        tk.Label(self.window, text="Bills").grid(row=6, column=0, padx=10, sticky='w')
+        self.bill_tree = self.create_table(7, self.BILL_COLUMNS)
+
+        for row in (3, 5, 7):
+            self.window.grid_rowconfigure(row, weight=1)
+        self.window.grid_columnconfigure(2, weight=1)
+        self.show_patient(patient_id)
+
+    def create_table(self, row, columns):
+        tree = ttk.Treeview(self.window, columns=columns, show='headings', height=5)
+        for column in columns:
+            tree.heading(column, text=column)
+            tree.column(column, width=240 if column == "Description" else 80, stretch=column == "Description")
+        tree.grid(row=row, column=0, columnspan=3, padx=10, pady=5, sticky='nsew')
+        scrollbar = ttk.Scrollbar(self.window, orient='vertical', command=tree.yview)
+        tree.configure(yscroll=scrollbar.set)
+        scrollbar.grid(row=row, column=3, sticky='ns')
+        return tree
+
+    def show_patient(self, patient_id):
+        self.patient_id = int(patient_id)
+        self.header.config(text="Loading patient {}...".format(self.patient_id))
+        self.app.executor.submit(clinic.patients.chart, self.patient_id, key=self, on_success=self.show_chart, on_error=self.show_error, name='patient chart')
+
+    def show_chart(self, chart):
+        for tree in (self.upcoming_tree, self.past_tree, self.bill_tree):
+            tree.delete(*tree.get_children())
+        if chart is None:
+            self.header.config(text="Patient {} no longer exists".format(self.patient_id))
+            self.balance.config(text="")
+            self.shown = {'appointments': set(), 'billing': set()}
+            self.update_buttons()
+            return
+        patient_id, name, age, gender, contact = chart.patient
+        self.window.title("Patient Chart - {}".format(name))
+        self.header.config(text="{} (ID {}), {}, {}, {}".format(name, patient_id, age, gender, contact))
+        self.balance.config(text="{} bill(s), balance {:.2f}".format(len(chart.bills), chart.balance or 0))
+        with timed('treeview', 'patient chart', len(chart.upcoming) + len(chart.past) + len(chart.bills)):
+            for tree, rows in ((self.upcoming_tree, chart.upcoming), (self.past_tree, chart.past)):
+                for row in rows:
+                    tree.insert('', 'end', values=row)
+            for bill_id, date, amount, description, balance in chart.bills:
+                self.bill_tree.insert('', 'end', values=(bill_id, date, '{:.2f}'.format(amount or 0), description, '{:.2f}'.format(balance or 0)))
+        self.shown = {'appointments': {row[0] for row in chart.upcoming + chart.past}, 'billing': {row[0] for row in chart.bills}}
+        self.update_buttons()
+        self.prefetch()
+
+    def show_error(self, error):
+        self.header.config(text="")
+        messagebox.showerror("Database Error", str(error), parent=self.window)
+
+    # The patients before and after this one in the Patients list, if loaded
+    def neighbours(self):
+        iid = str(self.patient_id)
+        if not self.tree.exists(iid):
+            return None, None
+        return self.tree.prev(iid) or None, self.tree.next(iid) or None
+
+    def update_buttons(self):
+        before, after = self.neighbours()
+        self.previous_button.config(state='normal' if before else 'disabled')
+        self.next_button.config(state='normal' if after else 'disabled')
+
+    def step(self, forward):
+        before, after = self.neighbours()
+        target = after if forward else before
+        if target:
+            self.tree.selection_set(target)
+            self.tree.see(target)
+            self.show_patient(target)
+
+    def prefetch(self):
+        for iid in self.neighbours():
+            if iid:
+                self.app.executor.submit(clinic.patients.chart, int(iid), name='patient chart prefetch')
+
+    def changed(self, table, row_id, row):
+        if table == 'patients':
+            affected = row_id is None or row_id == self.patient_id
+        else:
+            affected = row_id is None or row_id in self.shown[table] or (row is not None and row[1] == self.patient_id)
+        if affected:
+            self.show_patient(self.patient_id)
+
+    def close(self):
+        self.window.destroy()
+        self.app.chart = None
 
-        threading.Thread(target=generate_report).start()
 
 if __name__ == '__main__':
+    setup_database()
+    trace.mark('database')
     root = tk.Tk()
     app = DentalClinicApp(root)
+    trace.mark('login built')
     root.mainloop()
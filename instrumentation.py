@@ -0,0 +1,247 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+
+# Instrumentation
+# Connections opened by the pool use InstrumentedConnection, whose cursors time
+# every statement from execute() until its rows have been read and count the
+# rows. The Treeviews and the background executor report insert times and
+# queue depth to the same registry. Only the most recent samples of each
+# series are kept, so memory stays bounded however long the app runs.
+# Statements slower than SLOW_QUERY_MS are logged with their EXPLAIN QUERY PLAN.
+SAMPLES = 1000
+SLOW_QUERY_MS = 100
+SLOW_LOG_SIZE = 200
+
+logger = logging.getLogger('dcms.slow_queries')
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+@lru_cache(maxsize=512)
+def statement_name(sql):
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class Series:
+    def __init__(self, samples):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=samples)
+
+
+class Metrics:
+    COLUMNS = ('Kind', 'Name', 'Count', 'p50', 'p95', 'p99', 'Max', 'Mean', 'Rows')
+
+    def __init__(self, samples=SAMPLES, slow_ms=SLOW_QUERY_MS, slow_log_size=SLOW_LOG_SIZE):
+        self.samples = samples
+        self.slow_ms = slow_ms
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._series = {}
+        self.slow_queries = deque(maxlen=slow_log_size)
+
+    def record(self, kind, name, value, rows=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            series = self._series.get((kind, name))
+            if series is None:
+                series = self._series[(kind, name)] = Series(self.samples)
+            series.count += 1
+            series.total += value
+            series.maximum = max(series.maximum, value)
+            series.samples.append(value)
+            if rows:
+                series.rows += rows
+
+    def record_query(self, conn, sql, parameters, ms, rows):
+        name = statement_name(sql)
+        self.record('query', name, ms, rows)
+        if ms >= self.slow_ms and name.split(' ', 1)[0].upper() in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE'):
+            plan = explain(conn, sql, parameters)
+            self.slow_queries.append({
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'ms': round(ms, 3),
+                'rows': rows,
+                'sql': name,
+                'parameters': [repr(value) for value in parameters] if isinstance(parameters, (list, tuple)) else repr(parameters),
+                'plan': plan,
+            })
+            logger.warning('Slow query (%.1f ms, %s rows): %s\n%s', ms, rows, name, '\n'.join(plan))
+
+    # One row per series, slowest p95 first, in Metrics.COLUMNS order
+    def summary(self):
+        with self._lock:
+            items = [(key, series.count, series.total, series.maximum, series.rows, sorted(series.samples))
+                     for key, series in self._series.items()]
+        rows = []
+        for (kind, name), count, total, maximum, row_total, ordered in items:
+            rows.append((kind, name, count, round(percentile(ordered, 0.5), 3), round(percentile(ordered, 0.95), 3),
+                         round(percentile(ordered, 0.99), 3), round(maximum, 3), round(total / count, 3),
+                         round(row_total / count, 1) if row_total else ''))
+        rows.sort(key=lambda row: row[4], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self.slow_queries.clear()
+
+    def export(self, path, extra=None):
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'slow_query_ms': self.slow_ms,
+            'metrics': [dict(zip(self.COLUMNS, row)) for row in self.summary()],
+            'slow_queries': list(self.slow_queries),
+        }
+        report.update(extra or {})
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, default=str)
+        return path
+
+
+metrics = Metrics()
+
+
+def explain(conn, sql, parameters=()):
+    try:
+        # A plain cursor, so the plan lookup is not itself recorded
+        cursor = sqlite3.Cursor(conn)
+        return ['{} {}'.format('  ' * row[1] if row[1] else '', row[3]).strip()
+                for row in cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters or ())]
+    except sqlite3.Error as e:
+        return ['EXPLAIN QUERY PLAN failed: {}'.format(e)]
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _statement = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._statement = [sql, parameters, time.perf_counter() - started, 0]
+        if self.description is None:
+            self._finish(max(self.rowcount, 0))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        metrics.record('query', statement_name(sql), (time.perf_counter() - started) * 1000, max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, 0 if row is None else 1)
+        # Most callers read a single row and drop the cursor
+        self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        self._finish()
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0)
+            self._finish()
+            raise
+        self._fetched(started, 1)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def _fetched(self, started, rows):
+        if self._statement is not None:
+            self._statement[2] += time.perf_counter() - started
+            self._statement[3] += rows
+
+    def _finish(self, rows=None):
+        statement, self._statement = self._statement, None
+        if statement is not None:
+            sql, parameters, elapsed, fetched = statement
+            metrics.record_query(self.connection, sql, parameters, elapsed * 1000, fetched if rows is None else rows)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Times a block of UI work, e.g. filling a Treeview
+class timed:
+    def __init__(self, kind, name, rows=None):
+        self.kind = kind
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        metrics.record(self.kind, self.name, (time.perf_counter() - self.started) * 1000, self.rows)
+
+
+# Startup Trace
+# Milestones of a GUI start in milliseconds since started, which the main
+# module takes before its own imports. Each milestone is also recorded under
+# 'startup' in the metrics, so it shows on the Diagnostics tab.
+class StartupTrace:
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.marks = []
+
+    def mark(self, name):
+        ms = (time.perf_counter() - self.started) * 1000
+        self.marks.append((name, ms))
+        metrics.record('startup', name, ms)
+        return ms
+
+    def report(self):
+        return '\n'.join('{:8.1f} ms  {}'.format(ms, name) for name, ms in self.marks)
@@ -0,0 +1,237 @@
+import sys
+import sqlite3
+from changefeed import create_change_log
+from credentials import hash_password, is_hashed
+from database import ClinicRepository
+from search import setup_search_index
+from summaries import create_summaries, replace_summary_triggers
+from scheduling import DEFAULT_DURATION
+
+# Schema Migrations
+# Each migration runs once, in order, inside its own transaction and is then
+# recorded in schema_version. upgrade() is safe to call on every startup: the
+# latest version applied is mirrored in PRAGMA user_version, which is read
+# from the database header, so on an up-to-date database upgrade() returns
+# after that one read without creating or querying any table.
+def create_base_tables(conn):
+    c = conn.cursor()
+
+    # Create Users table
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    password TEXT NOT NULL,
+                    role TEXT NOT NULL
+                )''')
+
+    # Create Patients table
+    c.execute('''CREATE TABLE IF NOT EXISTS patients (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    age INTEGER,
+                    gender TEXT,
+                    contact TEXT
+                )''')
+
+    # Create Appointments table
+    c.execute('''CREATE TABLE IF NOT EXISTS appointments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id INTEGER,
+                    date TEXT,
+                    time TEXT,
+                    description TEXT,
+                    FOREIGN KEY (patient_id) REFERENCES patients (id)
+                )''')
+
+    # Create Billing table
+    c.execute('''CREATE TABLE IF NOT EXISTS billing (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id INTEGER,
+                    date TEXT,
+                    amount REAL,
+                    description TEXT,
+                    FOREIGN KEY (patient_id) REFERENCES patients (id)
+                )''')
+
+
+def unique_usernames(conn):
+    # Older databases collected a duplicate admin row on every start because
+    # INSERT OR IGNORE had no unique constraint to ignore against.
+    conn.execute('DELETE FROM users WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY username)')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username)')
+    conn.execute('INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)', ('admin', 'admin', 'admin'))
+
+
+def secondary_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments (patient_id, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_date_time ON appointments (date, time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_billing_patient_date ON billing (patient_id, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_billing_date ON billing (date, amount)')
+    conn.execute('ANALYZE')
+
+
+def full_text_search(conn):
+    setup_search_index(conn)
+
+
+def iso_dates(conn):
+    # Dates entered as DD-MM-YYYY are rewritten as YYYY-MM-DD so they sort and
+    # group correctly.
+    for table in ('appointments', 'billing'):
+        conn.execute('''UPDATE {} SET date = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2)
+                        WHERE date GLOB '[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]' '''.format(table))
+
+
+def billing_covering_indexes(conn):
+    # Revenue per patient and per procedure read amount and date as well;
+    # keeping them in the index avoids a table lookup for every bill.
+    conn.execute('DROP INDEX IF EXISTS idx_billing_patient_date')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_billing_patient_date_amount ON billing (patient_id, date, amount)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_billing_description_date_amount ON billing (description, date, amount)')
+    conn.execute('ANALYZE')
+
+
+def billing_summaries(conn):
+    create_summaries(conn)
+
+
+def appointment_slots(conn):
+    # Start/end in minutes since the epoch, duration and chair make overlap
+    # checks a range query instead of a comparison of date/time text.
+    conn.execute('ALTER TABLE appointments ADD COLUMN duration INTEGER NOT NULL DEFAULT {}'.format(DEFAULT_DURATION))
+    conn.execute('ALTER TABLE appointments ADD COLUMN chair INTEGER NOT NULL DEFAULT 1')
+    conn.execute('ALTER TABLE appointments ADD COLUMN start_ts INTEGER')
+    conn.execute('ALTER TABLE appointments ADD COLUMN end_ts INTEGER')
+    conn.execute("UPDATE appointments SET time = '0' || time WHERE time GLOB '[0-9]:[0-9][0-9]'")
+    conn.execute('''UPDATE appointments SET start_ts = CAST(strftime('%s', date || ' ' || time) AS INTEGER) / 60
+                    WHERE strftime('%s', date || ' ' || time) IS NOT NULL''')
+    conn.execute('UPDATE appointments SET end_ts = start_ts + duration WHERE start_ts IS NOT NULL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_chair_start ON appointments (chair, start_ts, end_ts)')
+
+
+def sort_indexes(conn):
+    # Every sortable column in the Treeviews has an index whose key is exactly
+    # the sort key (see queries.SORT_KEYS), so sorted pages are index walks.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_patients_name ON patients (name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_patients_age ON patients (age)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_billing_amount ON billing (amount)')
+    conn.execute('ANALYZE')
+
+
+def hashed_passwords(conn):
+    # Plaintext passwords are replaced by salted hashes (see credentials.py)
+    for user_id, password in conn.execute('SELECT id, password FROM users').fetchall():
+        if not is_hashed(password):
+            conn.execute('UPDATE users SET password = ? WHERE id = ?', (hash_password(password), user_id))
+
+
+def summaries_without_amounts(conn):
+    replace_summary_triggers(conn)
+
+
+def change_log(conn):
+    # Triggers log every change for other workstations (see changefeed.py)
+    create_change_log(conn)
+
+
+MIGRATIONS = [
+    (1, 'base tables', create_base_tables),
+    (2, 'unique usernames', unique_usernames),
+    (3, 'secondary indexes', secondary_indexes),
+    (4, 'full-text search', full_text_search),
+    (5, 'iso dates', iso_dates),
+    (6, 'billing covering indexes', billing_covering_indexes),
+    (7, 'billing summaries', billing_summaries),
+    (8, 'appointment slots', appointment_slots),
+    (9, 'sort indexes', sort_indexes),
+    (10, 'hashed passwords', hashed_passwords),
+    (11, 'change log', change_log),
+    (12, 'summaries without amounts', summaries_without_amounts),
+]
+
+
+def current_version(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def upgrade(conn):
+    if conn.execute('PRAGMA user_version').fetchone()[0] == MIGRATIONS[-1][0]:
+        return []
+    applied = []
+    version = current_version(conn)
+    conn.commit()
+    for number, name, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Another process may have applied it while we waited for the lock
+            if current_version(conn) >= number:
+                conn.rollback()
+                continue
+            migrate(conn)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (number, name))
+            conn.execute('PRAGMA user_version = {:d}'.format(number))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(name)
+    # Databases migrated before user_version was kept
+    if not applied:
+        conn.execute('PRAGMA user_version = {:d}'.format(current_version(conn)))
+        conn.commit()
+    return applied
+
+
+# Query Plans
+# The queries the application runs most, with representative parameters, for
+# checking which ones use an index.
+MAIN_QUERIES = {
+    'user_credentials': ('SELECT id, password, role FROM users WHERE username = ?', ('admin',)),
+    'patient_appointments': ('SELECT id, date, time, description FROM appointments WHERE patient_id = ? ORDER BY date', (1,)),
+    'patient_bills': ('SELECT id, date, amount, description FROM billing WHERE patient_id = ? ORDER BY date', (1,)),
+    'patient_chart': (ClinicRepository.CHART_QUERY, {'id': 1}),
+    'day_schedule': ('SELECT id, patient_id, time FROM appointments WHERE date = ? ORDER BY time', ('2024-01-01',)),
+    'revenue_in_range': ('SELECT SUM(amount) FROM billing WHERE date BETWEEN ? AND ?', ('2024-01-01', '2024-12-31')),
+    'bills_by_amount': ('SELECT id, patient_id, date, amount, description FROM billing WHERE amount IS NOT NULL AND amount <= ? AND (amount < ? OR amount = ? AND id < ?) ORDER BY amount DESC, id DESC LIMIT 100',
+                        (500, 500, 500, 1000)),
+}
+
+
+# A query that needs columns an older schema lacks is listed as unavailable
+def query_plans(conn):
+    plans = {}
+    for name, (query, params) in MAIN_QUERIES.items():
+        try:
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()
+        except sqlite3.Error as e:
+            plans[name] = ['unavailable: {}'.format(e)]
+            continue
+        plans[name] = [row[-1] for row in rows]
+    return plans
+
+
+def print_plans(title, plans):
+    print(title)
+    for name, steps in plans.items():
+        print('  {}:'.format(name))
+        for step in steps:
+            print('    ' + step)
+
+
+if __name__ == '__main__':
+    from database import DB_PATH
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    before = current_version(conn)
+    create_base_tables(conn)
+    print_plans('Query plans at schema version {}'.format(before), query_plans(conn))
+    applied = upgrade(conn)
+    print('Applied migrations: {}'.format(', '.join(applied) or 'none'))
+    print_plans('Query plans at schema version {}'.format(current_version(conn)), query_plans(conn))
+    conn.close()
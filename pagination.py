@@ -0,0 +1,352 @@
+from collections import deque
+from functools import partial
+from instrumentation import timed
+
+# Virtual Treeview
+# Keeps at most max_pages pages of rows in a ttk.Treeview. Scrolling near the
+# bottom fetches the next page with keyset pagination and drops the page at
+# the top; scrolling near the top does the reverse. Memory use stays the same
+# no matter how large the underlying table is.
+# fetch_page(after=row, before=row, limit=n) returns the page following or
+# preceding a row already shown, e.g. TableQuery.page, so the same paging
+# works for any sort order.
+# When an executor is given, reloads, searches and the page fetches made while
+# scrolling run on a worker thread. A newer reload or search replaces any that
+# is still in flight, and a page that arrives after one was started is
+# dropped. With a connection pool as well, the replaced request's query is
+# interrupted rather than left to finish.
+# Insert times are recorded under name in the instrumentation metrics.
+# apply(row_id, row) patches one changed row into the loaded pages instead of
+# reloading: the row is updated in place, moved, inserted at its sort position
+# or removed, touching only the loaded pages, so the cost does not depend on
+# the size of the table. With query (a TableQuery, see set_source) rows are
+# placed in its order and checked against its filters; without one they are
+# ordered by id.
+class VirtualTreeview:
+    def __init__(self, tree, scrollbar, fetch_page, page_size=100, max_pages=5, threshold=0.1, executor=None, name='treeview', pool=None, query=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.fetch_page = fetch_page
+        self.query = query
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.threshold = threshold
+        self.executor = executor
+        self.name = name
+        self.pool = pool
+        self.pages = deque()
+        # Loaded rows by iid; the first and last row of every page are the
+        # cursors for the next fetch
+        self.rows = {}
+        self.at_start = True
+        self.at_end = True
+        # Search results: paging and inserts are off until the next reload
+        self.static = False
+        self._pending = False
+        # Changes applied while a reload, search or page fetch is in flight,
+        # replayed on its result in case the query ran before they were
+        # committed
+        self._loading = False
+        self._paging = False
+        self._changes = []
+        # Bumped by every reload and search, so pages fetched for the rows
+        # shown before it are recognised and dropped
+        self._generation = 0
+        self.tree.configure(yscrollcommand=self._on_yscroll)
+
+    # Show a different query (e.g. a new sort order or filter) from the top
+    def set_source(self, fetch_page, query=None):
+        self.fetch_page = fetch_page
+        self.query = query
+        self.reload()
+
+    def reload(self):
+        self._submit(partial(self.fetch_page, limit=self.page_size), self.show_first_page)
+
+    def search(self, fn, *args):
+        self._submit(partial(fn, *args), self.show_rows)
+
+    def _submit(self, fn, callback):
+        if self.executor is None:
+            callback(fn())
+        else:
+            self._loading = True
+            self._generation += 1
+            self._changes.clear()
+            self.executor.submit(fn, key=self, on_success=callback, on_error=self._failed, pool=self.pool)
+
+    def _failed(self, error):
+        self._loading = False
+        raise error
+
+    def show_first_page(self, rows):
+        self.clear()
+        if rows:
+            self.pages.append(self._insert(rows, 'end'))
+        self.at_start = True
+        self.at_end = len(rows) < self.page_size
+        self._replay()
+
+    def show_rows(self, rows):
+        self.clear()
+        if rows:
+            self.pages.append(self._insert(rows, 'end'))
+        self.static = True
+        self._replay()
+
+    def clear(self):
+        self.tree.delete(*self.tree.get_children())
+        self.pages.clear()
+        self.rows.clear()
+        self.at_start = True
+        self.at_end = True
+        self.static = False
+
+    def _replay(self):
+        self._loading = False
+        changes, self._changes = self._changes, []
+        for row_id, row in changes:
+            self.apply(row_id, row)
+
+    def _insert(self, rows, index):
+        iids = []
+        with timed('treeview', self.name, len(rows)):
+            for row in rows:
+                iid = str(row[0])
+                self.tree.insert('', index, iid=iid, values=row)
+                self.rows[iid] = row
+                iids.append(iid)
+                if index != 'end':
+                    index += 1
+        return iids
+
+    def _drop(self, page):
+        self.tree.delete(*page)
+        for iid in page:
+            del self.rows[iid]
+
+    # Row-level change: row is the new row for an insert or update, None for
+    # a delete
+    def apply(self, row_id, row):
+        if self._loading or self._paging:
+            self._changes.append((row_id, row))
+        iid = str(row_id)
+        with timed('treeview', self.name + ' change', 1):
+            if row is not None and not self.static and self.query is not None and not self.query.contains(row_id):
+                row = None
+            if iid in self.rows:
+                if row is not None and (self.static or self._in_order(iid, row)):
+                    self.tree.item(iid, values=row)
+                    self.rows[iid] = row
+                    return
+                self._remove(iid)
+            if row is not None and not self.static:
+                self._place(iid, row)
+        if not self.pages and not (self.at_start and self.at_end):
+            self.reload()
+
+    def _precedes(self, row, other):
+        if self.query is None:
+            return row[0] < other[0]
+        return self.query.precedes(row, other)
+
+    def _in_order(self, iid, row):
+        before, after = self.tree.prev(iid), self.tree.next(iid)
+        return (not before or self._precedes(self.rows[before], row)) and (not after or self._precedes(row, self.rows[after]))
+
+    def _remove(self, iid):
+        for page in self.pages:
+            if iid in page:
+                page.remove(iid)
+                if not page:
+                    self.pages.remove(page)
+                break
+        del self.rows[iid]
+        self.tree.delete(iid)
+
+    # Insert row at its sort position if that falls inside the loaded pages;
+    # a row sorting beyond them is left for the page fetch that reaches it
+    def _place(self, iid, row):
+        children = self.tree.get_children()
+        if not children:
+            if self.at_start and self.at_end:
+                self.pages.append(self._insert([row], 'end'))
+            return
+        if (not self.at_start and self._precedes(row, self.rows[children[0]])) or \
+                (not self.at_end and self._precedes(self.rows[children[-1]], row)):
+            return
+        low, high = 0, len(children)
+        while low < high:
+            middle = (low + high) // 2
+            if self._precedes(self.rows[children[middle]], row):
+                low = middle + 1
+            else:
+                high = middle
+        self.tree.insert('', low, iid=iid, values=row)
+        self.rows[iid] = row
+        if low < len(children):
+            following = children[low]
+            page = next(page for page in self.pages if following in page)
+            page.insert(page.index(following), iid)
+        else:
+            self.pages[-1].append(iid)
+
+    def _on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._pending or self._paging:
+            return
+        if (float(last) >= 1 - self.threshold and not self.at_end) or (float(first) <= self.threshold and not self.at_start):
+            self._pending = True
+            self.tree.after_idle(self._load_more)
+
+    def _load_more(self):
+        self._pending = False
+        if not self.pages:
+            return
+        first, last = self.tree.yview()
+        if last >= 1 - self.threshold and not self.at_end:
+            self._load_next()
+        elif first <= self.threshold and not self.at_start:
+            self._load_previous()
+
+    def _load_next(self):
+        self._fetch(partial(self.fetch_page, after=self.rows[self.pages[-1][-1]], limit=self.page_size), self._show_next)
+
+    def _load_previous(self):
+        self._fetch(partial(self.fetch_page, before=self.rows[self.pages[0][0]], limit=self.page_size), self._show_previous)
+
+    def _fetch(self, fn, callback):
+        if self.executor is None:
+            callback(fn())
+            return
+        self._paging = True
+        self.executor.submit(fn, key=(self, 'page'), on_success=partial(self._paged, self._generation, callback),
+                             on_error=self._page_failed, pool=self.pool, name=self.name + ' page')
+
+    def _paged(self, generation, callback, rows):
+        self._paging = False
+        if generation != self._generation:
+            return
+        callback(rows)
+        if not self._loading:
+            self._replay()
+
+    def _page_failed(self, error):
+        self._paging = False
+        raise error
+
+    # Rows already shown (placed by apply while the page was fetched) are
+    # skipped
+    def _fresh(self, rows):
+        return [row for row in rows if str(row[0]) not in self.rows]
+
+    def _show_next(self, rows):
+        self.at_end = len(rows) < self.page_size
+        rows = self._fresh(rows)
+        if not rows or not self.pages:
+            return
+        anchor = self._top_item()
+        self.pages.append(self._insert(rows, 'end'))
+        if len(self.pages) > self.max_pages:
+            self._drop(self.pages.popleft())
+            self.at_start = False
+        self._restore_top(anchor)
+
+    def _show_previous(self, rows):
+        self.at_start = len(rows) < self.page_size
+        rows = self._fresh(rows)
+        if not rows or not self.pages:
+            return
+        anchor = self._top_item()
+        self.pages.appendleft(self._insert(rows, 0))
+        if len(self.pages) > self.max_pages:
+            self._drop(self.pages.pop())
+            self.at_end = False
+        self._restore_top(anchor)
+
+    # Keep the row that was at the top of the viewport in place while pages
+    # are added and removed around it.
+    def _top_item(self):
+        children = self.tree.get_children()
+        if not children:
+            return None
+        index = min(int(self.tree.yview()[0] * len(children)), len(children) - 1)
+        return children[index]
+
+    def _restore_top(self, anchor):
+        if anchor and self.tree.exists(anchor):
+            total = len(self.tree.get_children())
+            self.tree.yview_moveto(self.tree.index(anchor) / float(total))
+
+
+# Sortable Headings
+# Clicking a heading of a VirtualTreeview sorts it by that column, clicking it
+# again reverses the order. make_query(order_by, descending, **filters) builds
+# the query (e.g. clinic.billing.view), so sorting and filtering run in SQL.
+# headings maps Treeview column ids to sort columns; other headings stay inert.
+class SortableHeadings:
+    ARROWS = {False: ' ▲', True: ' ▼'}
+
+    def __init__(self, view, make_query, headings):
+        self.view = view
+        self.make_query = make_query
+        self.headings = headings
+        self.titles = {column: view.tree.heading(column, 'text') for column in headings}
+        self.order_by = 'id'
+        self.descending = False
+        self.filters = {}
+        for column in headings:
+            view.tree.heading(column, command=partial(self.sort, column))
+
+    def sort(self, column):
+        order_by = self.headings[column]
+        descending = not self.descending if order_by == self.order_by else False
+        self.show(order_by, descending, self.filters)
+
+    # Raises ValueError for a filter value that does not convert
+    def filter(self, **filters):
+        self.show(self.order_by, self.descending, filters)
+
+    def show(self, order_by, descending, filters):
+        query = self.make_query(order_by, descending, **filters)
+        self.order_by, self.descending, self.filters = order_by, descending, filters
+        for column, title in self.titles.items():
+            sorted_here = self.headings[column] == order_by and (order_by != 'id' or descending)
+            self.view.tree.heading(column, text=title + (self.ARROWS[descending] if sorted_here else ''))
+        self.view.set_source(query.page, query)
+
+
+# Search As You Type
+# Runs search(term) for the text of an Entry once typing pauses for delay ms,
+# showing the results in a VirtualTreeview; clearing the Entry reloads the
+# full list. Every keystroke restarts the timer, so a burst of typing costs
+# one search, and a search started while an older one is still running
+# replaces it (see VirtualTreeview). Keys that do not change the text, such as
+# arrows, do nothing. Return searches straight away.
+class IncrementalSearch:
+    def __init__(self, entry, view, search, delay=250):
+        self.entry = entry
+        self.view = view
+        self.search = search
+        self.delay = delay
+        self.term = ''
+        self._after_id = None
+        entry.bind('<KeyRelease>', self._typed)
+        entry.bind('<Return>', lambda event: self.run())
+
+    def _typed(self, event=None):
+        if self.entry.get().strip() == self.term:
+            return
+        if self._after_id is not None:
+            self.entry.after_cancel(self._after_id)
+        self._after_id = self.entry.after(self.delay, self.run)
+
+    def run(self):
+        if self._after_id is not None:
+            self.entry.after_cancel(self._after_id)
+            self._after_id = None
+        self.term = self.entry.get().strip()
+        if self.term:
+            self.view.search(self.search, self.term)
+        else:
+            self.view.reload()
@@ -0,0 +1,179 @@
+from scheduling import validate_chair
+from validation import GENDERS, normalize_date, validate_patient_id
+
+# Sorted and Filtered Views
+# A TableQuery is one table seen in a chosen order with optional filters, read
+# a page at a time. Sorting and filtering happen in SQLite: the filters become
+# a parameterized WHERE clause and every sort order matches an index, so
+# SQLite walks the index instead of sorting the table.
+# Pages use keyset pagination on the sort key followed by the id: the next
+# page starts after the last row shown, found with a range condition on the
+# index, so deep pages cost the same as the first one. NULLs sort first in
+# ascending order and last in descending order, as SQLite sorts them.
+
+# Sortable columns -> index key columns, each matching an index exactly (the
+# id is the rowid every index ends with)
+SORT_KEYS = {
+    'patients': {
+        'id': (),
+        'name': ('name',),
+        'age': ('age',),
+    },
+    'appointments': {
+        'id': (),
+        'patient_id': ('patient_id', 'date'),
+        'date': ('date', 'time'),
+        'time': ('date', 'time'),
+    },
+    'billing': {
+        'id': (),
+        'patient_id': ('patient_id', 'date', 'amount'),
+        'date': ('date', 'amount'),
+        'amount': ('amount',),
+        'description': ('description', 'date', 'amount'),
+    },
+}
+
+
+def _number(label):
+    def convert(value):
+        try:
+            return float(str(value).strip())
+        except ValueError:
+            raise ValueError("{} must be a number".format(label))
+    return convert
+
+
+def _integer(label):
+    def convert(value):
+        try:
+            return int(str(value).strip())
+        except ValueError:
+            raise ValueError("{} must be a whole number".format(label))
+    return convert
+
+
+def _gender(value):
+    if str(value).strip().lower() not in GENDERS:
+        raise ValueError("Gender must be 'Male', 'Female', or 'Other'")
+    return str(value).strip()
+
+
+# Filter name -> (SQL condition, value conversion)
+FILTERS = {
+    'patients': {
+        'gender': ('gender = ? COLLATE NOCASE', _gender),
+        'age_from': ('age >= ?', _integer('Age')),
+        'age_to': ('age <= ?', _integer('Age')),
+    },
+    'appointments': {
+        'patient_id': ('patient_id = ?', validate_patient_id),
+        'date_from': ('date >= ?', normalize_date),
+        'date_to': ('date <= ?', normalize_date),
+        'chair': ('chair = ?', validate_chair),
+    },
+    'billing': {
+        'patient_id': ('patient_id = ?', validate_patient_id),
+        'date_from': ('date >= ?', normalize_date),
+        'date_to': ('date <= ?', normalize_date),
+        'amount_from': ('amount >= ?', _number('Amount')),
+        'amount_to': ('amount <= ?', _number('Amount')),
+    },
+}
+
+
+class TableQuery:
+    def __init__(self, pool, table, columns, order_by='id', descending=False, filters=None):
+        if order_by not in SORT_KEYS[table]:
+            raise ValueError("Cannot sort {} by {}".format(table, order_by))
+        self.pool = pool
+        self.table = table
+        self.columns = columns
+        self.order_by = order_by
+        self.descending = descending
+        self.keys = SORT_KEYS[table][order_by]
+        self.key_indexes = [columns.index(key) for key in self.keys]
+        self.where, self.params = [], []
+        for name, value in (filters or {}).items():
+            if value is None or str(value).strip() == '':
+                continue
+            if name not in FILTERS[table]:
+                raise ValueError("Cannot filter {} by {}".format(table, name))
+            condition, convert = FILTERS[table][name]
+            self.where.append(condition)
+            self.params.append(convert(value))
+
+    # One page in the view's order. after and before are rows previously
+    # returned (the last row of the page above, the first of the page below).
+    def page(self, after=None, before=None, limit=100):
+        if before is not None:
+            rows = self._scan(before, not self.descending, limit)
+            rows.reverse()
+            return rows
+        return self._scan(after, self.descending, limit)
+
+    # Whether row comes before other in this view's order, NULLs first
+    # ascending and last descending, as SQLite sorts them
+    def precedes(self, row, other):
+        if self.descending:
+            return self.sort_key(other) < self.sort_key(row)
+        return self.sort_key(row) < self.sort_key(other)
+
+    def sort_key(self, row):
+        return tuple((row[index] is not None, row[index]) for index in self.key_indexes) + ((True, row[0]),)
+
+    # Whether the row with this id passes the filters: a rowid lookup, so it
+    # costs the same however large the table
+    def contains(self, row_id):
+        if not self.where:
+            return True
+        query = 'SELECT 1 FROM {} WHERE id = ? AND {}'.format(self.table, ' AND '.join(self.where))
+        return self.pool.fetchone(query, [row_id] + self.params) is not None
+
+    def _cursor(self, row):
+        return [row[index] for index in self.key_indexes] + [row[0]]
+
+    def _scan(self, row, descending, limit):
+        if row is None:
+            return self._select([], [], descending, limit)
+        rows = []
+        for where, params in self._segments(self._cursor(row), descending):
+            rows += self._select(where, params, descending, limit - len(rows))
+            if len(rows) >= limit:
+                break
+        return rows
+
+    # The rows after cursor, as a sequence of conditions that each select a
+    # contiguous run of the index: first the rows sharing the whole key with
+    # the cursor (higher ids), then those sharing all but the last key column
+    # (greater last column), and so on out to the leading column. Every
+    # condition is equalities on a key prefix plus one range, which SQLite
+    # answers with an index seek. NULLs sort lowest, so ascending they follow
+    # a NULL cursor value, and descending they come after all other values.
+    def _segments(self, cursor, descending):
+        keys, values = self.keys, cursor[:-1]
+        prefix = [self._equal(key, value) for key, value in zip(keys, values)]
+        yield self._join(prefix + [('id {} ?'.format('<' if descending else '>'), [cursor[-1]])])
+        for index in reversed(range(len(keys))):
+            key, value, equal = keys[index], values[index], prefix[:index]
+            if not descending:
+                yield self._join(equal + [(key + ' IS NOT NULL', []) if value is None else (key + ' > ?', [value])])
+            elif value is not None:
+                yield self._join(equal + [(key + ' < ?', [value])])
+                yield self._join(equal + [(key + ' IS NULL', [])])
+
+    @staticmethod
+    def _equal(key, value):
+        return (key + ' IS NULL', []) if value is None else (key + ' = ?', [value])
+
+    @staticmethod
+    def _join(conditions):
+        return [condition for condition, _ in conditions], [param for _, params in conditions for param in params]
+
+    def _select(self, where, params, descending, limit):
+        direction = ' DESC' if descending else ''
+        where = self.where + where
+        query = 'SELECT {} FROM {}{} ORDER BY {} LIMIT ?'.format(
+            ', '.join(self.columns), self.table, ' WHERE ' + ' AND '.join(where) if where else '',
+            ', '.join(key + direction for key in self.keys + ('id',)))
+        return self.pool.fetchall(query, self.params + params + [limit])
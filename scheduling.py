@@ -0,0 +1,194 @@
+from datetime import datetime, timedelta, timezone
+
+# Appointment Scheduling
+# Appointments carry start_ts/end_ts in minutes since the epoch plus a chair
+# number. Overlap checks are a range query on idx_appointments_chair_start:
+# because no appointment is longer than MAX_DURATION, anything overlapping a
+# new booking must start within MAX_DURATION minutes before its end.
+DEFAULT_DURATION = 30
+MAX_DURATION = 480
+CHAIRS = 3
+OPENING_TIME = '09:00'
+CLOSING_TIME = '17:00'
+SLOT_MINUTES = 15
+# Longest run of days one Schedule may cover
+MAX_SCHEDULE_DAYS = 31
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class SchedulingConflict(ValueError):
+    def __init__(self, conflicts, suggestions):
+        self.conflicts = conflicts
+        self.suggestions = suggestions
+        booked = ', '.join('{} {} ({} min)'.format(row[2], row[3], row[5]) for row in conflicts)
+        message = "Chair is already booked: {}".format(booked)
+        if suggestions:
+            message += "\nNext free slots: " + ', '.join('{} {} (chair {})'.format(*slot) for slot in suggestions)
+        super().__init__(message)
+
+
+def to_minutes(date, time):
+    moment = datetime.strptime(date + ' ' + time, '%Y-%m-%d %H:%M').replace(tzinfo=timezone.utc)
+    return int((moment - _EPOCH).total_seconds()) // 60
+
+
+def from_minutes(minutes):
+    moment = _EPOCH + timedelta(minutes=minutes)
+    return moment.strftime('%Y-%m-%d'), moment.strftime('%H:%M')
+
+
+def minute_of_day(time):
+    hours, _, minutes = time.partition(':')
+    return int(hours) * 60 + int(minutes)
+
+
+# The Monday of the week date (YYYY-MM-DD) falls in
+def week_start(date):
+    day = datetime.strptime(date, '%Y-%m-%d')
+    return (day - timedelta(days=day.weekday())).strftime('%Y-%m-%d')
+
+
+def validate_duration(duration):
+    try:
+        duration = int(duration)
+    except (TypeError, ValueError):
+        raise ValueError("Duration must be a whole number of minutes")
+    if duration <= 0 or duration > MAX_DURATION:
+        raise ValueError("Duration must be between 1 and {} minutes".format(MAX_DURATION))
+    return duration
+
+
+def validate_days(days):
+    try:
+        days = int(days)
+    except (TypeError, ValueError):
+        raise ValueError("Days must be a whole number")
+    if days <= 0 or days > MAX_SCHEDULE_DAYS:
+        raise ValueError("Days must be between 1 and {}".format(MAX_SCHEDULE_DAYS))
+    return days
+
+
+def validate_chair(chair):
+    try:
+        chair = int(chair)
+    except (TypeError, ValueError):
+        raise ValueError("Chair must be a number")
+    if chair <= 0:
+        raise ValueError("Chair must be a positive number")
+    return chair
+
+
+class Scheduler:
+    def __init__(self, chairs=CHAIRS, opening=OPENING_TIME, closing=CLOSING_TIME, slot_minutes=SLOT_MINUTES):
+        self.chairs = chairs
+        self.opening = opening
+        self.closing = closing
+        self.slot_minutes = slot_minutes
+
+    def bookings(self, conn, chair, start, end, exclude_id=None):
+        return conn.execute('''SELECT id, patient_id, date, time, description, duration, start_ts, end_ts
+                               FROM appointments
+                               WHERE chair = ? AND start_ts > ? AND start_ts < ? AND end_ts > ? AND id IS NOT ?
+                               ORDER BY start_ts''',
+                            (chair, start - MAX_DURATION, end, start, exclude_id)).fetchall()
+
+    def conflicts(self, conn, date, time, duration, chair, exclude_id=None):
+        start = to_minutes(date, time)
+        return self.bookings(conn, chair, start, start + duration, exclude_id)
+
+    # Walks the gaps between bookings, chair by chair and day by day, starting
+    # at the requested time. Each chair-day is one indexed range query.
+    def next_free_slots(self, conn, date, time, duration, chair=None, count=3, days=7, exclude_id=None):
+        chairs = [chair] + [c for c in range(1, self.chairs + 1) if c != chair] if chair else list(range(1, self.chairs + 1))
+        earliest = to_minutes(date, time)
+        slots = []
+        day = datetime.strptime(date, '%Y-%m-%d')
+        for _ in range(days):
+            day_name = day.strftime('%Y-%m-%d')
+            opening, closing = to_minutes(day_name, self.opening), to_minutes(day_name, self.closing)
+            for current_chair in chairs:
+                cursor = max(opening, earliest)
+                cursor += -(cursor - opening) % self.slot_minutes
+                for booking in self.bookings(conn, current_chair, opening, closing, exclude_id):
+                    if booking[6] - cursor >= duration:
+                        break
+                    cursor = max(cursor, booking[7])
+                    cursor += -(cursor - opening) % self.slot_minutes
+                if cursor + duration <= closing:
+                    slots.append(from_minutes(cursor) + (current_chair,))
+            if len(slots) >= count:
+                break
+            day += timedelta(days=1)
+        slots.sort()
+        return slots[:count]
+
+
+# Schedule
+# The appointments of a run of days laid out as a grid: for every day and
+# chair one cell per slot from opening to closing time, widened to take in
+# any appointment outside them, each cell holding the ids of the appointments
+# that cover that slot. The grid is built once when the days are loaded, so
+# drawing a day or one chair's week only reads ready-made lists. Rows are
+# (id, patient_id, date, time, description, duration, chair, patient name),
+# as returned by ClinicRepository.appointments_between.
+class Schedule:
+    def __init__(self, first, days, rows, chairs, opening=OPENING_TIME, closing=CLOSING_TIME, slot_minutes=SLOT_MINUTES):
+        start = datetime.strptime(first, '%Y-%m-%d')
+        self.dates = [(start + timedelta(days=day)).strftime('%Y-%m-%d') for day in range(days)]
+        self.slot_minutes = slot_minutes
+        self.appointments = {row[0]: row for row in rows}
+        self.patients = {row[1] for row in rows}
+        self.chairs = sorted(set(chairs) | {row[6] for row in rows})
+        self.starts = {row[0]: minute_of_day(row[3]) for row in rows}
+        opening, closing = minute_of_day(opening), minute_of_day(closing)
+        for row in rows:
+            opening = min(opening, self.starts[row[0]] - self.starts[row[0]] % slot_minutes)
+            closing = min(max(closing, self.starts[row[0]] + (row[5] or 0)), 24 * 60)
+        self.opening = opening
+        self.times = ['{:02d}:{:02d}'.format(*divmod(minute, 60)) for minute in range(opening, closing, slot_minutes)]
+        self.cells = {(date, chair): [()] * len(self.times) for date in self.dates for chair in self.chairs}
+        for row in rows:
+            cells = self.cells.get((row[2], row[6]))
+            if cells is None:
+                continue
+            begin = (self.starts[row[0]] - opening) // slot_minutes
+            end = max(begin + 1, -(-(self.starts[row[0]] + (row[5] or 0) - opening) // slot_minutes))
+            for index in range(begin, min(end, len(cells))):
+                cells[index] += (row[0],)
+
+    def __len__(self):
+        return len(self.appointments)
+
+    # Rows of (time, cell per chair) for one day
+    def day(self, date):
+        columns = [self.cells[date, chair] for chair in self.chairs]
+        return [(time,) + tuple(self.label(cells[index], index) for cells in columns) for index, time in enumerate(self.times)]
+
+    # Rows of (time, cell per day) for one chair
+    def week(self, chair):
+        columns = [self.cells[date, chair] for date in self.dates]
+        return [(time,) + tuple(self.label(cells[index], index) for cells in columns) for index, time in enumerate(self.times)]
+
+    # The patient and description in the slot an appointment starts in, a bar
+    # in the slots it runs on into
+    def label(self, cell, index):
+        slot = self.opening + index * self.slot_minutes
+        parts = []
+        for appointment_id in cell:
+            if self.starts[appointment_id] < slot:
+                parts.append('|')
+                continue
+            row = self.appointments[appointment_id]
+            parts.append('{}: {}'.format(row[7] or 'Patient {}'.format(row[1]), row[4]))
+        return ' / '.join(parts)
+
+    # Whether a change reported by ClinicRepository.notify shows here
+    def affected(self, table, row_id, row):
+        if table not in ('appointments', 'patients'):
+            return False
+        if row_id is None:
+            return True
+        if table == 'patients':
+            return row_id in self.patients
+        return row_id in self.appointments or (row is not None and row[2] in self.dates)
@@ -0,0 +1,180 @@
+import re
+import sqlite3
+import unicodedata
+
+# Full-text Search Index
+# External-content FTS5 tables mirror the searchable text columns and are kept
+# in sync by triggers, so a search reads the inverted index instead of
+# scanning the base table with LIKE '%term%'.
+FTS_TABLES = {
+    'patients': ('patients_fts', ('name', 'contact')),
+    'appointments': ('appointments_fts', ('description',)),
+    'billing': ('billing_fts', ('description',)),
+}
+
+SEARCH_LIMIT = 500
+# Positions of the indexed text columns in the rows each search returns
+TEXT_POSITIONS = {
+    'patients': (1, 4),
+    'appointments': (4,),
+    'billing': (4,),
+}
+# Ranking has to score every match, so very common prefixes are returned in
+# rowid order instead once they match more rows than this.
+RANK_LIMIT = 5000
+
+
+def fts5_available(conn):
+    try:
+        return bool(conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+    except sqlite3.Error:
+        return False
+
+
+def setup_search_index(conn):
+    if not fts5_available(conn):
+        return False
+    c = conn.cursor()
+    for table, (fts, columns) in FTS_TABLES.items():
+        exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)).fetchone()
+        cols = ', '.join(columns)
+        new_cols = ', '.join('new.' + col for col in columns)
+        old_cols = ', '.join('old.' + col for col in columns)
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                        {cols}, content='{table}', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                    )'''.format(fts=fts, cols=cols, table=table))
+        c.execute('''CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                        INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new_cols});
+                    END'''.format(fts=fts, table=table, cols=cols, new_cols=new_cols))
+        c.execute('''CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                        INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+                    END'''.format(fts=fts, table=table, cols=cols, old_cols=old_cols))
+        c.execute('''CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+                        INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+                        INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new_cols});
+                    END'''.format(fts=fts, table=table, cols=cols, old_cols=old_cols, new_cols=new_cols))
+        if not exists:
+            c.execute("INSERT INTO {fts} ({fts}) VALUES ('rebuild')".format(fts=fts))
+    return True
+
+
+# Bulk loads drop the per-row insert trigger inside their transaction and
+# index the new rows with one INSERT ... SELECT, which is much cheaper.
+def insert_trigger(conn, table):
+    fts = FTS_TABLES[table][0]
+    return conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (fts + '_ai',)).fetchone()
+
+
+def index_rows_after(conn, table, after_id):
+    fts, columns = FTS_TABLES[table]
+    cols = ', '.join(columns)
+    conn.execute('INSERT INTO {fts} (rowid, {cols}) SELECT id, {cols} FROM {table} WHERE id > ?'.format(fts=fts, cols=cols, table=table),
+                 (after_id,))
+
+
+def rebuild_search_index(conn):
+    with conn:
+        for fts, _ in FTS_TABLES.values():
+            conn.execute("INSERT INTO {fts} ({fts}) VALUES ('rebuild')".format(fts=fts))
+        for fts, _ in FTS_TABLES.values():
+            conn.execute("INSERT INTO {fts} ({fts}) VALUES ('optimize')".format(fts=fts))
+
+
+# Turn free text into an FTS5 query where every word must match as a prefix,
+# e.g. "jo smi" -> "jo"* AND "smi"*. Returns None when there is nothing to match.
+def match_expression(search_term):
+    tokens = re.findall(r'\w+', search_term, re.UNICODE)
+    if not tokens:
+        return None
+    return ' AND '.join('"{}"*'.format(token) for token in tokens)
+
+
+# Words as the unicode61 tokenizer sees them: case-folded, diacritics removed,
+# split on anything that is not a letter or digit.
+def fold_tokens(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r'[^\W_]+', text.casefold(), re.UNICODE)
+
+
+class SearchIndex:
+    def __init__(self, pool, limit=SEARCH_LIMIT):
+        self.pool = pool
+        self.limit = limit
+        self._available = None
+
+    @property
+    def available(self):
+        if self._available is None:
+            conn = self.pool.connection()
+            self._available = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'patients_fts'").fetchone() is not None
+        return self._available
+
+    def search_patients(self, search_term):
+        search_term = search_term.strip()
+        rows = []
+        # Exact id lookup goes straight to the primary key
+        if search_term.isdigit():
+            rows = self.pool.fetchall('SELECT id, name, age, gender, contact FROM patients WHERE id = ?', (int(search_term),))
+        matches = self._match('patients', 'id, name, age, gender, contact', search_term)
+        return rows + [row for row in matches if not rows or row[0] != rows[0][0]]
+
+    def search_appointments(self, search_term):
+        search_term = search_term.strip()
+        if search_term.isdigit():
+            return self.pool.fetchall('SELECT id, patient_id, date, time, description, duration, chair FROM appointments WHERE patient_id = ? ORDER BY id LIMIT ?', (int(search_term), self.limit))
+        return self._match('appointments', 'id, patient_id, date, time, description, duration, chair', search_term)
+
+    def search_bills(self, search_term):
+        search_term = search_term.strip()
+        if search_term.isdigit():
+            return self.pool.fetchall('SELECT id, patient_id, date, amount, description FROM billing WHERE patient_id = ? ORDER BY id LIMIT ?', (int(search_term), self.limit))
+        return self._match('billing', 'id, patient_id, date, amount, description', search_term)
+
+    # True when every row matching search_term also matches shorter, so its
+    # results can be filtered from the complete results for shorter instead of
+    # searching again: each word of shorter is a prefix of a word of
+    # search_term, e.g. "jo smi" -> "john smit". Numeric terms are ID lookups
+    # and never narrow.
+    def refines(self, search_term, shorter):
+        search_term, shorter = search_term.strip(), shorter.strip()
+        if not shorter or search_term.isdigit() or shorter.isdigit():
+            return False
+        if not self.available:
+            if any(char in search_term for char in '%_'):
+                return False
+            return shorter.casefold() in search_term.casefold()
+        if '_' in search_term or '_' in shorter:
+            return False
+        words = fold_tokens(search_term)
+        return bool(words) and all(any(word.startswith(prefix) for word in words) for prefix in fold_tokens(shorter))
+
+    # Row predicate with the same meaning as searching table for search_term
+    def matcher(self, table, search_term):
+        positions = TEXT_POSITIONS[table]
+        if not self.available:
+            needle = search_term.strip().casefold()
+            return lambda row: any(needle in (row[i] or '').casefold() for i in positions)
+        prefixes = fold_tokens(search_term)
+
+        def matches(row):
+            words = [word for i in positions for word in fold_tokens(row[i])]
+            return all(any(word.startswith(prefix) for word in words) for prefix in prefixes)
+        return matches
+
+    def _match(self, table, columns, search_term):
+        fts, fts_columns = FTS_TABLES[table]
+        if not self.available:
+            pattern = '%' + search_term + '%'
+            where = ' OR '.join('{} LIKE ?'.format(col) for col in fts_columns)
+            return self.pool.fetchall('SELECT {} FROM {} WHERE {} LIMIT ?'.format(columns, table, where), (pattern,) * len(fts_columns) + (self.limit,))
+        expression = match_expression(search_term)
+        if expression is None:
+            return []
+        columns = ', '.join('t.' + col for col in columns.split(', '))
+        query = 'SELECT {columns} FROM {fts} JOIN {table} t ON t.id = {fts}.rowid WHERE {fts} MATCH ?'.format(columns=columns, fts=fts, table=table)
+        matches = self.pool.fetchone('SELECT count(*) FROM (SELECT 1 FROM {fts} WHERE {fts} MATCH ? LIMIT ?)'.format(fts=fts), (expression, RANK_LIMIT + 1))[0]
+        if matches > RANK_LIMIT:
+            return self.pool.fetchall(query + ' LIMIT ?', (expression, self.limit))
+        return self.pool.fetchall(query + ' ORDER BY {fts}.rank LIMIT ?'.format(fts=fts), (expression, self.limit))
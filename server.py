@@ -0,0 +1,450 @@
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+from credentials import LoginLocked
+from scheduling import DEFAULT_DURATION, SchedulingConflict
+
+# HTTP/JSON API Server
+# A small asyncio HTTP/1.1 server over the service layer, so tablets and other
+# workstations can share one clinic database. The event loop only parses and
+# writes; every request runs in a bounded thread pool, each worker thread with
+# its own pooled SQLite connection. Connections are kept alive and requests
+# may be pipelined: reads on one connection run concurrently, writes wait for
+# the requests before them, and responses always go back in request order.
+#
+# Clients authenticate with a session token from POST /login (Authorization:
+# Bearer) or with HTTP Basic credentials on every request. Either way only the
+# first request checks the password hash; later ones are answered from the
+# in-memory session cache.
+#
+# Changes made by other workstations are picked up from the change log twice
+# a second (see changefeed.py), so the caches never serve stale records.
+#
+# Target: more than 2,000 simple authenticated reads (GET /patients?limit=20)
+# per second on one core against localhost, with keep-alive and pipelining.
+HOST = '127.0.0.1'
+PORT = 8080
+WORKERS = 4
+MAX_PENDING = 256
+PIPELINE_DEPTH = 16
+KEEP_ALIVE_TIMEOUT = 15
+MAX_HEADER_SIZE = 16384
+MAX_BODY_SIZE = 1048576
+MAX_PAGE_SIZE = 1000
+
+COLUMNS = {
+    'patients': ('id', 'name', 'age', 'gender', 'contact'),
+    'appointments': ('id', 'patient_id', 'date', 'time', 'description', 'duration', 'chair'),
+    'billing': ('id', 'patient_id', 'date', 'amount', 'description'),
+    'users': ('id', 'username', 'role'),
+    'chart_appointments': ('id', 'date', 'time', 'description', 'duration', 'chair'),
+    'chart_bills': ('id', 'date', 'amount', 'description', 'balance'),
+    'schedule': ('id', 'patient_id', 'date', 'time', 'description', 'duration', 'chair', 'patient_name'),
+}
+
+FIELDS = {
+    'patients': ('name', 'age', 'gender', 'contact'),
+    'appointments': ('patient_id', 'date', 'time', 'description', 'duration', 'chair'),
+    'billing': ('patient_id', 'date', 'amount', 'description'),
+    'users': ('username', 'password', 'role'),
+}
+
+OPTIONAL = {'duration': DEFAULT_DURATION, 'chair': 1}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+class Request:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.version = version
+        self.headers = headers
+        self.body = body
+        url = urlsplit(target)
+        self.path = url.path.rstrip('/') or '/'
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        connection = headers.get('connection', '').lower()
+        self.keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        self.role = None
+
+    @property
+    def safe(self):
+        return self.method in ('GET', 'HEAD')
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except (UnicodeDecodeError, ValueError):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Request body must be JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object")
+        return data
+
+    def int_param(self, name, default=None):
+        value = self.query.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "{} must be a number".format(name))
+
+
+def as_dicts(table, rows):
+    return [dict(zip(COLUMNS[table], row)) for row in rows]
+
+
+def fields(request, table):
+    data = request.json()
+    missing = [name for name in FIELDS[table] if name not in data and name not in OPTIONAL]
+    if missing:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Missing fields: {}".format(', '.join(missing)))
+    return [data.get(name, OPTIONAL.get(name)) for name in FIELDS[table]]
+
+
+class ApiServer:
+    def __init__(self, clinic, host=HOST, port=PORT, workers=WORKERS, max_pending=MAX_PENDING,
+                 pipeline_depth=PIPELINE_DEPTH, keep_alive_timeout=KEEP_ALIVE_TIMEOUT):
+        self.clinic = clinic
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api')
+        self.max_pending = max_pending
+        self.pipeline_depth = pipeline_depth
+        self.keep_alive_timeout = keep_alive_timeout
+        self.server = None
+        self.requests = 0
+        self.connections = 0
+        self.routes = []
+        self._add_routes()
+
+    # Routes
+    def route(self, method, pattern, handler, auth='user'):
+        self.routes.append((method, re.compile('^{}$'.format(pattern)), handler, auth))
+
+    def _add_routes(self):
+        self.route('GET', '/health', lambda request: (HTTPStatus.OK, self.stats()), auth=None)
+        self.route('POST', '/login', self.login, auth=None)
+        self.route('POST', '/logout', self.logout)
+        self.route('GET', r'/patients/(\d+)/chart', self.chart)
+        self._add_resource('patients', 'patients', self.clinic.patients)
+        self.route('GET', '/appointments/slots', self.free_slots)
+        self.route('GET', '/appointments/schedule', self.schedule)
+        self._add_resource('appointments', 'appointments', self.clinic.appointments)
+        self._add_resource('bills', 'billing', self.clinic.billing)
+        self._add_resource('users', 'users', self.clinic.users, auth='admin')
+
+    def _add_resource(self, path, table, service, auth='user'):
+        def page(request):
+            if table == 'users':
+                return HTTPStatus.OK, as_dicts(table, service.list())
+            limit = min(request.int_param('limit', 100), MAX_PAGE_SIZE)
+            return HTTPStatus.OK, as_dicts(table, service.page(request.int_param('after'), request.int_param('before'), limit))
+
+        def get(request, row_id):
+            row = service.get(int(row_id))
+            if row is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, "Not found")
+            return HTTPStatus.OK, as_dicts(table, [row])[0]
+
+        def search(request):
+            return HTTPStatus.OK, as_dicts(table, service.search(request.query.get('q', '')))
+
+        def add(request):
+            return HTTPStatus.CREATED, {'id': service.add(*fields(request, table))}
+
+        def update(request, row_id):
+            service.update(int(row_id), *fields(request, table))
+            return HTTPStatus.OK, {'id': int(row_id)}
+
+        def delete(request, row_id):
+            service.delete(int(row_id))
+            return HTTPStatus.OK, {'id': int(row_id)}
+
+        self.route('GET', '/' + path, page, auth)
+        if hasattr(service, 'search'):
+            self.route('GET', '/{}/search'.format(path), search, auth)
+        if hasattr(service, 'get'):
+            self.route('GET', r'/{}/(\d+)'.format(path), get, auth)
+        self.route('POST', '/' + path, add, auth)
+        self.route('PUT', r'/{}/(\d+)'.format(path), update, auth)
+        self.route('DELETE', r'/{}/(\d+)'.format(path), delete, auth)
+
+    def login(self, request):
+        data = request.json()
+        session = self.clinic.users.login(data.get('username', ''), data.get('password', ''))
+        if session is None:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Invalid credentials")
+        token, role = session
+        return HTTPStatus.OK, {'username': data['username'], 'role': role, 'token': token}
+
+    def logout(self, request):
+        scheme, _, token = request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() == 'bearer':
+            self.clinic.users.logout(token.strip())
+        return HTTPStatus.OK, {}
+
+    def chart(self, request, patient_id):
+        chart = self.clinic.patients.chart(int(patient_id))
+        if chart is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Not found")
+        return HTTPStatus.OK, {
+            'patient': as_dicts('patients', [chart.patient])[0],
+            'upcoming': as_dicts('chart_appointments', chart.upcoming),
+            'past': as_dicts('chart_appointments', chart.past),
+            'bills': as_dicts('chart_bills', chart.bills),
+            'balance': chart.balance,
+        }
+
+    def free_slots(self, request):
+        if 'date' not in request.query or 'time' not in request.query:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "date and time are required")
+        slots = self.clinic.appointments.free_slots(request.query['date'], request.query['time'], request.query.get('duration', DEFAULT_DURATION),
+                                                    request.int_param('chair'), request.int_param('count', 3))
+        return HTTPStatus.OK, [{'date': date, 'time': time, 'chair': chair} for date, time, chair in slots]
+
+    # The grid as slot times, and per date and chair the appointment ids
+    # covering each slot
+    def schedule(self, request):
+        if 'date' not in request.query:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "date is required")
+        schedule = self.clinic.appointments.schedule(request.query['date'], request.int_param('days', 1), request.int_param('chair'))
+        return HTTPStatus.OK, {
+            'dates': schedule.dates,
+            'chairs': schedule.chairs,
+            'times': schedule.times,
+            'appointments': as_dicts('schedule', schedule.appointments.values()),
+            'slots': {date: {str(chair): [list(cell) for cell in schedule.cells[date, chair]] for chair in schedule.chairs} for date in schedule.dates},
+        }
+
+    def authenticate(self, request):
+        scheme, _, credentials = request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() == 'bearer':
+            session = self.clinic.users.session(credentials.strip())
+            if session is None:
+                raise HTTPError(HTTPStatus.UNAUTHORIZED, "Session expired", (('WWW-Authenticate', 'Bearer realm="dcms"'),))
+            return session[1]
+        if scheme.lower() != 'basic':
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Authentication required", (('WWW-Authenticate', 'Basic realm="dcms"'),))
+        try:
+            username, _, password = base64.b64decode(credentials).decode('utf-8').partition(':')
+        except (binascii.Error, UnicodeDecodeError):
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Malformed credentials", (('WWW-Authenticate', 'Basic realm="dcms"'),))
+        role = self.clinic.users.authenticate(username, password, cached=True)
+        if role is None:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Invalid credentials", (('WWW-Authenticate', 'Basic realm="dcms"'),))
+        return role
+
+    # Runs in a worker thread: authentication, the operation and JSON encoding
+    def dispatch(self, request):
+        try:
+            allowed = []
+            for method, pattern, handler, auth in self.routes:
+                match = pattern.match(request.path)
+                if not match:
+                    continue
+                if method != request.method:
+                    allowed.append(method)
+                    continue
+                if auth:
+                    request.role = self.authenticate(request)
+                    if auth == 'admin' and request.role != 'admin':
+                        raise HTTPError(HTTPStatus.FORBIDDEN, "Admin access required")
+                status, payload = handler(request, *match.groups())
+                return status, (), payload
+            if allowed:
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed", (('Allow', ', '.join(allowed)),))
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Not found")
+        except HTTPError as e:
+            return e.status, e.headers, {'error': str(e)}
+        except LoginLocked as e:
+            return HTTPStatus.TOO_MANY_REQUESTS, (('Retry-After', str(e.retry_after)),), {'error': str(e)}
+        except SchedulingConflict as e:
+            return HTTPStatus.CONFLICT, (), {'error': str(e), 'conflicts': [dict(zip(COLUMNS['appointments'], row[:6])) for row in e.conflicts],
+                                             'suggestions': [{'date': date, 'time': time, 'chair': chair} for date, time, chair in e.suggestions]}
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, (), {'error': str(e)}
+        except sqlite3.IntegrityError as e:
+            return HTTPStatus.CONFLICT, (), {'error': str(e)}
+        except sqlite3.Error as e:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, (), {'error': str(e)}
+
+    def stats(self):
+        stats = {'status': 'ok', 'requests': self.requests, 'connections': self.connections, 'sessions': self.clinic.users.sessions.stats()}
+        if self.clinic.patient_cache is not None:
+            stats['patient_cache'] = self.clinic.patient_cache.stats()
+            stats['chart_cache'] = self.clinic.patients.charts.stats()
+        if self.clinic.writes is not None:
+            stats['write_queue'] = self.clinic.writes.stats()
+        stats['changes'] = self.clinic.changes.stats()
+        return stats
+
+    # Connections
+    async def start(self):
+        self._pending = asyncio.Semaphore(self.max_pending)
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port, limit=MAX_HEADER_SIZE)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        responses = asyncio.Queue(self.pipeline_depth)
+        sender = asyncio.ensure_future(self._send_responses(responses, writer))
+        # Reads since the last write may run together; a write waits for them
+        inflight, barrier = [], None
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as e:
+                    await responses.put((asyncio.ensure_future(self._error(e)), False))
+                    break
+                if request is None:
+                    break
+                if request.safe:
+                    task = asyncio.ensure_future(self._run(request, barrier))
+                    inflight.append(task)
+                else:
+                    task = asyncio.ensure_future(self._run(request, barrier, inflight))
+                    inflight, barrier = [], task
+                await responses.put((task, request.keep_alive))
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            await responses.put(None)
+            await sender
+
+    async def _read_request(self, reader):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keep_alive_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Request headers too large")
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+        if version not in ('HTTP/1.0', 'HTTP/1.1'):
+            raise HTTPError(HTTPStatus.HTTP_VERSION_NOT_SUPPORTED, "HTTP version not supported")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        if 'transfer-encoding' in headers:
+            raise HTTPError(HTTPStatus.NOT_IMPLEMENTED, "Chunked request bodies are not supported")
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+        body = await reader.readexactly(length) if length else b''
+        return Request(method.upper(), target, version, headers, body)
+
+    async def _run(self, request, barrier=None, previous=()):
+        if barrier is not None:
+            await asyncio.wait([barrier])
+        if previous:
+            await asyncio.wait(previous)
+        async with self._pending:
+            status, headers, payload = await asyncio.get_running_loop().run_in_executor(self.executor, self.dispatch, request)
+        self.requests += 1
+        return status, headers, json.dumps(payload).encode('utf-8')
+
+    async def _error(self, error):
+        return error.status, error.headers, json.dumps({'error': str(error)}).encode('utf-8')
+
+    async def _send_responses(self, responses, writer):
+        connected = True
+        try:
+            while True:
+                item = await responses.get()
+                if item is None:
+                    break
+                task, keep_alive = item
+                status, headers, body = await task
+                if not connected:
+                    # The client went away; keep draining so the reader never blocks
+                    continue
+                head = ['HTTP/1.1 {} {}'.format(status.value, status.phrase),
+                        'Content-Type: application/json',
+                        'Content-Length: {}'.format(len(body)),
+                        'Connection: {}'.format('keep-alive' if keep_alive else 'close')]
+                head.extend('{}: {}'.format(name, value) for name, value in headers)
+                writer.write('\r\n'.join(head).encode('latin-1') + b'\r\n\r\n' + body)
+                # Pipelined responses that are already waiting go out in one write
+                try:
+                    if responses.empty():
+                        await writer.drain()
+                except ConnectionError:
+                    connected = False
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+
+# Polls the change feed while serving, so the caches pick up writes made by
+# other workstations
+async def serve(clinic, host=HOST, port=PORT, workers=WORKERS):
+    clinic.changes.start()
+    try:
+        server = await ApiServer(clinic, host, port, workers).start()
+        print('Serving the clinic API on http://{}:{}'.format(server.host, server.port))
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+    finally:
+        clinic.changes.stop()
+
+
+def main(argv=None):
+    from database import ConnectionPool, DB_PATH
+    from services import Clinic
+    parser = argparse.ArgumentParser(description='Dental Clinic Management System API server')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args(argv)
+    clinic = Clinic(ConnectionPool(args.db)).setup()
+    try:
+        asyncio.run(serve(clinic, args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        clinic.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+from database import ClinicRepository, pool as default_pool
+from cache import ChartCache, PatientCache, SearchCache
+from credentials import LoginLimiter, SessionCache, dummy_hash, hash_password, needs_rehash, verify_password
+from migrations import upgrade
+from scheduling import DEFAULT_DURATION
+from validation import normalize_date, validate_appointment, validate_bill, validate_credentials, validate_patient, validate_patient_id, validate_user
+from writequeue import WriteQueue
+
+# Service Layer
+# Everything the application does, without Tkinter: the GUIs, the command line
+# and scripts all go through these classes. Methods take plain values, raise
+# ValueError (or SchedulingConflict) for bad input and let sqlite3.Error
+# through for database failures. Patient, appointment and bill writes accept
+# wait=False to return a Future instead of waiting for the commit.
+#
+# Logins check a salted password hash, which is deliberately slow (about
+# 60 ms), so GUIs should call authenticate from a worker thread. Any change to
+# the users table ends every session, so a removed user or a changed role or
+# password takes effect at once. Usernames and passwords must be strings and
+# roles one of validation.ROLES, whichever client sends them.
+class UserService:
+    def __init__(self, repository, limiter=None, sessions=None):
+        self.repository = repository
+        self.limiter = limiter or LoginLimiter()
+        self.sessions = sessions or SessionCache()
+        repository.subscribe(self._changed)
+
+    # The user's role, or None for a wrong username or password. Raises
+    # LoginLocked while the username is locked out. With cached=True a pair
+    # verified before is accepted from the session cache without hashing it
+    # again, for clients that send the password with every request.
+    def authenticate(self, username, password, cached=False):
+        validate_credentials(username, password)
+        key = self.sessions.credential_key(username, password) if cached else None
+        if key is not None:
+            session = self.sessions.get(key)
+            if session is not None:
+                return session[1]
+        self.limiter.check(username)
+        user = self.repository.get_credentials(username)
+        valid = verify_password(password, user[1] if user else dummy_hash())
+        if user is None or not valid:
+            self.limiter.failed(username)
+            return None
+        self.limiter.succeeded(username)
+        user_id, stored, role = user
+        if needs_rehash(stored):
+            self.repository.rehash_password(user_id, hash_password(password))
+        if key is not None:
+            self.sessions.remember(key, username, role)
+        return role
+
+    # (token, role) for a correct username and password, else None
+    def login(self, username, password):
+        role = self.authenticate(username, password)
+        if role is None:
+            return None
+        return self.sessions.create(username, role), role
+
+    # (username, role) for a live session token, else None
+    def session(self, token):
+        return self.sessions.get(token)
+
+    def logout(self, token):
+        self.sessions.revoke(token)
+
+    def add(self, username, password, role):
+        username, password, role = validate_user(username, password, role)
+        return self.repository.add_user(username, hash_password(password), role)
+
+    def update(self, user_id, username, password, role):
+        username, password, role = validate_user(username, password, role)
+        self.repository.update_user(user_id, username, hash_password(password), role)
+
+    def delete(self, user_id):
+        self.repository.delete_user(user_id)
+
+    def list(self):
+        return self.repository.list_users()
+
+    def _changed(self, table, row_id=None, row=None):
+        if table == 'users':
+            self.sessions.clear()
+
+
+# Lookups, searches and charts are served from the caches; writes go through
+# the repository, which keeps the caches up to date.
+class PatientService:
+    def __init__(self, repository, cache=None, charts=None):
+        self.repository = repository
+        self.cache = cache
+        self.charts = charts
+
+    def get(self, patient_id):
+        patient_id = validate_patient_id(patient_id)
+        if self.cache is None:
+            return self.repository.get_patient(patient_id)
+        return self.cache.get(patient_id)
+
+    # Demographics, appointments and bills with a running balance (see
+    # ClinicRepository.patient_chart), or None for an unknown patient
+    def chart(self, patient_id):
+        patient_id = validate_patient_id(patient_id)
+        if self.charts is None:
+            return self.repository.patient_chart(patient_id)
+        return self.charts.get(patient_id)
+
+    def add(self, name, age, gender, contact, wait=True):
+        return self.repository.add_patient(*validate_patient(name, age, gender, contact), wait=wait)
+
+    def update(self, patient_id, name, age, gender, contact, wait=True):
+        return self.repository.update_patient(validate_patient_id(patient_id), *validate_patient(name, age, gender, contact), wait=wait)
+
+    def delete(self, patient_id, wait=True):
+        return self.repository.delete_patient(validate_patient_id(patient_id), wait=wait)
+
+    def search(self, term):
+        if self.cache is None:
+            return self.repository.search_patients(term)
+        return self.cache.search(term)
+
+    def page(self, after_id=None, before_id=None, limit=100):
+        return self.repository.fetch_page('patients', after_id, before_id, limit)
+
+    def view(self, order_by='id', descending=False, **filters):
+        return self.repository.query('patients', order_by, descending, filters)
+
+
+# Searches go through a SearchCache when one is given, so typing a longer
+# term narrows the previous results instead of querying again.
+class AppointmentService:
+    def __init__(self, repository, searches=None):
+        self.repository = repository
+        self.searches = searches
+
+    def add(self, patient_id, date, time, description, duration=DEFAULT_DURATION, chair=1, wait=True):
+        return self.repository.add_appointment(*validate_appointment(patient_id, date, time, description, duration, chair), wait=wait)
+
+    def update(self, appointment_id, patient_id, date, time, description, duration=DEFAULT_DURATION, chair=1, wait=True):
+        return self.repository.update_appointment(appointment_id, *validate_appointment(patient_id, date, time, description, duration, chair), wait=wait)
+
+    def delete(self, appointment_id, wait=True):
+        return self.repository.delete_appointment(appointment_id, wait=wait)
+
+    def search(self, term):
+        if self.searches is None:
+            return self.repository.search_appointments(term)
+        return self.searches.search(term)
+
+    def page(self, after_id=None, before_id=None, limit=100):
+        return self.repository.fetch_page('appointments', after_id, before_id, limit)
+
+    def view(self, order_by='id', descending=False, **filters):
+        return self.repository.query('appointments', order_by, descending, filters)
+
+    def free_slots(self, date, time, duration=DEFAULT_DURATION, chair=None, count=3):
+        return self.repository.free_slots(date, time, duration, chair, count)
+
+    # days days of appointments from date, all chairs or one, bucketed into
+    # time slots for calendar views (see scheduling.Schedule)
+    def schedule(self, date, days=1, chair=None):
+        return self.repository.schedule(date, days, chair)
+
+
+class BillingService:
+    def __init__(self, repository, searches=None):
+        self.repository = repository
+        self.searches = searches
+
+    def add(self, patient_id, date, amount, description, wait=True):
+        return self.repository.add_bill(*validate_bill(patient_id, date, amount, description), wait=wait)
+
+    def update(self, bill_id, patient_id, date, amount, description, wait=True):
+        return self.repository.update_bill(bill_id, *validate_bill(patient_id, date, amount, description), wait=wait)
+
+    def delete(self, bill_id, wait=True):
+        return self.repository.delete_bill(bill_id, wait=wait)
+
+    def search(self, term):
+        if self.searches is None:
+            return self.repository.search_bills(term)
+        return self.searches.search(term)
+
+    def page(self, after_id=None, before_id=None, limit=100):
+        return self.repository.fetch_page('billing', after_id, before_id, limit)
+
+    def view(self, order_by='id', descending=False, **filters):
+        return self.repository.query('billing', order_by, descending, filters)
+
+
+# Reports, analytics and bulk import. Each call uses the calling thread's
+# pooled connection, so these are safe to run from a worker thread. The
+# report modules are imported on first use, keeping them out of startup.
+class ReportService:
+    def __init__(self, pool, repository=None):
+        self.pool = pool
+        self.repository = repository
+        self.snapshots = {}
+
+    # Columnar snapshot of billing or appointments for client-side filtering,
+    # sorting and grouping; built on first use and refreshed on every call.
+    def snapshot(self, table):
+        snapshot = self.snapshots.get(table)
+        if snapshot is None:
+            from snapshot import ColumnarSnapshot
+            snapshot = self.snapshots.setdefault(table, ColumnarSnapshot(self.pool, table, self.repository))
+        return snapshot.refresh()
+
+    def export(self, report, fmt='xlsx', path=None, progress=None):
+        from exporter import REPORTS, export_report
+        if report not in REPORTS:
+            raise ValueError("Unknown report: {}".format(report))
+        return export_report(self.pool.connection(), report, fmt, path, progress=progress)
+
+    def analyse(self, name, start=None, end=None):
+        from analytics import ANALYSES
+        if name not in ANALYSES:
+            raise ValueError("Unknown analysis: {}".format(name))
+        start = normalize_date(start) if start else None
+        end = normalize_date(end) if end else None
+        return ANALYSES[name](self.pool.connection(), start, end)
+
+    def export_rows(self, columns, rows, path):
+        from exporter import export_rows
+        return export_rows(columns, rows, path)
+
+    # Listeners hear of the import once, when it ends; the change feed skips
+    # the log entries it wrote
+    def import_file(self, table, path, reject_path=None, progress=None):
+        from importer import import_file
+        logged = self.repository.changes.own if self.repository is not None else None
+        try:
+            return import_file(self.pool.connection(), table, path, reject_path, progress=progress, logged=logged)
+        finally:
+            if self.repository is not None:
+                self.repository.notify(table)
+
+
+# Patient, appointment and bill writes go through a WriteQueue (group commit)
+# unless write_queue=False.
+class Clinic:
+    def __init__(self, pool=default_pool, cache=True, write_queue=True):
+        self.pool = pool
+        self.writes = WriteQueue(pool) if write_queue else None
+        self.repository = ClinicRepository(pool, self.writes)
+        self.changes = self.repository.changes
+        self.patient_cache = PatientCache(self.repository) if cache else None
+        self.users = UserService(self.repository)
+        self.patients = PatientService(self.repository, self.patient_cache, ChartCache(self.repository) if cache else None)
+        self.appointments = AppointmentService(self.repository, SearchCache(self.repository, 'appointments', self.repository.search_appointments) if cache else None)
+        self.billing = BillingService(self.repository, SearchCache(self.repository, 'billing', self.repository.search_bills) if cache else None)
+        self.reports = ReportService(pool, self.repository)
+
+    def setup(self):
+        upgrade(self.pool.connection())
+        return self
+
+    # Commit any queued writes and close the database connections
+    def close(self):
+        self.changes.stop()
+        if self.writes is not None:
+            self.writes.close()
+        self.pool.close_all()
+
+
+clinic = Clinic()
@@ -0,0 +1,370 @@
+import math
+import threading
+
+# Columnar Snapshot
+# An in-memory copy of the billing or appointments table held column by
+# column in NumPy arrays instead of as a list of row tuples. Integers and
+# amounts are fixed-width numbers, dates are datetime64[D] and text columns
+# (descriptions, times) are interned: each distinct string is stored once and
+# rows hold a 32-bit code. A million bills take about 37 MB this way against
+# roughly 290 MB as tuples from fetchall().
+# Filtering, sorting and grouping are vectorized over the whole table; only
+# the rows of the requested page are turned back into tuples.
+# The snapshot refreshes incrementally: refresh() appends rows with a higher
+# id than any loaded so far and re-reads rows the repository reported as
+# updated or deleted (see ClinicRepository.subscribe). A bulk change such as
+# an import triggers a full reload. Updates and deletes made by other
+# processes are picked up by the next reload().
+CHUNK_SIZE = 100000
+# Deleted rows are only masked out; the arrays are compacted once this share
+# of them is dead.
+COMPACT_RATIO = 0.25
+IN_CHUNK = 500
+
+# Table -> (column, kind) in ClinicRepository.COLUMNS order. Kinds are 'int',
+# 'float', 'date' and 'text'.
+TABLES = {
+    'billing': (('id', 'int'), ('patient_id', 'int'), ('date', 'date'), ('amount', 'float'), ('description', 'text')),
+    'appointments': (('id', 'int'), ('patient_id', 'int'), ('date', 'date'), ('time', 'text'), ('description', 'text'),
+                     ('duration', 'int'), ('chair', 'int')),
+}
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("Columnar snapshots require the 'numpy' package")
+    return numpy
+
+
+# Interned strings: code 0 is NULL, every other code is one distinct string
+class StringPool:
+    def __init__(self):
+        self.strings = [None]
+        self.codes = {None: 0}
+
+    def encode(self, values):
+        codes, strings = self.codes, self.strings
+        encoded = []
+        for value in values:
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(strings)
+                strings.append(value)
+            encoded.append(code)
+        return encoded
+
+    # Codes of the strings containing text, case-insensitively
+    def matching(self, text):
+        text = text.lower()
+        return [code for code, value in enumerate(self.strings) if value is not None and text in value.lower()]
+
+    # Sort rank of every code, so code arrays can be ordered alphabetically
+    def ranks(self, np):
+        order = sorted(range(len(self.strings)), key=lambda code: (self.strings[code] is not None, self.strings[code] or ''))
+        ranks = np.empty(len(order), dtype=np.int32)
+        ranks[order] = np.arange(len(order), dtype=np.int32)
+        return ranks
+
+    def nbytes(self):
+        return sum(len(value) for value in self.strings if value is not None) + 8 * len(self.strings)
+
+
+class Column:
+    def __init__(self, np, name, kind, pool=None):
+        self.np = np
+        self.name = name
+        self.kind = kind
+        self.pool = pool
+        self.dtype = {'int': np.int64, 'float': np.float64, 'date': 'datetime64[D]', 'text': np.int32}[kind]
+        self.data = np.empty(0, dtype=self.dtype)
+        self.size = 0
+
+    def encode(self, values):
+        np = self.np
+        if self.kind == 'text':
+            return np.array(self.pool.encode(values), dtype=np.int32)
+        if self.kind == 'date':
+            try:
+                return np.array(values, dtype='datetime64[D]')
+            except ValueError:
+                return np.array([_date_or_none(np, value) for value in values], dtype='datetime64[D]')
+        try:
+            return np.array(values, dtype=self.dtype)
+        except (TypeError, ValueError):
+            missing = 0 if self.kind == 'int' else math.nan
+            return np.array([missing if value is None else value for value in values], dtype=self.dtype)
+
+    def append(self, values):
+        values = self.encode(values)
+        needed = self.size + len(values)
+        if needed > len(self.data):
+            grown = self.np.empty(max(needed, len(self.data) * 2, 1024), dtype=self.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = values
+        self.size = needed
+
+    def set(self, index, value):
+        self.data[index] = self.encode([value])[0]
+
+    def values(self):
+        return self.data[:self.size]
+
+    # Python values for the given row indexes, NULLs as None
+    def decode(self, indexes):
+        np = self.np
+        data = self.values()[indexes]
+        if self.kind == 'text':
+            strings = self.pool.strings
+            return [strings[code] for code in data.tolist()]
+        if self.kind == 'date':
+            return [None if value == 'NaT' else value for value in np.datetime_as_string(data).tolist()]
+        if self.kind == 'float':
+            return [None if value != value else value for value in data.tolist()]
+        return [value or None for value in data.tolist()]
+
+    # Numeric keys that sort the column, NULLs first
+    def sort_keys(self):
+        data = self.values()
+        if self.kind == 'text':
+            return self.pool.ranks(self.np)[data]
+        if self.kind == 'date':
+            return data.view(self.np.int64)
+        if self.kind == 'float':
+            return self.np.nan_to_num(data, nan=-math.inf)
+        return data
+
+    def nbytes(self):
+        return self.data.nbytes
+
+
+# Row count and sum of values per distinct key. Keys in a narrow range
+# (interned codes, months, chairs) are counted directly by offset without
+# sorting; anything else goes through np.unique.
+def _group(np, keys, values):
+    integers = keys.view(np.int64) if keys.dtype.kind == 'M' else keys
+    if len(keys) and integers.dtype.kind in 'iu':
+        low, high = int(integers.min()), int(integers.max())
+        if high - low <= 4 * len(keys) + 1024:
+            offsets = integers - low
+            counts = np.bincount(offsets)
+            sums = np.bincount(offsets, weights=values) if values is not None else counts.astype(np.float64)
+            present = np.flatnonzero(counts)
+            return (present + low).astype(integers.dtype).view(keys.dtype), counts[present], sums[present]
+    groups, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(groups))
+    sums = np.bincount(inverse, weights=values, minlength=len(groups)) if values is not None else counts.astype(np.float64)
+    return groups, counts, sums
+
+
+def _date_or_none(np, value):
+    try:
+        return np.datetime64(value, 'D')
+    except (TypeError, ValueError):
+        return None
+
+
+class ColumnarSnapshot:
+    def __init__(self, pool, table, repository=None):
+        if table not in TABLES:
+            raise ValueError("No columnar snapshot for {}".format(table))
+        self.np = _numpy()
+        self.pool = pool
+        self.table = table
+        self.names = tuple(name for name, _ in TABLES[table])
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._changes = set()
+        self._reload = False
+        self._reset()
+        if repository is not None:
+            repository.subscribe(self._changed)
+
+    def _changed(self, table, row_id=None, row=None):
+        if table != self.table:
+            return
+        with self._lock:
+            if row_id is None:
+                self._reload = True
+            else:
+                self._changes.add(int(row_id))
+
+    def __len__(self):
+        return int(self.alive[:self.columns['id'].size].sum())
+
+    def _reset(self):
+        self.strings = StringPool()
+        self.columns = {name: Column(self.np, name, kind, self.strings) for name, kind in TABLES[self.table]}
+        self.alive = self.np.empty(0, dtype=bool)
+        self.last_id = 0
+
+    def reload(self):
+        with self._lock:
+            self._reset()
+            self._changes.clear()
+            self._reload = False
+            self._append(self.pool.connection().execute(self._select('WHERE id > 0 ORDER BY id')))
+            self._trim()
+            self.loaded = True
+        return self
+
+    def refresh(self):
+        with self._lock:
+            if self._reload or not self.loaded:
+                return self.reload()
+            changes = [row_id for row_id in self._changes if row_id <= self.last_id]
+            self._changes.clear()
+            conn = self.pool.connection()
+            self._apply(conn, changes)
+            self._append(conn.execute(self._select('WHERE id > ? ORDER BY id'), (self.last_id,)))
+            size = self.columns['id'].size
+            if size and size - int(self.alive[:size].sum()) > size * COMPACT_RATIO:
+                self._compact()
+        return self
+
+    def _select(self, where):
+        return 'SELECT {} FROM {} {}'.format(', '.join(self.names), self.table, where)
+
+    def _append(self, cursor):
+        np = self.np
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            for column, values in zip(self.columns.values(), zip(*rows)):
+                column.append(values)
+            size = self.columns['id'].size
+            if size > len(self.alive):
+                grown = np.zeros(max(size, len(self.alive) * 2, 1024), dtype=bool)
+                grown[:len(self.alive)] = self.alive
+                self.alive = grown
+            self.alive[size - len(rows):size] = True
+            self.last_id = rows[-1][0]
+
+    # Re-read updated rows in place and mask out deleted ones
+    def _apply(self, conn, changes):
+        ids = self.columns['id'].values()
+        for start in range(0, len(changes), IN_CHUNK):
+            chunk = changes[start:start + IN_CHUNK]
+            rows = {row[0]: row for row in conn.execute(
+                self._select('WHERE id IN ({})'.format(', '.join('?' * len(chunk)))), chunk)}
+            for row_id in chunk:
+                index = int(self.np.searchsorted(ids, row_id))
+                if index == len(ids) or ids[index] != row_id:
+                    continue
+                row = rows.get(row_id)
+                if row is None:
+                    self.alive[index] = False
+                else:
+                    for column, value in zip(self.columns.values(), row):
+                        column.set(index, value)
+                    self.alive[index] = True
+
+    def _compact(self):
+        keep = self.np.flatnonzero(self.alive[:self.columns['id'].size])
+        for column in self.columns.values():
+            column.data = column.values()[keep]
+            column.size = len(keep)
+        self.alive = self.np.ones(len(keep), dtype=bool)
+
+    # Drop the spare capacity left by growing the arrays during a load
+    def _trim(self):
+        size = self.columns['id'].size
+        for column in self.columns.values():
+            column.data = column.values().copy()
+        self.alive = self.alive[:size].copy()
+
+    # Boolean mask of the live rows matching every condition. Conditions are
+    # column=value for equality, column_from/column_to for an inclusive
+    # range, and text columns match a case-insensitive substring.
+    def filter(self, **conditions):
+        np = self.np
+        with self._lock:
+            size = self.columns['id'].size
+            mask = self.alive[:size].copy()
+            for key, value in conditions.items():
+                if value is None or value == '':
+                    continue
+                name, _, bound = key.rpartition('_') if key.endswith(('_from', '_to')) else (key, '', '')
+                if name not in self.columns:
+                    raise ValueError("Unknown column: {}".format(name))
+                column = self.columns[name]
+                data = column.values()
+                if column.kind == 'text':
+                    if bound:
+                        raise ValueError("Ranges are not supported on {}".format(name))
+                    mask &= np.isin(data, np.array(self.strings.matching(str(value)), dtype=np.int32))
+                    continue
+                if column.kind == 'date':
+                    value = np.datetime64(value, 'D')
+                elif column.kind == 'int':
+                    value = int(value)
+                else:
+                    value = float(value)
+                if bound == 'from':
+                    mask &= data >= value
+                elif bound == 'to':
+                    mask &= data <= value
+                else:
+                    mask &= data == value
+            return mask
+
+    # One page of rows as tuples, in table column order
+    def select(self, mask=None, order_by='id', descending=False, offset=0, limit=100):
+        np = self.np
+        with self._lock:
+            if mask is None:
+                mask = self.alive[:self.columns['id'].size]
+            if order_by not in self.columns:
+                raise ValueError("Unknown column: {}".format(order_by))
+            indexes = np.flatnonzero(mask)
+            keys = self.columns[order_by].sort_keys()[indexes]
+            if descending:
+                keys = -keys
+            ids = self.columns['id'].values()[indexes]
+            wanted = offset + limit
+            # Only the first offset + limit rows need to be fully sorted
+            if wanted < len(indexes) // 8:
+                part = np.argpartition(keys, wanted)[:wanted]
+                indexes, keys, ids = indexes[part], keys[part], ids[part]
+            order = np.lexsort((ids, keys))[offset:wanted]
+            page = indexes[order]
+            return list(zip(*(column.decode(page) for column in self.columns.values())))
+
+    # (group, rows, sum of value) per group, largest sum first. by may be any
+    # column, or 'month'/'year' to group the date column.
+    def aggregate(self, by, value='amount', mask=None, limit=None):
+        np = self.np
+        with self._lock:
+            if mask is None:
+                mask = self.alive[:self.columns['id'].size]
+            if by in ('month', 'year'):
+                keys = self.columns['date'].values()[mask].astype('datetime64[{}]'.format(by[0].upper()))
+                decode = lambda groups: [None if text == 'NaT' else text for text in np.datetime_as_string(groups).tolist()]
+            elif by in self.columns:
+                column = self.columns[by]
+                keys = column.values()[mask]
+                if column.kind == 'text':
+                    decode = lambda groups: [self.strings.strings[code] for code in groups.tolist()]
+                elif column.kind == 'date':
+                    decode = lambda groups: [None if text == 'NaT' else text for text in np.datetime_as_string(groups).tolist()]
+                else:
+                    decode = lambda groups: [group or None for group in groups.tolist()]
+            else:
+                raise ValueError("Unknown column: {}".format(by))
+            values = np.nan_to_num(self.columns[value].values()[mask].astype(np.float64)) if value else None
+            groups, counts, sums = _group(np, keys, values)
+            order = np.argsort(-sums, kind='stable')[:limit]
+            return list(zip(decode(groups[order]), counts[order].tolist(), np.round(sums[order], 2).tolist()))
+
+    def memory(self):
+        with self._lock:
+            columns = sum(column.nbytes() for column in self.columns.values())
+            return {
+                'rows': len(self),
+                'columns_bytes': columns + self.alive.nbytes,
+                'strings': len(self.strings.strings) - 1,
+                'strings_bytes': self.strings.nbytes(),
+            }
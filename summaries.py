@@ -0,0 +1,121 @@
+import sys
+import sqlite3
+
+# Billing Summary Tables
+# Revenue per day and per patient is maintained incrementally by triggers on
+# billing, so totals read O(days) or O(patients) rows instead of every bill.
+# Amounts are summed as integer cents so repeated adds and removes never drift;
+# a bill without an amount counts as zero.
+SUMMARY_TABLES = '''
+CREATE TABLE IF NOT EXISTS billing_daily (
+    day TEXT PRIMARY KEY,
+    bills INTEGER NOT NULL,
+    revenue_cents INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS billing_patient (
+    patient_id INTEGER PRIMARY KEY,
+    bills INTEGER NOT NULL,
+    revenue_cents INTEGER NOT NULL,
+    last_date TEXT
+);
+'''
+
+# Trigger bodies that add a bill to, or take it out of, the running totals
+ADD_BILL = '''
+    INSERT INTO billing_daily (day, bills, revenue_cents)
+    SELECT new.date, 1, CAST(ROUND(IFNULL(new.amount, 0) * 100) AS INTEGER) WHERE new.date IS NOT NULL
+    ON CONFLICT (day) DO UPDATE SET bills = bills + 1, revenue_cents = revenue_cents + excluded.revenue_cents;
+    INSERT INTO billing_patient (patient_id, bills, revenue_cents, last_date)
+    SELECT new.patient_id, 1, CAST(ROUND(IFNULL(new.amount, 0) * 100) AS INTEGER), new.date WHERE new.patient_id IS NOT NULL
+    ON CONFLICT (patient_id) DO UPDATE SET bills = bills + 1, revenue_cents = revenue_cents + excluded.revenue_cents,
+                                           last_date = CASE WHEN last_date IS NULL OR excluded.last_date > last_date
+                                                            THEN excluded.last_date ELSE last_date END;
+'''
+
+REMOVE_BILL = '''
+    UPDATE billing_daily SET bills = bills - 1, revenue_cents = revenue_cents - CAST(ROUND(IFNULL(old.amount, 0) * 100) AS INTEGER)
+    WHERE day IS old.date;
+    DELETE FROM billing_daily WHERE day IS old.date AND bills <= 0;
+    UPDATE billing_patient SET bills = bills - 1, revenue_cents = revenue_cents - CAST(ROUND(IFNULL(old.amount, 0) * 100) AS INTEGER),
+                               last_date = (SELECT MAX(date) FROM billing WHERE patient_id IS old.patient_id)
+    WHERE patient_id IS old.patient_id;
+    DELETE FROM billing_patient WHERE patient_id IS old.patient_id AND bills <= 0;
+'''
+
+SUMMARY_TRIGGERS = (
+    'CREATE TRIGGER IF NOT EXISTS billing_summary_ai AFTER INSERT ON billing BEGIN {} END'.format(ADD_BILL),
+    'CREATE TRIGGER IF NOT EXISTS billing_summary_ad AFTER DELETE ON billing BEGIN {} END'.format(REMOVE_BILL),
+    'CREATE TRIGGER IF NOT EXISTS billing_summary_au AFTER UPDATE OF patient_id, date, amount ON billing BEGIN {} {} END'.format(REMOVE_BILL, ADD_BILL),
+)
+
+DAILY_FROM_BILLING = '''SELECT date, COUNT(*), SUM(CAST(ROUND(IFNULL(amount, 0) * 100) AS INTEGER))
+                        FROM billing WHERE date IS NOT NULL GROUP BY date'''
+PATIENT_FROM_BILLING = '''SELECT patient_id, COUNT(*), SUM(CAST(ROUND(IFNULL(amount, 0) * 100) AS INTEGER)), MAX(date)
+                          FROM billing WHERE patient_id IS NOT NULL GROUP BY patient_id'''
+
+
+def create_summaries(conn):
+    for statement in SUMMARY_TABLES.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+    for trigger in SUMMARY_TRIGGERS:
+        conn.execute(trigger)
+    fill_summaries(conn)
+
+
+# Replaces triggers made before a bill without an amount counted as zero
+def replace_summary_triggers(conn):
+    for name in ('billing_summary_ai', 'billing_summary_ad', 'billing_summary_au'):
+        conn.execute('DROP TRIGGER IF EXISTS ' + name)
+    for trigger in SUMMARY_TRIGGERS:
+        conn.execute(trigger)
+    fill_summaries(conn)
+
+
+def fill_summaries(conn):
+    conn.execute('DELETE FROM billing_daily')
+    conn.execute('DELETE FROM billing_patient')
+    conn.execute('INSERT INTO billing_daily (day, bills, revenue_cents) ' + DAILY_FROM_BILLING)
+    conn.execute('INSERT INTO billing_patient (patient_id, bills, revenue_cents, last_date) ' + PATIENT_FROM_BILLING)
+
+
+def rebuild_summaries(conn):
+    with conn:
+        fill_summaries(conn)
+
+
+# Compares the summary tables with a fresh GROUP BY over billing and returns
+# one (table, key, expected, actual) tuple per row that differs.
+def check_summaries(conn):
+    problems = []
+    checks = (
+        ('billing_daily', DAILY_FROM_BILLING, 'SELECT day, bills, revenue_cents FROM billing_daily'),
+        ('billing_patient', PATIENT_FROM_BILLING, 'SELECT patient_id, bills, revenue_cents, last_date FROM billing_patient'),
+    )
+    for table, expected_query, actual_query in checks:
+        expected = {row[0]: tuple(row[1:]) for row in conn.execute(expected_query)}
+        actual = {row[0]: tuple(row[1:]) for row in conn.execute(actual_query)}
+        for key in expected.keys() | actual.keys():
+            if expected.get(key) != actual.get(key):
+                problems.append((table, key, expected.get(key), actual.get(key)))
+    return problems
+
+
+if __name__ == '__main__':
+    from database import DB_PATH
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    conn = sqlite3.connect(sys.argv[2] if len(sys.argv) > 2 else DB_PATH)
+    if command == 'rebuild':
+        rebuild_summaries(conn)
+        print('Billing summaries rebuilt')
+    elif command == 'check':
+        problems = check_summaries(conn)
+        for table, key, expected, actual in problems:
+            print('{} {}: expected {}, found {}'.format(table, key, expected, actual))
+        print('{} inconsistent summary rows'.format(len(problems)))
+        sys.exit(1 if problems else 0)
+    else:
+        print('Usage: python summaries.py [check|rebuild] [database]')
+        sys.exit(2)
+    conn.close()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import ConnectionPool  # noqa: E402
+from services import Clinic  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'dental_clinic.db')
+
+
+@pytest.fixture
+def pool(db_path):
+    pool = ConnectionPool(db_path)
+    yield pool
+    pool.close_all()
+
+
+# A migrated database behind the full service layer, write queue included
+@pytest.fixture
+def clinic(pool):
+    clinic = Clinic(pool).setup()
+    yield clinic
+    clinic.close()
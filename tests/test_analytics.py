@@ -0,0 +1,50 @@
+import pytest
+
+from analytics import ANALYSES, aging_summary, revenue_by_patient, revenue_by_period, top_procedures, totals
+
+
+@pytest.fixture
+def conn(clinic):
+    ann = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    bob = clinic.patients.add('Bob Ray', 40, 'Male', '555-0102')
+    clinic.billing.add(ann, '2024-01-10', 100, 'Cleaning')
+    clinic.billing.add(ann, '2024-02-20', 50.5, 'X-Ray')
+    clinic.billing.add(bob, '2024-02-21', 80, 'x-ray ')
+    conn = clinic.pool.connection()
+    # Older versions saved a bill without an amount
+    with conn:
+        conn.execute("INSERT INTO billing (patient_id, date, amount, description) VALUES (?, '2024-03-01', NULL, 'Extraction')", (bob,))
+    return conn
+
+
+def test_every_analysis_runs_with_a_bill_without_an_amount(conn):
+    for name, analysis in ANALYSES.items():
+        columns, rows = analysis(conn)
+        assert rows, name
+        assert all(len(row) == len(columns) for row in rows), name
+
+
+def test_revenue_by_period(conn):
+    assert revenue_by_period(conn, 'month')[1] == [('2024-01', 1, 100.0, 100.0), ('2024-02', 2, 130.5, 65.25), ('2024-03', 1, 0.0, 0.0)]
+    assert revenue_by_period(conn, 'year', '2024-02-01', '2024-02-28')[1] == [('2024', 2, 130.5, 65.25)]
+
+
+def test_revenue_by_patient_agrees_with_the_summary_tables(conn):
+    summary = revenue_by_patient(conn)[1]
+    assert summary == [(1, 'Ann Lee', 2, 150.5, 75.25, '2024-02-20'), (2, 'Bob Ray', 2, 80.0, 40.0, '2024-03-01')]
+    # A date range wide enough to hold every bill is computed from billing
+    assert revenue_by_patient(conn, '2000-01-01', '2099-12-31')[1] == summary
+
+
+def test_top_procedures_folds_spelling_variants(conn):
+    assert top_procedures(conn)[1] == [('X-Ray', 2, 130.5, 65.25), ('Cleaning', 1, 100.0, 100.0), ('Extraction', 1, 0.0, 0.0)]
+
+
+def test_aging_summary(conn):
+    assert aging_summary(conn, '2024-03-15')[1] == [(1, 'Ann Lee', 50.5, 0.0, 100.0, 0.0, 150.5),
+                                                    (2, 'Bob Ray', 80.0, 0.0, 0.0, 0.0, 80.0)]
+
+
+def test_totals(conn):
+    assert totals(conn)[1] == [(4, 2, 230.5, 57.62, '2024-01-10', '2024-03-01')]
+    assert totals(conn, '2024-02-01', '2024-02-28')[1] == [(2, 2, 130.5, 65.25, '2024-02-20', '2024-02-21')]
@@ -0,0 +1,95 @@
+from cache import MISSING, LRUCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is MISSING
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    # peek neither refreshes an entry nor counts as a lookup
+    assert cache.peek('a') == 1
+    cache.put('d', 4)
+    assert cache.get('a') is MISSING
+    stats = cache.stats()
+    assert (stats['size'], stats['evictions'], stats['hits'], stats['misses']) == (2, 2, 3, 2)
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = LRUCache(ttl=10, clock=clock)
+    cache.put('a', 1)
+    clock.now += 9.9
+    assert cache.get('a') == 1
+    clock.now += 0.1
+    assert cache.peek('a') is MISSING
+    assert cache.get('a') is MISSING
+    assert cache.stats()['expirations'] == 1
+    # Writing an entry again starts its ttl over
+    cache.put('a', 2)
+    clock.now += 5
+    assert cache.get('a') == 2
+
+
+def test_patient_writes_go_through_the_cache(clinic):
+    records = clinic.patient_cache.records
+    patient = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    # An added patient is cached from the write, without reading it back
+    assert clinic.patients.get(patient) == (patient, 'Ann Lee', 30, 'Female', '555-0101')
+    assert records.stats()['misses'] == 0
+
+    clinic.patients.update(patient, 'Ann Smith', 31, 'Female', '555-0101')
+    assert clinic.patients.get(patient) == (patient, 'Ann Smith', 31, 'Female', '555-0101')
+    assert records.stats()['misses'] == 0
+
+    clinic.patients.delete(patient)
+    assert clinic.patients.get(patient) is None
+
+
+def test_patient_cache_serves_until_expiry(clinic):
+    clock = Clock()
+    records = clinic.patient_cache.records
+    records.clock = clock
+    patient = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    # A write the repository does not see, as from an older client
+    with clinic.pool.connection() as conn:
+        conn.execute("UPDATE patients SET name = 'Ann Smith' WHERE id = ?", (patient,))
+    assert clinic.patients.get(patient)[1] == 'Ann Lee'
+    clock.now += records.ttl
+    assert clinic.patients.get(patient)[1] == 'Ann Smith'
+
+
+def test_records_are_bounded(clinic):
+    records = clinic.patient_cache.records
+    records.maxsize = 2
+    patients = [clinic.patients.add('Patient {}'.format(i), 30, 'Other', '555-0100') for i in range(3)]
+    assert len(records) == 2
+    assert [clinic.patients.get(patient)[1] for patient in patients] == ['Patient 0', 'Patient 1', 'Patient 2']
+    assert records.stats()['evictions'] >= 1
+
+
+def test_charts_follow_bill_and_patient_changes(clinic):
+    patient = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    assert clinic.patients.chart(patient).bills == []
+    assert clinic.patients.chart(patient) is clinic.patients.chart(patient)
+
+    bill = clinic.billing.add(patient, '2024-01-10', 40, 'Cleaning')
+    chart = clinic.patients.chart(patient)
+    assert [row[0] for row in chart.bills] == [bill] and chart.balance == 40
+
+    clinic.billing.update(bill, patient, '2024-01-10', 55, 'Cleaning')
+    assert clinic.patients.chart(patient).balance == 55
+    clinic.patients.update(patient, 'Ann Smith', 30, 'Female', '555-0101')
+    assert clinic.patients.chart(patient).patient[1] == 'Ann Smith'
+    clinic.billing.delete(bill)
+    assert clinic.patients.chart(patient).bills == []
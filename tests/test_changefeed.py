@@ -0,0 +1,72 @@
+import sqlite3
+
+import pytest
+
+from changefeed import TABLES
+
+
+# Another workstation sharing the database file
+@pytest.fixture
+def other(db_path):
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def changes(clinic):
+    changes = []
+    clinic.repository.subscribe(lambda table, row_id=None, row=None: changes.append((table, row_id, row)))
+    # The first poll only finds where the log ends
+    assert clinic.changes.poll() == 0
+    return changes
+
+
+def test_poll_reports_rows_written_by_another_connection(clinic, other, changes):
+    patient = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    assert clinic.patients.get(patient)[1] == 'Ann Lee'
+    del changes[:]
+    with other:
+        other.execute("UPDATE patients SET name = 'Ann Smith' WHERE id = ?", (patient,))
+        other.execute("INSERT INTO billing (patient_id, date, amount, description) VALUES (?, '2024-01-10', 40, 'Cleaning')", (patient,))
+
+    assert clinic.changes.poll() == 2
+    assert changes == [('patients', patient, (patient, 'Ann Smith', 30, 'Female', '555-0101')),
+                       ('billing', 1, (1, patient, '2024-01-10', 40.0, 'Cleaning'))]
+    # The patient cache was patched rather than left stale
+    assert clinic.patients.get(patient)[1] == 'Ann Smith'
+    assert clinic.changes.poll() == 0
+
+
+def test_poll_skips_writes_of_this_process(clinic, changes):
+    patient = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    clinic.billing.add(patient, '2024-01-10', 40, 'Cleaning')
+    assert len(changes) == 2
+    assert clinic.changes.poll() == 0
+    assert len(changes) == 2
+
+
+def test_poll_reports_deleted_rows_without_a_row(clinic, other, changes):
+    patient = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    del changes[:]
+    with other:
+        other.execute('DELETE FROM patients WHERE id = ?', (patient,))
+    assert clinic.changes.poll() == 1
+    assert changes == [('patients', patient, None)]
+
+
+def test_poll_reports_bulk_changes_as_the_whole_table(clinic, other, changes):
+    with other:
+        other.execute("INSERT INTO change_log (tbl, row_id) VALUES ('appointments', NULL)")
+        other.execute("INSERT INTO appointments (patient_id, date, time, description) VALUES (1, '2024-05-01', '10:00', 'Cleaning')")
+    assert clinic.changes.poll() == 1
+    assert changes == [('appointments', None, None)]
+
+
+def test_feed_behind_the_pruned_log_reports_every_table(clinic, other, changes):
+    with other:
+        for name in ('Ann Lee', 'Bob Ray'):
+            other.execute("INSERT INTO patients (name, age, gender, contact) VALUES (?, 30, 'Female', '555-0101')", (name,))
+        other.execute('DELETE FROM change_log WHERE seq = (SELECT MIN(seq) FROM change_log)')
+    assert clinic.changes.poll() == len(TABLES)
+    assert sorted(table for table, row_id, row in changes) == sorted(TABLES)
@@ -0,0 +1,123 @@
+import pytest
+
+import credentials
+from credentials import LoginLimiter, LoginLocked, SessionCache, hash_password, is_hashed, needs_rehash, verify_password
+from services import UserService
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def users(clinic, clock):
+    users = UserService(clinic.repository, LoginLimiter(max_failures=3, window=60, lockout=30, clock=clock), SessionCache(ttl=600, clock=clock))
+    users.add('ann', 'correct horse', 'user')
+    return users
+
+
+def test_hash_and_verify():
+    stored = hash_password('secret')
+    assert is_hashed(stored) and not needs_rehash(stored)
+    assert stored != hash_password('secret')
+    assert verify_password('secret', stored)
+    assert not verify_password('Secret', stored)
+    assert not verify_password('secret', 'secret')
+    assert not verify_password('secret', 'scrypt$not$a$valid$hash')
+
+
+def test_login_upgrades_a_cheaper_hash(clinic, users, monkeypatch):
+    monkeypatch.setattr(credentials, 'SCRYPT_N', 2 ** 10)
+    users.update(1, 'admin', 'admin', 'admin')
+    monkeypatch.undo()
+    assert needs_rehash(clinic.repository.get_credentials('admin')[1])
+    assert users.authenticate('admin', 'admin') == 'admin'
+    stored = clinic.repository.get_credentials('admin')[1]
+    assert not needs_rehash(stored) and verify_password('admin', stored)
+
+
+def test_lockout_after_repeated_failures(users, clock):
+    for attempt in range(3):
+        assert users.authenticate('ann', 'wrong') is None
+    # Locked out even with the right password, without checking it
+    with pytest.raises(LoginLocked) as locked:
+        users.authenticate('ann', 'correct horse')
+    assert locked.value.retry_after == 30
+    clock.now += 30
+    assert users.authenticate('ann', 'correct horse') == 'user'
+
+
+def test_unknown_usernames_are_locked_out_too(users):
+    for attempt in range(3):
+        assert users.authenticate('nobody', 'guess') is None
+    with pytest.raises(LoginLocked):
+        users.authenticate('nobody', 'guess')
+
+
+def test_success_resets_the_failure_count(users):
+    for attempt in range(2):
+        users.authenticate('ann', 'wrong')
+    assert users.authenticate('ann', 'correct horse') == 'user'
+    for attempt in range(2):
+        users.authenticate('ann', 'wrong')
+    assert users.authenticate('ann', 'correct horse') == 'user'
+
+
+def test_failures_outside_the_window_are_forgotten(users, clock):
+    for attempt in range(2):
+        users.authenticate('ann', 'wrong')
+    clock.now += 61
+    users.authenticate('ann', 'wrong')
+    assert users.authenticate('ann', 'correct horse') == 'user'
+
+
+def test_sessions_expire_and_can_be_revoked(users, clock):
+    token, role = users.login('ann', 'correct horse')
+    assert role == 'user' and users.session(token) == ('ann', 'user')
+    assert users.login('ann', 'wrong') is None
+    clock.now += 600
+    assert users.session(token) is None
+
+    token, role = users.login('ann', 'correct horse')
+    users.logout(token)
+    assert users.session(token) is None
+
+
+def test_cached_credentials_skip_the_hash(users, monkeypatch):
+    assert users.authenticate('ann', 'correct horse', cached=True) == 'user'
+    monkeypatch.setattr('services.verify_password', lambda password, stored: pytest.fail('password hashed again'))
+    assert users.authenticate('ann', 'correct horse', cached=True) == 'user'
+    # A different password is never served from the cache
+    with pytest.raises(pytest.fail.Exception):
+        users.authenticate('ann', 'wrong', cached=True)
+
+
+def test_user_changes_end_every_session(users):
+    token, _ = users.login('ann', 'correct horse')
+    users.authenticate('ann', 'correct horse', cached=True)
+    users.update(2, 'ann', 'new password', 'admin')
+    assert users.session(token) is None
+    assert users.authenticate('ann', 'correct horse', cached=True) is None
+    assert users.authenticate('ann', 'new password', cached=True) == 'admin'
+
+    token, _ = users.login('ann', 'new password')
+    users.delete(2)
+    assert users.session(token) is None
+    assert users.authenticate('ann', 'new password', cached=True) is None
+
+
+def test_credentials_must_be_text(users):
+    for username, password in ((1, 'x'), ('ann', None), ('ann', ['correct horse'])):
+        with pytest.raises(ValueError):
+            users.authenticate(username, password)
+    with pytest.raises(ValueError):
+        users.add('bob', 'pw', 'root')
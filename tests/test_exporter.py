@@ -0,0 +1,51 @@
+import csv
+
+import pytest
+
+from exporter import export_query, export_report
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+@pytest.fixture
+def conn(clinic):
+    clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    clinic.patients.add('Bob Ray', 40, 'Male', '555-0102')
+    conn = clinic.pool.connection()
+    # SQLite's type affinity let older versions store text in INTEGER columns
+    with conn:
+        conn.execute("INSERT INTO patients (name, age, gender, contact) VALUES ('Cy Dee', 'n/a', 'Other', '555-0103')")
+    return conn
+
+
+def test_csv_export(conn, tmp_path):
+    path = export_report(conn, 'patient', 'csv', str(tmp_path / 'patients.csv'), chunk_size=2)
+    with open(path, newline='', encoding='utf-8') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ['id', 'name', 'age', 'gender', 'contact']
+    assert [row[2] for row in rows[1:]] == ['30', '40', 'n/a']
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5000])
+def test_parquet_export_of_mistyped_rows(conn, tmp_path, chunk_size):
+    path = export_report(conn, 'patient', 'parquet', str(tmp_path / 'patients.parquet'), chunk_size=chunk_size)
+    table = pq.read_table(path)
+    assert str(table.schema.field('age').type) == 'string'
+    assert str(table.schema.field('id').type) == 'int64'
+    assert table.column('age').to_pylist() == ['30', '40', 'n/a']
+
+
+def test_parquet_export_keeps_declared_types(clinic, tmp_path):
+    patient = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    clinic.billing.add(patient, '2024-01-10', 100, 'Cleaning')
+    clinic.billing.add(patient, '2024-01-11', 20.5, 'X-Ray')
+    path = export_report(clinic.pool.connection(), 'financial', 'parquet', str(tmp_path / 'billing.parquet'), chunk_size=1)
+    table = pq.read_table(path)
+    assert [str(field.type) for field in table.schema] == ['int64', 'int64', 'string', 'double', 'string']
+    assert table.column('amount').to_pylist() == [100.0, 20.5]
+
+
+def test_parquet_writer_falls_back_when_the_first_chunk_is_mistyped(conn, tmp_path):
+    path = str(tmp_path / 'ages.parquet')
+    export_query(conn, 'SELECT age FROM patients ORDER BY id DESC', path, types={'age': 'INTEGER'})
+    assert pq.read_table(path).column('age').to_pylist() == ['n/a', '40', '30']
@@ -0,0 +1,83 @@
+import csv
+
+import pytest
+
+HEADER = ('patient_id', 'date', 'time', 'description', 'duration', 'chair')
+
+
+@pytest.fixture
+def patient(clinic):
+    return clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+def rejected_lines(result):
+    with open(result.reject_path, newline='', encoding='utf-8') as file:
+        return [int(row[0]) for row in list(csv.reader(file))[1:]]
+
+
+def test_import_rejects_invalid_rows(clinic, tmp_path):
+    path = write_csv(tmp_path / 'patients.csv', ('name', 'age', 'gender', 'contact'), [
+        ('Ann Lee', 30, 'Female', '555-0101'),
+        ('Bob Ray', 'old', 'Male', '555-0102'),
+        ('Cy Dee', 50, 'Robot', '555-0103'),
+        ('Di Fox', '25.7', 'Female', '555-0104'),
+    ])
+    result = clinic.reports.import_file('patients', path)
+    assert (result.imported, result.rejected) == (1, 3)
+    assert rejected_lines(result) == [3, 4, 5]
+    assert [row[1] for row in clinic.patients.search('ann')] == ['Ann Lee']
+
+
+def test_import_rejects_double_bookings(clinic, patient, tmp_path):
+    clinic.appointments.add(patient, '2024-05-01', '10:00', 'Checkup', 30, 1)
+    path = write_csv(tmp_path / 'appointments.csv', HEADER, [
+        (patient, '2024-05-01', '10:15', 'Clashes with a booking', 30, 1),   # line 2
+        (patient, '2024-05-01', '11:00', 'First in file', 60, 1),
+        (patient, '2024-05-01', '11:30', 'Clashes with line 3', 30, 1),
+        (patient, '2024-05-01', '10:45', 'Clashes with line 3', 30, 1),
+        (patient, '2024-05-01', '10:30', 'Fits between', 30, 1),
+        (patient, '2024-05-01', '11:30', 'Other chair', 30, 2),
+    ])
+    result = clinic.reports.import_file('appointments', path)
+    assert (result.imported, result.rejected) == (3, 3)
+    assert rejected_lines(result) == [2, 4, 5]
+    rows = clinic.appointments.view('date', chair=1).page()
+    assert [row[3] for row in rows] == ['10:00', '10:30', '11:00']
+
+
+def test_rejected_duplicate_id_does_not_block_later_rows(clinic, patient, tmp_path):
+    taken = clinic.appointments.add(patient, '2024-05-01', '09:00', 'Checkup', 30, 2)
+    path = write_csv(tmp_path / 'appointments.csv', ('id',) + HEADER, [
+        (taken, patient, '2024-05-02', '10:00', 'Duplicate id', 30, 1),
+        (1000, patient, '2024-05-02', '10:00', 'Same slot, new id', 30, 1),
+    ])
+    result = clinic.reports.import_file('appointments', path)
+    assert (result.imported, result.rejected) == (1, 1)
+    assert clinic.repository.get_rows('appointments', [1000])[1000][4] == 'Same slot, new id'
+
+
+def test_import_is_reported_once(clinic, patient, tmp_path):
+    heard = []
+    clinic.repository.subscribe(lambda table, row_id=None, row=None: heard.append((table, row_id)))
+    clinic.changes.poll()
+    path = write_csv(tmp_path / 'appointments.csv', HEADER, [(patient, '2024-05-01', '09:00', 'Checkup', 30, 1)])
+    clinic.reports.import_file('appointments', path)
+    assert clinic.changes.poll() == 0
+    assert heard == [('appointments', None)]
+
+
+def test_ages_must_be_whole_numbers(clinic):
+    # A spreadsheet cell can hold a whole number as a float
+    patient = clinic.patients.add('Ann Lee', 30.0, 'Female', '555-0101')
+    assert clinic.patients.get(patient)[2] == 30
+    for age in ('25.7', 25.7, '25.0', float('nan')):
+        with pytest.raises(ValueError):
+            clinic.patients.add('Bob Ray', age, 'Male', '555-0102')
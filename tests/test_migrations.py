@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from credentials import is_hashed
+from database import ClinicRepository, ConnectionPool
+from migrations import MIGRATIONS, current_version, upgrade
+from summaries import check_summaries
+
+LATEST = MIGRATIONS[-1][0]
+
+# The schema as the original application created it on every start, admin
+# row included (INSERT OR IGNORE without a unique index duplicated it)
+BASELINE_SCHEMA = '''
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL, password TEXT NOT NULL, role TEXT NOT NULL);
+CREATE TABLE patients (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, age INTEGER, gender TEXT, contact TEXT);
+CREATE TABLE appointments (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id INTEGER, date TEXT, time TEXT, description TEXT,
+                           FOREIGN KEY (patient_id) REFERENCES patients (id));
+CREATE TABLE billing (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id INTEGER, date TEXT, amount REAL, description TEXT,
+                      FOREIGN KEY (patient_id) REFERENCES patients (id));
+INSERT INTO users (username, password, role) VALUES ('admin', 'admin', 'admin');
+INSERT INTO users (username, password, role) VALUES ('admin', 'admin', 'admin');
+'''
+
+
+def test_upgrade_empty_database(db_path):
+    conn = sqlite3.connect(db_path)
+    assert upgrade(conn) == [name for _, name, _ in MIGRATIONS]
+    assert current_version(conn) == LATEST
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == LATEST
+    username, password, role = conn.execute('SELECT username, password, role FROM users').fetchone()
+    assert (username, role) == ('admin', 'admin')
+    assert is_hashed(password)
+    assert upgrade(conn) == []
+    conn.close()
+
+
+def test_upgrade_baseline_database(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO patients (name, age, gender, contact) VALUES ('John Smith', 42, 'Male', '555-0100')")
+    conn.execute("INSERT INTO appointments (patient_id, date, time, description) VALUES (1, '05-03-2024', '9:30', 'Checkup')")
+    conn.execute("INSERT INTO billing (patient_id, date, amount, description) VALUES (1, '05-03-2024', 120.5, 'Filling')")
+    # Older versions saved a bill without an amount
+    conn.execute("INSERT INTO billing (patient_id, date, amount, description) VALUES (1, '06-03-2024', NULL, 'Checkup')")
+    conn.commit()
+
+    assert len(upgrade(conn)) == LATEST
+    assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 1
+    assert conn.execute('SELECT date, time, duration, chair, end_ts - start_ts FROM appointments').fetchone() == ('2024-03-05', '09:30', 30, 1, 30)
+    assert conn.execute('SELECT date FROM billing ORDER BY id').fetchall() == [('2024-03-05',), ('2024-03-06',)]
+    assert conn.execute('SELECT day, bills, revenue_cents FROM billing_daily ORDER BY day').fetchall() == [('2024-03-05', 1, 12050), ('2024-03-06', 1, 0)]
+    assert check_summaries(conn) == []
+    conn.close()
+
+    pool = ConnectionPool(db_path)
+    repository = ClinicRepository(pool)
+    assert [row[0] for row in repository.search_patients('smi')] == [1]
+    assert [row[0] for row in repository.search_appointments('check')] == [1]
+    pool.close_all()
+
+
+def test_upgrade_records_user_version_of_older_databases(db_path):
+    conn = sqlite3.connect(db_path)
+    upgrade(conn)
+    # Databases migrated before user_version was kept have it at 0
+    conn.execute('PRAGMA user_version = 0')
+    assert upgrade(conn) == []
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == LATEST
+    conn.close()
+
+
+def test_failed_migration_rolls_back(db_path, monkeypatch):
+    def broken(conn):
+        conn.execute('CREATE TABLE half_done (id INTEGER)')
+        conn.execute('SELECT no_such_column FROM patients')
+
+    conn = sqlite3.connect(db_path)
+    upgrade(conn)
+    monkeypatch.setattr('migrations.MIGRATIONS', MIGRATIONS + [(LATEST + 1, 'broken', broken)])
+    with pytest.raises(sqlite3.OperationalError):
+        upgrade(conn)
+    assert current_version(conn) == LATEST
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    conn.close()
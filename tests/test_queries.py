@@ -0,0 +1,72 @@
+import pytest
+
+from queries import SORT_KEYS
+
+# Many ties on every sort key, and NULLs, which SQLite sorts first ascending
+# and last descending
+BILLS = [(patient, date, amount, description)
+         for patient in (1, 2, None)
+         for date in ('2024-01-01', '2024-01-02', None)
+         for amount, description in ((10.0, 'Cleaning'), (10.0, 'Filling'), (25.5, None), (None, 'Cleaning'))]
+
+
+@pytest.fixture
+def repository(clinic):
+    with clinic.pool.connection() as conn:
+        conn.executemany('INSERT INTO billing (patient_id, date, amount, description) VALUES (?, ?, ?, ?)', BILLS)
+    return clinic.repository
+
+
+def expected(repository, order_by, descending, where='', params=()):
+    direction = ' DESC' if descending else ''
+    keys = SORT_KEYS['billing'][order_by] + ('id',)
+    return repository.pool.fetchall('SELECT id, patient_id, date, amount, description FROM billing {} ORDER BY {}'.format(
+        where, ', '.join(key + direction for key in keys)), params)
+
+
+def walk_forward(query, limit):
+    rows = query.page(limit=limit)
+    while True:
+        page = query.page(after=rows[-1], limit=limit)
+        if not page:
+            return rows
+        rows += page
+
+
+def walk_back(query, last, limit):
+    rows = [last]
+    while True:
+        page = query.page(before=rows[0], limit=limit)
+        if not page:
+            return rows
+        rows = page + rows
+
+
+@pytest.mark.parametrize('order_by', sorted(SORT_KEYS['billing']))
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('limit', [1, 4, 7])
+def test_pages_cover_every_row_once_in_order(repository, order_by, descending, limit):
+    query = repository.query('billing', order_by, descending)
+    everything = expected(repository, order_by, descending)
+    forward = walk_forward(query, limit)
+    assert forward == everything
+    assert walk_back(query, forward[-1], limit) == everything
+    assert all(query.precedes(row, following) for row, following in zip(everything, everything[1:]))
+
+
+def test_filtered_pages(repository):
+    query = repository.query('billing', 'amount', True, {'patient_id': 2, 'date_from': '2024-01-02'})
+    everything = expected(repository, 'amount', True, 'WHERE patient_id = ? AND date >= ?', (2, '2024-01-02'))
+    assert len(everything) == 4
+    assert walk_forward(query, 3) == everything
+    assert query.contains(everything[0][0])
+    assert not query.contains(expected(repository, 'id', False)[0][0])
+
+
+def test_unknown_sort_or_filter_is_refused(repository):
+    with pytest.raises(ValueError):
+        repository.query('billing', 'contact')
+    with pytest.raises(ValueError):
+        repository.query('billing', 'id', filters={'colour': 'red'})
+    with pytest.raises(ValueError):
+        repository.query('billing', 'id', filters={'amount_from': 'lots'})
@@ -0,0 +1,43 @@
+import pytest
+
+from scheduling import SchedulingConflict
+
+
+@pytest.fixture
+def patient(clinic):
+    return clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+
+
+def test_overlap_on_the_same_chair_is_refused(clinic, patient):
+    booked = clinic.appointments.add(patient, '2024-05-01', '10:00', 'Checkup', 30, 1)
+    with pytest.raises(SchedulingConflict) as refused:
+        clinic.appointments.add(patient, '2024-05-01', '10:15', 'Filling', 30, 1)
+    assert [row[0] for row in refused.value.conflicts] == [booked]
+    # Earliest first, over every chair
+    assert refused.value.suggestions == [('2024-05-01', '10:15', 2), ('2024-05-01', '10:15', 3), ('2024-05-01', '10:30', 1)]
+
+
+@pytest.mark.parametrize('time, duration, chair', [
+    ('09:30', 30, 1),   # ends as the booking starts
+    ('10:30', 15, 1),   # starts as it ends
+    ('10:00', 30, 2),   # another chair
+])
+def test_adjacent_or_other_chair_is_allowed(clinic, patient, time, duration, chair):
+    clinic.appointments.add(patient, '2024-05-01', '10:00', 'Checkup', 30, 1)
+    clinic.appointments.add(patient, '2024-05-01', time, 'Filling', duration, chair)
+
+
+def test_long_booking_is_found_from_before_the_window(clinic, patient):
+    clinic.appointments.add(patient, '2024-05-01', '09:00', 'Implant', 240, 1)
+    with pytest.raises(SchedulingConflict):
+        clinic.appointments.add(patient, '2024-05-01', '12:45', 'Checkup', 15, 1)
+
+
+def test_moving_an_appointment_ignores_itself(clinic, patient):
+    booked = clinic.appointments.add(patient, '2024-05-01', '10:00', 'Checkup', 30, 1)
+    clinic.appointments.update(booked, patient, '2024-05-01', '10:15', 'Checkup', 30, 1)
+
+
+def test_free_slots_skip_bookings(clinic, patient):
+    clinic.appointments.add(patient, '2024-05-01', '09:00', 'Checkup', 60, 1)
+    assert clinic.appointments.free_slots('2024-05-01', '09:00', 30, chair=1) == [('2024-05-01', '09:00', 2), ('2024-05-01', '09:00', 3), ('2024-05-01', '10:00', 1)]
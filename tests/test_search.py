@@ -0,0 +1,59 @@
+import pytest
+
+PATIENTS = [
+    ('Sam Smith', 30, 'Male', '555-0101'),
+    ('Sally Smythe', 41, 'Female', '555-0102'),
+    ('John Smithers', 52, 'Male', '555-0103'),
+    ('Tom Brown', 63, 'Male', '555-0104'),
+]
+
+
+@pytest.fixture
+def clinic(clinic):
+    for patient in PATIENTS:
+        clinic.patients.add(*patient)
+    return clinic
+
+
+def ids(rows):
+    return sorted(row[0] for row in rows)
+
+
+def test_longer_terms_narrow_cached_results(clinic):
+    searches = clinic.patient_cache.searches
+    assert ids(clinic.patients.search('s')) == [1, 2, 3]
+    for term in ('sm', 'smi', 'SMITH', 'smith jo', 'sally'):
+        assert ids(clinic.patients.search(term)) == ids(clinic.repository.search_patients(term))
+    assert searches.narrowed == 5
+    assert ids(clinic.patients.search('smith')) == [1, 3]
+
+
+def test_write_clears_cached_results(clinic):
+    assert ids(clinic.patients.search('smi')) == [1, 3]
+    clinic.patients.add('Anna Smit', 25, 'Female', '555-0105')
+    assert ids(clinic.patients.search('smi')) == [1, 3, 5]
+    # Narrowing from the cleared results would have missed the new patient
+    assert ids(clinic.patients.search('smit')) == [1, 3, 5]
+    assert clinic.patient_cache.searches.narrowed == 1
+
+
+def test_incomplete_results_are_not_narrowed(clinic):
+    clinic.repository.search.limit = 2
+    assert len(clinic.patients.search('s')) == 2
+    assert ids(clinic.patients.search('smith')) == [1, 3]
+    assert clinic.patient_cache.searches.narrowed == 0
+
+
+def test_numeric_terms_do_not_narrow(clinic):
+    assert ids(clinic.patients.search('1')) == [1]
+    assert clinic.patients.search('12') == []
+    assert clinic.patient_cache.searches.narrowed == 0
+
+
+def test_appointment_searches_narrow(clinic):
+    clinic.appointments.add(1, '2024-05-01', '10:00', 'Cleaning')
+    clinic.appointments.add(2, '2024-05-01', '11:00', 'Crown fitting')
+    clinic.appointments.add(3, '2024-05-02', '10:00', 'Check-up')
+    assert ids(clinic.appointments.search('c')) == [1, 2, 3]
+    assert ids(clinic.appointments.search('cr')) == [2]
+    assert clinic.appointments.searches.narrowed == 1
@@ -0,0 +1,146 @@
+import asyncio
+import base64
+import http.client
+import json
+import socket
+import threading
+
+import pytest
+
+from server import ApiServer
+
+ADMIN = 'Basic ' + base64.b64encode(b'admin:admin').decode('ascii')
+
+
+# The server on an ephemeral port, its event loop on a background thread
+@pytest.fixture
+def server(clinic):
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(ApiServer(clinic, port=0, workers=2).start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server
+    asyncio.run_coroutine_threadsafe(shutdown(server), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+    loop.close()
+
+
+# Closes the server and, as asyncio.run() would, cancels the handlers of
+# connections still open
+async def shutdown(server):
+    await server.close()
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@pytest.fixture
+def api(server):
+    connection = http.client.HTTPConnection(server.host, server.port, timeout=10)
+
+    def request(method, path, body=None, authorization=ADMIN, raw=None):
+        headers = {'Authorization': authorization} if authorization else {}
+        if raw is None and body is not None:
+            raw = json.dumps(body)
+        if raw is not None:
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, raw, headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read()), response
+    yield request
+    connection.close()
+
+
+def read_response(file):
+    status = int(file.readline().split()[1])
+    headers = {}
+    for line in iter(file.readline, b'\r\n'):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(file.read(int(headers['content-length'])))
+
+
+def test_routing(api):
+    status, body, _ = api('GET', '/health', authorization=None)
+    assert status == 200 and body['status'] == 'ok'
+    status, body, _ = api('POST', '/patients', {'name': 'Ann Lee', 'age': 30, 'gender': 'Female', 'contact': '555-0101'})
+    assert (status, body) == (201, {'id': 1})
+    assert api('GET', '/patients/1')[:2] == (200, {'id': 1, 'name': 'Ann Lee', 'age': 30, 'gender': 'Female', 'contact': '555-0101'})
+    assert api('GET', '/patients/search?q=ann')[1][0]['id'] == 1
+    assert api('PUT', '/patients/1', {'name': 'Ann Smith', 'age': 31, 'gender': 'Female', 'contact': '555-0101'})[:2] == (200, {'id': 1})
+    assert [row['name'] for row in api('GET', '/patients?limit=10')[1]] == ['Ann Smith']
+    assert api('GET', '/patients/1/chart')[1]['patient']['name'] == 'Ann Smith'
+    assert api('DELETE', '/patients/1')[0] == 200
+    assert api('GET', '/patients/1')[0] == 404
+    assert api('GET', '/nowhere')[0] == 404
+    status, _, response = api('DELETE', '/health')
+    assert status == 405 and response.getheader('Allow') == 'GET'
+
+
+def test_session_tokens(api):
+    assert api('POST', '/login', {'username': 'admin', 'password': 'wrong'}, authorization=None)[0] == 401
+    status, body, _ = api('POST', '/login', {'username': 'admin', 'password': 'admin'}, authorization=None)
+    assert status == 200 and body['role'] == 'admin'
+    bearer = 'Bearer ' + body['token']
+    assert api('GET', '/patients', authorization=bearer)[0] == 200
+    assert api('POST', '/logout', authorization=bearer)[0] == 200
+    status, _, response = api('GET', '/patients', authorization=bearer)
+    assert status == 401 and response.getheader('WWW-Authenticate').startswith('Bearer')
+
+
+def test_authentication_and_roles(api):
+    status, _, response = api('GET', '/patients', authorization=None)
+    assert status == 401 and response.getheader('WWW-Authenticate').startswith('Basic')
+    assert api('GET', '/patients', authorization='Basic !!!')[0] == 401
+    assert api('GET', '/patients', authorization='Basic ' + base64.b64encode(b'admin:wrong').decode('ascii'))[0] == 401
+    assert api('POST', '/users', {'username': 'bob', 'password': 'pw', 'role': 'user'})[0] == 201
+    bob = 'Basic ' + base64.b64encode(b'bob:pw').decode('ascii')
+    assert api('GET', '/patients', authorization=bob)[0] == 200
+    assert api('GET', '/users', authorization=bob)[0] == 403
+
+
+def test_bad_requests(api):
+    assert api('POST', '/patients', raw='{not json')[:2] == (400, {'error': 'Request body must be JSON'})
+    assert api('POST', '/patients', raw='[1, 2]')[0] == 400
+    assert api('POST', '/patients', {'name': 'Ann Lee'})[:2] == (400, {'error': 'Missing fields: age, gender, contact'})
+    assert api('POST', '/patients', {'name': 'Ann Lee', 'age': 'old', 'gender': 'Female', 'contact': '555-0101'})[:2] == \
+        (400, {'error': 'Age must be a positive integer'})
+    assert api('GET', '/patients?limit=lots')[0] == 400
+    assert api('POST', '/login', {'username': 1, 'password': 2}, authorization=None)[0] == 400
+    assert api('POST', '/users', {'username': 'eve', 'password': 'pw', 'role': 'root'})[0] == 400
+
+
+def test_booking_conflict(api):
+    api('POST', '/patients', {'name': 'Ann Lee', 'age': 30, 'gender': 'Female', 'contact': '555-0101'})
+    booking = {'patient_id': 1, 'date': '2024-05-01', 'time': '10:00', 'description': 'Checkup', 'duration': 30, 'chair': 1}
+    assert api('POST', '/appointments', booking)[0] == 201
+    status, body, _ = api('POST', '/appointments', dict(booking, time='10:15'))
+    assert status == 409 and body['conflicts'][0]['id'] == 1 and body['suggestions']
+
+
+def test_pipelined_requests_are_answered_in_order(server):
+    patient = json.dumps({'name': 'Ann Lee', 'age': 30, 'gender': 'Female', 'contact': '555-0101'}).encode('utf-8')
+    head = 'Host: localhost\r\nAuthorization: {}\r\n'.format(ADMIN).encode('latin-1')
+    requests = (b'POST /patients HTTP/1.1\r\n' + head + b'Content-Length: ' + str(len(patient)).encode('ascii') + b'\r\n\r\n' + patient
+                + b'GET /patients/1 HTTP/1.1\r\n' + head + b'\r\n'
+                + b'GET /health HTTP/1.1\r\n\r\n'
+                + b'GET /patients HTTP/1.1\r\n' + head + b'Connection: close\r\n\r\n')
+    with socket.create_connection((server.host, server.port), timeout=10) as sock:
+        sock.sendall(requests)
+        file = sock.makefile('rb')
+        responses = [read_response(file) for _ in range(4)]
+        assert file.read() == b''
+    assert [status for status, body in responses] == [201, 200, 200, 200]
+    # The read after the write sees it
+    assert responses[1][1]['name'] == 'Ann Lee'
+    assert [row['id'] for row in responses[3][1]] == [1]
+
+
+def test_malformed_request_line(server):
+    with socket.create_connection((server.host, server.port), timeout=10) as sock:
+        sock.sendall(b'NONSENSE\r\n\r\n')
+        file = sock.makefile('rb')
+        assert read_response(file) == (400, {'error': 'Malformed request line'})
+        assert file.read() == b''
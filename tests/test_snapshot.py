@@ -0,0 +1,93 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from snapshot import ColumnarSnapshot  # noqa: E402
+
+BILLS = [
+    (1, '2024-01-10', 100.0, 'Cleaning'),
+    (1, '2024-01-25', 45.5, 'X-Ray'),
+    (2, '2024-02-03', 250.0, 'Crown'),
+    (2, '2024-02-14', 80.0, 'cleaning'),
+    (3, '2024-03-01', 60.25, 'Filling'),
+    (3, '2024-03-09', 30.0, 'X-Ray'),
+]
+
+
+@pytest.fixture
+def snapshot(clinic):
+    for bill in BILLS:
+        clinic.billing.add(*bill)
+    return ColumnarSnapshot(clinic.pool, 'billing', clinic.repository).reload()
+
+
+def sql(clinic, query, params=()):
+    return clinic.pool.fetchall(query, params)
+
+
+def everything(clinic):
+    return sql(clinic, 'SELECT id, patient_id, date, amount, description FROM billing ORDER BY id')
+
+
+def test_build_matches_the_table(clinic, snapshot):
+    assert len(snapshot) == len(BILLS)
+    assert snapshot.select(limit=100) == everything(clinic)
+    assert snapshot.memory()['strings'] == 5
+
+
+def test_aggregates_match_sql(clinic, snapshot):
+    assert snapshot.aggregate('description') == sql(clinic, '''SELECT description, COUNT(*), ROUND(SUM(amount), 2) FROM billing
+                                                               GROUP BY description ORDER BY SUM(amount) DESC''')
+    assert snapshot.aggregate('month') == sql(clinic, '''SELECT substr(date, 1, 7) AS month, COUNT(*), ROUND(SUM(amount), 2) FROM billing
+                                                         GROUP BY month ORDER BY SUM(amount) DESC''')
+    assert snapshot.aggregate('patient_id', limit=2) == sql(clinic, '''SELECT patient_id, COUNT(*), ROUND(SUM(amount), 2) FROM billing
+                                                                       GROUP BY patient_id ORDER BY SUM(amount) DESC LIMIT 2''')
+    mask = snapshot.filter(date_from='2024-02-01')
+    assert snapshot.aggregate('year', mask=mask) == [('2024', 4, 420.25)]
+
+
+def test_filter_and_sort_match_sql(clinic, snapshot):
+    mask = snapshot.filter(patient_id=2, date_to='2024-12-31', amount_from='50')
+    assert snapshot.select(mask, 'amount', True) == sql(clinic, '''SELECT id, patient_id, date, amount, description FROM billing
+                                                                   WHERE patient_id = 2 AND amount >= 50 ORDER BY amount DESC''')
+    # Text columns match a case-insensitive substring
+    mask = snapshot.filter(description='CLEAN')
+    assert snapshot.select(mask, 'date') == sql(clinic, '''SELECT id, patient_id, date, amount, description FROM billing
+                                                           WHERE description LIKE '%clean%' ORDER BY date''')
+    assert snapshot.select(order_by='description', offset=1, limit=2) == sql(clinic, '''SELECT id, patient_id, date, amount, description
+                                                                                       FROM billing ORDER BY description, id LIMIT 2 OFFSET 1''')
+    with pytest.raises(ValueError):
+        snapshot.filter(colour='red')
+    with pytest.raises(ValueError):
+        snapshot.filter(description_from='a')
+
+
+def test_refresh_applies_writes(clinic, snapshot):
+    added = clinic.billing.add(3, '2024-04-01', 99.0, 'Whitening')
+    clinic.billing.update(1, 1, '2024-01-10', 120.0, 'Cleaning')
+    clinic.billing.delete(2)
+    # Nothing changes until the next refresh
+    assert len(snapshot) == len(BILLS)
+    snapshot.refresh()
+    assert len(snapshot) == len(BILLS)
+    assert snapshot.select(limit=100) == everything(clinic)
+    assert added in [row[0] for row in snapshot.select(limit=100)]
+    assert snapshot.aggregate('description')[0] == ('Crown', 1, 250.0)
+
+
+def test_deletes_are_compacted(clinic, snapshot):
+    for bill_id in (1, 2, 3):
+        clinic.billing.delete(bill_id)
+    snapshot.refresh()
+    assert snapshot.columns['id'].size == 3
+    assert snapshot.select(limit=100) == everything(clinic)
+
+
+def test_bulk_change_reloads(clinic, snapshot):
+    # Also a bill without an amount, which sums as zero as in SQL
+    with clinic.pool.connection() as conn:
+        conn.execute("UPDATE billing SET amount = NULL WHERE id = 6")
+    clinic.repository.notify('billing')
+    snapshot.refresh()
+    assert snapshot.select(limit=100) == everything(clinic)
+    assert ('X-Ray', 2, 45.5) in snapshot.aggregate('description')
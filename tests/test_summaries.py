@@ -0,0 +1,47 @@
+from summaries import check_summaries, rebuild_summaries
+
+
+def test_triggers_keep_summaries_in_step(clinic):
+    patient = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    other = clinic.patients.add('Bob Ray', 40, 'Male', '555-0102')
+    first = clinic.billing.add(patient, '2024-01-10', 100.10, 'Cleaning')
+    second = clinic.billing.add(patient, '2024-01-12', 0.20, 'X-Ray')
+    clinic.billing.add(other, '2024-01-10', 50, 'Filling')
+    conn = clinic.pool.connection()
+    assert conn.execute("SELECT bills, revenue_cents FROM billing_daily WHERE day = '2024-01-10'").fetchone() == (2, 15010)
+    assert conn.execute('SELECT bills, revenue_cents, last_date FROM billing_patient WHERE patient_id = ?', (patient,)).fetchone() == (2, 10030, '2024-01-12')
+
+    # Moving a bill to another patient and day, then deleting one
+    clinic.billing.update(second, other, '2024-01-11', 0.30, 'X-Ray')
+    clinic.billing.delete(first)
+    assert conn.execute("SELECT day FROM billing_daily ORDER BY day").fetchall() == [('2024-01-10',), ('2024-01-11',)]
+    assert conn.execute('SELECT 1 FROM billing_patient WHERE patient_id = ?', (patient,)).fetchone() is None
+    assert conn.execute('SELECT bills, revenue_cents, last_date FROM billing_patient WHERE patient_id = ?', (other,)).fetchone() == (2, 5030, '2024-01-11')
+    assert check_summaries(conn) == []
+
+
+def test_check_finds_drift_and_rebuild_repairs_it(clinic):
+    patient = clinic.patients.add('Ann Lee', 30, 'Female', '555-0101')
+    clinic.billing.add(patient, '2024-01-10', 25, 'Cleaning')
+    conn = clinic.pool.connection()
+    with conn:
+        conn.execute('UPDATE billing_daily SET revenue_cents = 1')
+        conn.execute('DELETE FROM billing_patient')
+    problems = check_summaries(conn)
+    assert sorted(table for table, *_ in problems) == ['billing_daily', 'billing_patient']
+    assert ('billing_daily', '2024-01-10', (1, 2500), (1, 1)) in problems
+
+    rebuild_summaries(conn)
+    assert check_summaries(conn) == []
+
+
+def test_bill_without_amount_counts_as_zero(clinic):
+    conn = clinic.pool.connection()
+    with conn:
+        conn.execute("INSERT INTO billing (patient_id, date, amount, description) VALUES (7, '2024-01-10', NULL, 'Checkup')")
+        conn.execute("INSERT INTO billing (patient_id, date, amount, description) VALUES (7, '2024-01-10', 12.5, 'X-Ray')")
+    assert conn.execute('SELECT bills, revenue_cents FROM billing_patient WHERE patient_id = 7').fetchone() == (2, 1250)
+    with conn:
+        conn.execute('DELETE FROM billing WHERE amount IS NULL')
+    assert conn.execute("SELECT bills, revenue_cents FROM billing_daily WHERE day = '2024-01-10'").fetchone() == (1, 1250)
+    assert check_summaries(conn) == []
@@ -0,0 +1,98 @@
+import sqlite3
+import threading
+
+import pytest
+
+from writequeue import WriteQueue
+
+
+@pytest.fixture
+def writes(pool):
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, text TEXT NOT NULL UNIQUE)')
+    writes = WriteQueue(pool, durable=False)
+    yield writes
+    writes.close()
+
+
+def insert(text):
+    return lambda conn: conn.execute('INSERT INTO notes (text) VALUES (?)', (text,)).lastrowid
+
+
+# Holds the writer in its current batch until released, so everything
+# submitted meanwhile is committed together as the next batch
+def hold(writes):
+    held, release = threading.Event(), threading.Event()
+    writes.submit(lambda conn: held.set() or release.wait(5))
+    held.wait(5)
+    return release
+
+
+def notes(pool):
+    return [row[0] for row in pool.fetchall('SELECT text FROM notes ORDER BY id')]
+
+
+def test_writes_commit_in_order(pool, writes):
+    release = hold(writes)
+    futures = [writes.submit(insert('note {}'.format(i))) for i in range(5)]
+    release.set()
+    assert [future.result(5) for future in futures] == [1, 2, 3, 4, 5]
+    assert notes(pool) == ['note {}'.format(i) for i in range(5)]
+    assert writes.stats()['largest_batch'] == 5
+
+
+def test_failing_write_fails_alone(pool, writes):
+    release = hold(writes)
+    first = writes.submit(insert('first'))
+    duplicate = writes.submit(insert('first'))
+    last = writes.submit(insert('last'))
+    release.set()
+    assert first.result(5) == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        duplicate.result(5)
+    assert last.result(5) is not None
+    assert notes(pool) == ['first', 'last']
+    assert writes.stats()['failed'] == 1
+
+
+def test_failing_done_callback_fails_its_write(pool, writes):
+    def done(result):
+        raise RuntimeError('listener failed')
+    with pytest.raises(RuntimeError):
+        writes.submit(insert('first'), done).result(5)
+    # The write itself committed before done ran
+    assert notes(pool) == ['first']
+    assert writes.stats()['failed'] == 1
+
+
+class FailingCommit(sqlite3.Connection):
+    def commit(self):
+        raise sqlite3.OperationalError('disk I/O error')
+
+
+def test_failed_commit_fails_every_write(db_path, pool):
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, text TEXT NOT NULL UNIQUE)')
+
+    class FailingPool:
+        def connection(self):
+            return sqlite3.connect(db_path, factory=FailingCommit, check_same_thread=False)
+    writes = WriteQueue(FailingPool(), durable=False)
+    release = hold(writes)
+    futures = [writes.submit(insert(text)) for text in ('first', 'second')]
+    release.set()
+    for future in futures:
+        with pytest.raises(sqlite3.OperationalError):
+            future.result(5)
+    writes.close()
+    assert notes(pool) == []
+    assert writes.stats()['failed'] == 3
+
+
+def test_close_commits_pending_writes(pool, writes):
+    release = hold(writes)
+    futures = [writes.submit(insert(text)) for text in ('first', 'second')]
+    release.set()
+    writes.close()
+    assert all(future.done() for future in futures)
+    assert notes(pool) == ['first', 'second']
@@ -0,0 +1,100 @@
+import math
+from datetime import date as _date, datetime
+from scheduling import DEFAULT_DURATION, validate_chair, validate_duration
+
+# Input Validation
+DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y')
+TIME_FORMATS = ('%H:%M', '%H:%M:%S')
+GENDERS = ('male', 'female', 'other')
+ROLES = ('admin', 'user')
+
+
+# Dates are stored as YYYY-MM-DD so they sort, range-scan and group correctly.
+# DD-MM-YYYY is still accepted on input.
+def normalize_date(date):
+    if isinstance(date, _date):
+        return date.strftime('%Y-%m-%d')
+    date = str(date).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(date, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    raise ValueError("Date must be in YYYY-MM-DD or DD-MM-YYYY format")
+
+
+def normalize_time(time):
+    time = str(time).strip()
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(time, fmt).strftime('%H:%M')
+        except ValueError:
+            pass
+    raise ValueError("Time must be in HH:MM format")
+
+
+def _required(*values):
+    if any(value is None or str(value).strip() == '' for value in values):
+        raise ValueError("All fields are required")
+
+
+def validate_patient_id(patient_id):
+    try:
+        patient_id = int(str(patient_id).strip())
+    except ValueError:
+        raise ValueError("Patient ID must be a number")
+    if patient_id <= 0:
+        raise ValueError("Patient ID must be a positive number")
+    return patient_id
+
+
+# Usernames and passwords must be text; anything else, such as a number in a
+# JSON body, is refused before it reaches the password hash
+def validate_credentials(username, password):
+    if not isinstance(username, str) or not isinstance(password, str):
+        raise ValueError("Username and password must be text")
+    return username, password
+
+
+def validate_user(username, password, role):
+    validate_credentials(username, password)
+    _required(username, password, role)
+    if str(role).strip().lower() not in ROLES:
+        raise ValueError("Role must be 'admin' or 'user'")
+    return username, password, str(role).strip().lower()
+
+
+# The record validators are shared by the entry forms and the bulk importer.
+# Each returns the cleaned values in column order or raises ValueError.
+def validate_patient(name, age, gender, contact):
+    _required(name, age, gender, contact)
+    # A whole-number float, as a spreadsheet cell can hold, is an integer too
+    if isinstance(age, float) and age.is_integer():
+        age = int(age)
+    try:
+        age = int(str(age).strip())
+    except ValueError:
+        raise ValueError("Age must be a positive integer")
+    if age <= 0:
+        raise ValueError("Age must be a positive integer")
+    if str(gender).strip().lower() not in GENDERS:
+        raise ValueError("Gender must be 'Male', 'Female', or 'Other'")
+    return str(name).strip(), age, str(gender).strip(), str(contact).strip()
+
+
+def validate_appointment(patient_id, date, time, description, duration=DEFAULT_DURATION, chair=1):
+    _required(patient_id, date, time, description)
+    return (validate_patient_id(patient_id), normalize_date(date), normalize_time(time), str(description).strip(),
+            validate_duration(duration if duration not in (None, '') else DEFAULT_DURATION),
+            validate_chair(chair if chair not in (None, '') else 1))
+
+
+def validate_bill(patient_id, date, amount, description):
+    _required(patient_id, date, amount, description)
+    try:
+        amount = float(str(amount).strip())
+    except ValueError:
+        raise ValueError("Amount must be a positive number")
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("Amount must be a positive number")
+    return validate_patient_id(patient_id), normalize_date(date), amount, str(description).strip()
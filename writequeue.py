@@ -0,0 +1,163 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from instrumentation import metrics
+
+# Write Queue
+# Inserts, updates and deletes from every thread are handed to one writer
+# thread, which applies them in the order they were submitted and commits
+# them together: group commit. Whenever the writer is free it takes every
+# write waiting in the queue, up to max_batch and for at most max_delay
+# seconds, and commits them as one transaction; writes submitted meanwhile
+# wait for the next one. A lone write is committed straight away, and a burst
+# of them shares one transaction and one fsync. linger > 0 also waits that
+# long for more writes after the queue runs dry, trading latency for bigger
+# batches.
+#
+# Guarantees:
+# * Ordering: writes are applied and their futures resolved in submission
+#   order, so a write sees the effect of every write submitted before it.
+# * Durability: a future resolves only after the transaction holding its
+#   write has committed, and the writer's connection uses synchronous=FULL,
+#   so a resolved write survives a power cut. The fsync is shared by the batch.
+# * Isolation: a write that raises is rolled back alone and its future gets
+#   the exception; the rest of the batch commits. The batch is first run as
+#   plain statements, and only when a write fails is it run again with a
+#   savepoint around each write. If the commit itself fails, every write in
+#   the batch fails.
+#
+# Batch sizes, commit times and the time from submit to commit are recorded
+# under 'write queue' in the instrumentation metrics.
+MAX_DELAY = 0.05
+LINGER = 0
+MAX_BATCH = 1000
+
+
+class WriteQueue:
+    def __init__(self, pool, max_delay=MAX_DELAY, linger=LINGER, max_batch=MAX_BATCH, durable=True):
+        self.pool = pool
+        self.max_delay = max_delay
+        self.linger = linger
+        self.max_batch = max_batch
+        self.durable = durable
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.writes = 0
+        self.failed = 0
+        self.largest_batch = 0
+
+    # Queue fn(conn) to run inside a write transaction. Returns a Future for
+    # its result; done(result), if given, is called on the writer thread once
+    # the write has committed and before the future resolves.
+    def submit(self, fn, done=None):
+        future = Future()
+        self._start()
+        self._queue.put((fn, done, future, time.perf_counter()))
+        return future
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='dcms-writer', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+
+    def _run(self):
+        conn = self.pool.connection()
+        if self.durable:
+            conn.execute('PRAGMA synchronous = FULL')
+        while True:
+            batch = self._collect()
+            writes = [item for item in batch if item is not None]
+            if writes:
+                self._commit(conn, writes)
+            if len(writes) < len(batch):
+                return
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = time.perf_counter() + self.max_delay
+        while first is not None and len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=min(self.linger, remaining)) if self.linger else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is None:
+                break
+        return batch
+
+    def _commit(self, conn, writes):
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                results = [(fn(conn), None) for fn, done, future, submitted in writes]
+            except Exception:
+                conn.rollback()
+                conn.execute('BEGIN IMMEDIATE')
+                results = [self._isolated(conn, fn) for fn, done, future, submitted in writes]
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(None, e)] * len(writes)
+        committed = time.perf_counter()
+        metrics.record('write queue', 'batch size', len(writes))
+        metrics.record('write queue', 'commit', (committed - started) * 1000, len(writes))
+        with self._lock:
+            self.batches += 1
+            self.writes += len(writes)
+            self.largest_batch = max(self.largest_batch, len(writes))
+        for (fn, done, future, submitted), (result, error) in zip(writes, results):
+            if error is None and done is not None:
+                try:
+                    done(result)
+                except Exception as e:
+                    error = e
+            metrics.record('write queue', 'latency', (committed - submitted) * 1000)
+            if error is None:
+                future.set_result(result)
+            else:
+                with self._lock:
+                    self.failed += 1
+                future.set_exception(error)
+
+    @staticmethod
+    def _isolated(conn, fn):
+        conn.execute('SAVEPOINT write')
+        try:
+            result = fn(conn)
+        except Exception as e:
+            conn.execute('ROLLBACK TO write')
+            conn.execute('RELEASE write')
+            return None, e
+        conn.execute('RELEASE write')
+        return result, None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'batches': self.batches,
+                'writes': self.writes,
+                'failed': self.failed,
+                'largest_batch': self.largest_batch,
+            }
+
+    # Commit everything already submitted and stop the writer
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()